@@ -0,0 +1,144 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Scene.SceneNode import SceneNode
+
+import numpy
+
+##  Finds free spots on the build plate to place objects in.
+#
+#   The build plate is rasterised into a grid of cells that are either free or
+#   occupied. Disallowed areas and the hulls of objects that are already placed
+#   occupy cells. To place a hull, its bounding box is grown by a bit of spacing
+#   and the first spot where all cells under that box are free is used, filling
+#   the build plate from the front left corner. Whether the cells under a box
+#   are free is looked up in an integral image of the grid, so all possible
+#   spots are tested at once.
+class Arrange:
+    ##  Creates a new, empty build plate.
+    #
+    #   \param width The width of the build plate, in mm.
+    #   \param depth The depth of the build plate, in mm.
+    #   \param resolution The size of a cell of the grid, in mm.
+    #   \param spacing The minimum distance between two hulls, in mm.
+    def __init__(self, width, depth, resolution = 1.0, spacing = 1.0):
+        self._resolution = resolution
+        self._spacing_cells = int(numpy.ceil(spacing / resolution))
+        self._min_x = -width / 2
+        self._min_z = -depth / 2
+        self._occupied = numpy.zeros((max(1, int(depth / resolution)), max(1, int(width / resolution))), numpy.bool_) # Rows are z, columns are x.
+        self._integral = None # Integral image of the occupied cells, computed when it is needed.
+
+    ##  Create an arranger for the build plate of the current scene.
+    #
+    #   \param scene_root The root of the scene.
+    #   \param width The width of the build plate, in mm.
+    #   \param depth The depth of the build plate, in mm.
+    #   \param disallowed_areas List of Polygons where nothing may be placed.
+    #   \param exclude Nodes that are going to be arranged, so they should not
+    #   occupy the build plate.
+    @classmethod
+    def create(cls, scene_root, width, depth, disallowed_areas, exclude = ()):
+        arrange = cls(width, depth)
+        for area in disallowed_areas:
+            arrange.occupy(area.getPoints())
+        for node in scene_root.getChildren():
+            if type(node) is not SceneNode or node in exclude:
+                continue
+            hull = getArrangeHull(node)
+            if hull is not None:
+                arrange.occupy(hull.getPoints())
+        return arrange
+
+    ##  Mark the cells under a polygon as occupied.
+    #
+    #   \param points The points of the polygon on the build plate, as an array
+    #   of shape (n, 2).
+    def occupy(self, points):
+        points = numpy.asarray(points, numpy.float64)
+        if len(points) < 3:
+            return
+
+        # Only look at the cells within the bounding box of the polygon.
+        min_column, min_row = self._toCell(points.min(axis = 0), numpy.floor)
+        max_column, max_row = self._toCell(points.max(axis = 0), numpy.ceil)
+        min_column, max_column = max(min_column, 0), min(max_column, self._occupied.shape[1])
+        min_row, max_row = max(min_row, 0), min(max_row, self._occupied.shape[0])
+        if min_column >= max_column or min_row >= max_row:
+            return
+
+        # Even-odd test of the centres of the cells against every edge of the polygon.
+        x = self._min_x + (numpy.arange(min_column, max_column) + 0.5) * self._resolution
+        z = self._min_z + (numpy.arange(min_row, max_row) + 0.5) * self._resolution
+        x, z = numpy.meshgrid(x, z)
+        inside = numpy.zeros(x.shape, numpy.bool_)
+        for (x1, z1), (x2, z2) in zip(points, numpy.roll(points, -1, axis = 0)):
+            if z1 == z2:
+                continue
+            crosses = (z1 > z) != (z2 > z)
+            crosses &= x < (x2 - x1) * (z - z1) / (z2 - z1) + x1
+            inside ^= crosses
+
+        self._occupied[min_row:max_row, min_column:max_column] |= inside
+        self._integral = None
+
+    ##  Find a free spot for a hull.
+    #
+    #   \param points The points of the hull, relative to the position of its
+    #   node, as an array of shape (n, 2).
+    #   \return The x and z position to move the node to, or None if there is
+    #   no free spot left.
+    def findPosition(self, points):
+        points = numpy.asarray(points, numpy.float64)
+        hull_min = points.min(axis = 0)
+        size = points.max(axis = 0) - hull_min
+        columns = int(numpy.ceil(size[0] / self._resolution)) + 2 * self._spacing_cells
+        rows = int(numpy.ceil(size[1] / self._resolution)) + 2 * self._spacing_cells
+        grid_rows, grid_columns = self._occupied.shape
+        if columns > grid_columns or rows > grid_rows:
+            return None
+
+        if self._integral is None:
+            self._integral = numpy.zeros((grid_rows + 1, grid_columns + 1), numpy.int32)
+            numpy.cumsum(numpy.cumsum(self._occupied, axis = 0), axis = 1, out = self._integral[1:, 1:])
+
+        # Number of occupied cells under the box, for every spot the box can be placed at.
+        integral = self._integral
+        occupied = integral[rows:, columns:] - integral[:-rows, columns:] - integral[rows:, :-columns] + integral[:-rows, :-columns]
+        free_rows, free_columns = numpy.nonzero(occupied == 0)
+        if len(free_rows) == 0:
+            return None
+
+        # Fill from the front (highest z) and from the left.
+        best = numpy.lexsort((free_columns, -free_rows))[0]
+        row, column = free_rows[best] + self._spacing_cells, free_columns[best] + self._spacing_cells
+        x = self._min_x + column * self._resolution - hull_min[0]
+        z = self._min_z + row * self._resolution - hull_min[1]
+        return float(x), float(z)
+
+    ##  Find a free spot for a hull and mark it as occupied.
+    #
+    #   \param points The points of the hull, relative to the position of its
+    #   node, as an array of shape (n, 2).
+    #   \return The x and z position to move the node to, or None if there is
+    #   no free spot left.
+    def place(self, points):
+        position = self.findPosition(points)
+        if position is not None:
+            self.occupy(numpy.asarray(points, numpy.float64) + position)
+        return position
+
+    def _toCell(self, point, rounding):
+        return int(rounding((point[0] - self._min_x) / self._resolution)), int(rounding((point[1] - self._min_z) / self._resolution))
+
+
+##  Get the hull of a node that should be kept free of other nodes.
+#
+#   This includes the print head when printing one at a time.
+#
+#   \return The Polygon of the hull, or None if the hull is not known yet.
+def getArrangeHull(node):
+    hull = node.callDecoration("getConvexHullHead")
+    if hull is None or len(hull.getPoints()) < 3:
+        return None
+    return hull
@@ -0,0 +1,79 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+##  Broad phase of the collision detection between the convex hulls of nodes.
+#
+#   Every node is tracked with the axis-aligned bounding box of its hull on
+#   the build plate. Only pairs of nodes whose boxes overlap can have hulls
+#   that overlap, so the expensive polygon tests only need to be done for
+#   those pairs.
+#
+#   The pairs are found by sort and sweep: the nodes are kept sorted by the
+#   left side of their box, and a sweep from left to right only compares the
+#   nodes whose boxes overlap in that direction. Since nodes move only a bit
+#   between two updates, the order hardly changes and sorting it again is
+#   close to linear.
+class ConvexHullBroadPhase:
+    def __init__(self):
+        self._boxes = {} # Node -> (min x, min y, max x, max y) of its hull.
+        self._hulls = {} # Node -> the hull that its box was computed from.
+        self._order = [] # The nodes, sorted by the min x of their boxes.
+
+    ##  Add a node or update its hull.
+    #
+    #   The box is only computed again if the hull changed since the last
+    #   update of the node.
+    #
+    #   \param node The node.
+    #   \param hull The Polygon that contains everything of the node that can
+    #   collide.
+    def update(self, node, hull):
+        if self._hulls.get(node) is hull:
+            return
+
+        points = hull.getPoints()
+        if node not in self._boxes:
+            self._order.append(node)
+        self._boxes[node] = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+        self._hulls[node] = hull
+
+    ##  Stop tracking a node.
+    def remove(self, node):
+        if node in self._boxes:
+            del self._boxes[node]
+            del self._hulls[node]
+            self._order.remove(node)
+
+    ##  Stop tracking all nodes that are not in a collection of nodes.
+    #
+    #   \param nodes The nodes to keep.
+    def retain(self, nodes):
+        removed = [node for node in self._boxes if node not in nodes]
+        for node in removed:
+            del self._boxes[node]
+            del self._hulls[node]
+        if removed:
+            self._order = [node for node in self._order if node in self._boxes]
+
+    def __contains__(self, node):
+        return node in self._boxes
+
+    ##  Get the pairs of nodes whose boxes overlap.
+    #
+    #   \return A list of (node, other node) tuples. Every pair is in the list
+    #   once.
+    def getCandidatePairs(self):
+        boxes = self._boxes
+        self._order.sort(key = lambda node: boxes[node][0])
+
+        pairs = []
+        active = [] # Nodes whose boxes may still overlap the next box in the x direction.
+        for node in self._order:
+            min_x, min_y, max_x, max_y = boxes[node]
+            active = [other for other in active if boxes[other][2] >= min_x]
+            for other in active:
+                other_box = boxes[other]
+                if other_box[1] <= max_y and other_box[3] >= min_y:
+                    pairs.append((other, node))
+            active.append(node)
+        return pairs
@@ -1,5 +1,8 @@
 from UM.Scene.SceneNodeDecorator import SceneNodeDecorator
 from UM.Application import Application
+from UM.Math.Polygon import Polygon
+
+import numpy
 
 
 ##  The convex hull decorator is a scene node decorator that adds the convex hull functionality to a scene node.
@@ -24,6 +27,14 @@ class ConvexHullDecorator(SceneNodeDecorator):
         self._convex_hull_node = None
         self._convex_hull_job = None
 
+        # The hulls relative to the position of the node, and the transformation they are valid for.
+        # As long as only the position of the node changes, the hulls can be moved along with the node.
+        self._local_hulls = None
+        self._hull_transformation_key = None
+
+        # The boundary and full head hulls that the hit shapes were made of, and the hit shapes.
+        self._hit_shapes = None
+
         # Keep track of the previous parent so we can clear its convex hull when the object is reparented
         self._parent_node = None
 
@@ -68,6 +79,21 @@ class ConvexHullDecorator(SceneNodeDecorator):
             return self.getConvexHull()
         return self._convex_hull_boundary
 
+    ##  Get the shapes that OneAtATimeIterator tests for hits between nodes.
+    #
+    #   The shapes are made when they are first asked for, and kept until the
+    #   boundary or the full head hull changes.
+    #
+    #   \return A tuple of the shapes of the boundary and of the full head
+    #   hull. Each shape is a tuple of the points of the hull and the normals
+    #   of its edges, as arrays of shape (n, 2).
+    def getConvexHullHitShapes(self):
+        boundary = self.getConvexHullBoundary()
+        head_full = self.getConvexHullHeadFull()
+        if self._hit_shapes is None or self._hit_shapes[0] is not boundary or self._hit_shapes[1] is not head_full:
+            self._hit_shapes = (boundary, head_full, (_createHitShape(boundary), _createHitShape(head_full)))
+        return self._hit_shapes[2]
+
     def setConvexHullBoundary(self, hull):
         self._convex_hull_boundary = hull
 
@@ -79,10 +105,84 @@ class ConvexHullDecorator(SceneNodeDecorator):
 
     def setConvexHull(self, hull):
         self._convex_hull = hull
+        if not hull:
+            self._local_hulls = None
+            self._hull_transformation_key = None
         if not hull and self._convex_hull_node:
             self._convex_hull_node.setParent(None)
             self._convex_hull_node = None
 
+    ##  Get the transformation of the node that hulls are computed for.
+    #
+    #   The result is to be passed to setConvexHullTransformation() when the
+    #   hulls are set.
+    #
+    #   \param world_transformation The world transformation of the node to use,
+    #   or None to use the current one. A job that computes the hulls on another
+    #   thread passes the transformation that it transforms the mesh with, so
+    #   that moving the node in the meantime can't make them differ.
+    #   \return A tuple of the key of everything but the horizontal position of
+    #   the node that the hulls depend on, and its position on the build plate.
+    def getConvexHullTransformation(self, world_transformation = None):
+        node = self.getNode()
+        if world_transformation is None:
+            world_transformation = node.getWorldTransformation()
+
+        # Anything but moving over the build plate changes the hull: the parts below the
+        # build plate are left out, so even moving the node up or down changes it.
+        matrix = world_transformation.getData().copy()
+        position = numpy.array([matrix[0, 3], matrix[2, 3]])
+        matrix[0, 3] = 0
+        matrix[2, 3] = 0
+        key = [matrix.tobytes()]
+
+        # The hull of a group is made from the hulls of its children, so a child that
+        # moves within its group needs a new hull.
+        parent = node.getParent()
+        if parent and parent.callDecoration("isGroup"):
+            key.append(node.getLocalTransformation().getData().tobytes())
+
+        # The hulls of objects that are printed one at a time include the print head.
+        key.append(Application.getInstance().getPrintHeadPolygons().getGeneration())
+
+        return (node.getMeshData(), tuple(key)), position
+
+    ##  Indicate for which transformation the hulls of the node were computed.
+    #
+    #   This stores the hulls relative to the position of the node, so that
+    #   translateConvexHull() can move them along with the node.
+    #
+    #   \param transformation The transformation from getConvexHullTransformation()
+    #   at the time the hulls were computed.
+    def setConvexHullTransformation(self, transformation):
+        key, position = transformation
+        self._hull_transformation_key = key
+        self._local_hulls = {}
+        for name in ("_convex_hull", "_convex_hull_boundary", "_convex_hull_head", "_convex_hull_head_full"):
+            hull = getattr(self, name)
+            if hull is not None:
+                self._local_hulls[name] = hull.getPoints() - position
+
+    ##  Move the hulls to the current position of the node.
+    #
+    #   This only works if the node was not rotated, scaled or moved up or down
+    #   since the hulls were computed, because then the hulls are the same apart
+    #   from their position.
+    #
+    #   \return True if the hulls were moved, or False if they have to be
+    #   computed again.
+    def translateConvexHull(self):
+        if self._convex_hull is None or self._local_hulls is None:
+            return False
+
+        (mesh, key), position = self.getConvexHullTransformation()
+        if mesh is not self._hull_transformation_key[0] or key != self._hull_transformation_key[1]:
+            return False
+
+        for name, local_hull in self._local_hulls.items():
+            setattr(self, name, Polygon(local_hull + position))
+        return True
+
     def getConvexHullJob(self):
         return self._convex_hull_job
 
@@ -120,3 +220,19 @@ class ConvexHullDecorator(SceneNodeDecorator):
         if self._parent_node and self._parent_node.callDecoration("isGroup"):
             self._parent_node.callDecoration("setConvexHull", None)
         self._parent_node = self.getNode().getParent()
+
+
+##  Get the points of a hull and the normals of its edges.
+#
+#   The normals are not normalised. That doesn't matter for a separating axis
+#   test, since it only compares projections on the same axis.
+def _createHitShape(hull):
+    points = hull.getPoints() if hull is not None else None
+    if points is None or len(points) == 0:
+        points = numpy.zeros((0, 2))
+    points = numpy.asarray(points, numpy.float64)
+    edges = points - numpy.roll(points, 1, axis = 0)
+    normals = numpy.empty(edges.shape)
+    normals[:, 0] = edges[:, 1]
+    normals[:, 1] = -edges[:, 0]
+    return points, normals
@@ -5,12 +5,20 @@ from UM.Job import Job
 from UM.Application import Application
 from UM.Math.Polygon import Polygon
 
+from cura.LRUCache import LRUCache
+
 import numpy
 import copy
+import weakref
 from . import ConvexHullNode
 
 ##  Job to async calculate the convex hull of a node.
 class ConvexHullJob(Job):
+    ##  Hulls of meshes relative to the position of their node, by mesh and
+    #   the rest of the transformation of the node. Copies of an object share
+    #   their mesh, so only the first copy has to compute its hull.
+    _local_hull_cache = LRUCache(16 * 1024 * 1024)
+
     def __init__(self, node):
         super().__init__()
 
@@ -19,6 +27,14 @@ class ConvexHullJob(Job):
     def run(self):
         if not self._node:
             return
+
+        # The hulls are computed in the current position of the node. Remember it, so
+        # that they can be moved along with the node when it moves without a new job.
+        # The node may move while this job runs, so the mesh is transformed with the
+        # same copy of the transformation that the hulls are cached and moved by.
+        world_transformation = copy.deepcopy(self._node.getWorldTransformation())
+        transformation = self._node.callDecoration("getConvexHullTransformation", world_transformation)
+
         ## If the scene node is a group, use the hull of the children to calculate its hull.
         if self._node.callDecoration("isGroup"):
             hull = Polygon(numpy.zeros((0, 2), dtype=numpy.int32))
@@ -34,59 +50,32 @@ class ConvexHullJob(Job):
 
                 Job.yieldThread()
 
+            hull = self._createHull(hull)
+
         else: 
             if not self._node.getMeshData():
                 return
-            mesh = self._node.getMeshData()
-            vertex_data = mesh.getTransformed(self._node.getWorldTransformation()).getVertices()
-            # Don't use data below 0.
-            # TODO; We need a better check for this as this gives poor results for meshes with long edges.
-            vertex_data = vertex_data[vertex_data[:,1] >= 0]
-
-            # Round the vertex data to 1/10th of a mm, then remove all duplicate vertices
-            # This is done to greatly speed up further convex hull calculations as the convex hull
-            # becomes much less complex when dealing with highly detailed models.
-            vertex_data = numpy.round(vertex_data, 1)
-
-            vertex_data = vertex_data[:, [0, 2]]    # Drop the Y components to project to 2D.
-
-            # Grab the set of unique points.
-            #
-            # This basically finds the unique rows in the array by treating them as opaque groups of bytes
-            # which are as long as the 2 float64s in each row, and giving this view to numpy.unique() to munch.
-            # See http://stackoverflow.com/questions/16970982/find-unique-rows-in-numpy-array
-            vertex_byte_view = numpy.ascontiguousarray(vertex_data).view(numpy.dtype((numpy.void, vertex_data.dtype.itemsize * vertex_data.shape[1])))
-            _, idx = numpy.unique(vertex_byte_view, return_index=True)
-            vertex_data = vertex_data[idx]  # Select the unique rows by index.
-
-            hull = Polygon(vertex_data)
-
-        # First, calculate the normal convex hull around the points
-        hull = hull.getConvexHull()
-
-        # Then, do a Minkowski hull with a simple 1x1 quad to outset and round the normal convex hull.
-        # This is done because of rounding errors.
-        hull = hull.getMinkowskiHull(Polygon(numpy.array([[-0.5, -0.5], [-0.5, 0.5], [0.5, 0.5], [0.5, -0.5]], numpy.float32)))
+            hull = self._getCachedHull(transformation)
+            if hull is None:
+                hull = self._createHull(self._createMeshPolygon(world_transformation))
+                self._cacheHull(transformation, hull)
 
         global_stack = Application.getInstance().getGlobalContainerStack()
+
         if global_stack:
             if global_stack.getProperty("print_sequence", "value")== "one_at_a_time" and not self._node.getParent().callDecoration("isGroup"):
                 # Printing one at a time and it's not an object in a group
                 self._node.callDecoration("setConvexHullBoundary", copy.deepcopy(hull))
-                head_and_fans = Polygon(numpy.array(global_stack.getProperty("machine_head_with_fans_polygon", "value"), numpy.float32))
+                head_polygons = Application.getInstance().getPrintHeadPolygons() #The shapes of the head are the same for all objects.
 
                 # Full head hull is used to actually check the order.
-                full_head_hull = hull.getMinkowskiHull(head_and_fans)
+                full_head_hull = hull.getMinkowskiHull(head_polygons.getHeadAndFans())
                 self._node.callDecoration("setConvexHullHeadFull", full_head_hull)
-                mirrored = copy.deepcopy(head_and_fans)
-                mirrored.mirror([0, 0], [0, 1]) #Mirror horizontally.
-                mirrored.mirror([0, 0], [1, 0]) #Mirror vertically.
-                head_and_fans = head_and_fans.intersectionConvexHulls(mirrored)
 
                 # Min head hull is used for the push free
-                min_head_hull = hull.getMinkowskiHull(head_and_fans)
+                min_head_hull = hull.getMinkowskiHull(head_polygons.getMirroredHeadAndFans())
                 self._node.callDecoration("setConvexHullHead", min_head_hull)
-                hull = hull.getMinkowskiHull(Polygon(numpy.array(global_stack.getProperty("machine_head_polygon","value"),numpy.float32)))
+                hull = hull.getMinkowskiHull(head_polygons.getHead())
             else:
                 self._node.callDecoration("setConvexHullHead", None)
         if self._node.getParent() is None:  # Node was already deleted before job is done.
@@ -98,6 +87,7 @@ class ConvexHullJob(Job):
         hull_node = ConvexHullNode.ConvexHullNode(self._node, hull, Application.getInstance().getController().getScene().getRoot())
         self._node.callDecoration("setConvexHullNode", hull_node)
         self._node.callDecoration("setConvexHull", hull)
+        self._node.callDecoration("setConvexHullTransformation", transformation)
         self._node.callDecoration("setConvexHullJob", None)
 
         if self._node.getParent() and self._node.getParent().callDecoration("isGroup"):
@@ -108,3 +98,59 @@ class ConvexHullJob(Job):
             hull_node = self._node.getParent().callDecoration("getConvexHullNode")
             if hull_node:
                 hull_node.setParent(None)
+
+    ##  Create a polygon of the vertices of the mesh of the node, projected on
+    #   the build plate.
+    #
+    #   \param world_transformation The world transformation of the node.
+    def _createMeshPolygon(self, world_transformation):
+        mesh = self._node.getMeshData()
+        vertex_data = mesh.getTransformed(world_transformation).getVertices()
+        # Don't use data below 0.
+        # TODO; We need a better check for this as this gives poor results for meshes with long edges.
+        vertex_data = vertex_data[vertex_data[:,1] >= 0]
+
+        # Round the vertex data to 1/10th of a mm, then remove all duplicate vertices
+        # This is done to greatly speed up further convex hull calculations as the convex hull
+        # becomes much less complex when dealing with highly detailed models.
+        vertex_data = numpy.round(vertex_data, 1)
+
+        vertex_data = vertex_data[:, [0, 2]]    # Drop the Y components to project to 2D.
+
+        # Grab the set of unique points.
+        #
+        # This basically finds the unique rows in the array by treating them as opaque groups of bytes
+        # which are as long as the 2 float64s in each row, and giving this view to numpy.unique() to munch.
+        # See http://stackoverflow.com/questions/16970982/find-unique-rows-in-numpy-array
+        vertex_byte_view = numpy.ascontiguousarray(vertex_data).view(numpy.dtype((numpy.void, vertex_data.dtype.itemsize * vertex_data.shape[1])))
+        _, idx = numpy.unique(vertex_byte_view, return_index=True)
+        vertex_data = vertex_data[idx]  # Select the unique rows by index.
+
+        return Polygon(vertex_data)
+
+    ##  Create the hull of a polygon, grown a bit to account for rounding errors.
+    def _createHull(self, polygon):
+        # First, calculate the normal convex hull around the points
+        hull = polygon.getConvexHull()
+
+        # Then, do a Minkowski hull with a simple 1x1 quad to outset and round the normal convex hull.
+        # This is done because of rounding errors.
+        return hull.getMinkowskiHull(Polygon(numpy.array([[-0.5, -0.5], [-0.5, 0.5], [0.5, 0.5], [0.5, -0.5]], numpy.float32)))
+
+    ##  Find the hull of the mesh in the cache.
+    #
+    #   \param transformation The transformation of the node, as given by
+    #   ConvexHullDecorator.getConvexHullTransformation().
+    #   \return The hull in the current position of the node, or None if it is
+    #   not cached.
+    def _getCachedHull(self, transformation):
+        (mesh, key), position = transformation
+        cached = self._local_hull_cache.get((id(mesh), key))
+        if cached is None or cached[0]() is not mesh: # An id can be reused once the mesh it belonged to is gone.
+            return None
+        return Polygon(cached[1] + position)
+
+    def _cacheHull(self, transformation, hull):
+        (mesh, key), position = transformation
+        local_points = hull.getPoints() - position
+        self._local_hull_cache.put((id(mesh), key), (weakref.ref(mesh), local_points), local_points.nbytes)
@@ -80,7 +80,13 @@ class ConvexHullNode(SceneNode):
         return True
 
     def _onNodePositionChanged(self, node):
-        if node.callDecoration("getConvexHull"): 
+        if node.callDecoration("getConvexHull"):
+            if node.callDecoration("translateConvexHull"):
+                # The node was only moved, so move the hull mesh along instead of computing a new hull.
+                offset = node.callDecoration("getConvexHull").getPoints()[0] - self._hull.getPoints()[0]
+                self.setPosition(Vector(offset[0], 0, offset[1]))
+                return
+
             node.callDecoration("setConvexHull", None)
             node.callDecoration("setConvexHullNode", None)
             self.setParent(None)  # Garbage collection should delete this node after a while.
@@ -39,6 +39,9 @@ from . import MultiMaterialDecorator
 from . import ZOffsetDecorator
 from . import CuraSplashScreen
 from . import MachineManagerModel
+from . import Arrange
+from . import ResolvedSettings
+from . import PrintHeadPolygons
 
 from PyQt5.QtCore import pyqtSlot, QUrl, pyqtSignal, pyqtProperty, QEvent, Q_ENUMS
 from PyQt5.QtGui import QColor, QIcon
@@ -49,6 +52,7 @@ import sys
 import os.path
 import numpy
 import copy
+import collections
 import urllib
 numpy.seterr(all="ignore")
 
@@ -116,6 +120,8 @@ class CuraApplication(QtApplication):
         self._center_after_select = False
         self._camera_animation = None
         self._cura_actions = None
+        self._resolved_settings = None
+        self._print_head_polygons = None
 
         self.getController().getScene().sceneChanged.connect(self.updatePlatformActivity)
         self.getController().toolOperationStopped.connect(self._onToolOperationStopped)
@@ -294,6 +300,9 @@ class CuraApplication(QtApplication):
 
         self._volume = BuildVolume.BuildVolume(root)
 
+        # Created here on the main thread, before the convex hull jobs that use it from other threads can start.
+        self._print_head_polygons = PrintHeadPolygons.PrintHeadPolygons()
+
         self.getRenderer().setBackgroundColor(QColor(245, 245, 245))
 
         self._physics = PlatformPhysics.PlatformPhysics(controller, self._volume)
@@ -341,6 +350,22 @@ class CuraApplication(QtApplication):
     def getPrintInformation(self):
         return self._print_information
 
+    ##  Get the resolved values of the settings of the global stack.
+    #
+    #   This is shared by everything that needs the values of all settings,
+    #   so they only need to be resolved once after they change.
+    def getResolvedSettings(self):
+        if not self._resolved_settings:
+            self._resolved_settings = ResolvedSettings.ResolvedSettings()
+        return self._resolved_settings
+
+    ##  Get the shapes of the print head of the current machine.
+    #
+    #   These are shared by the hulls of all objects that are printed one at
+    #   a time, so they only need to be made once after the head changes.
+    def getPrintHeadPolygons(self):
+        return self._print_head_polygons
+
     def registerObjects(self, engine):
         engine.rootContext().setContextProperty("Printer", self)
         self._print_information = PrintInformation.PrintInformation()
@@ -471,20 +496,103 @@ class CuraApplication(QtApplication):
             node = Selection.getSelectedObject(0)
 
         if node:
+            if node.getParent() and node.getParent().callDecoration("isGroup"):
+                node = node.getParent() #Copy the group node.
+
+            # Place the copies on free spots of the build plate right away, instead of leaving that to push free.
+            arrange = None
+            local_hull = None
+            hull = Arrange.getArrangeHull(node)
+            if hull is not None and node.getParent() is self.getController().getScene().getRoot():
+                arrange = self._createArrange()
+                position = node.getWorldPosition()
+                local_hull = hull.getPoints() - numpy.array([position.x, position.z])
+
             op = GroupedOperation()
             for _ in range(count):
-                if node.getParent() and node.getParent().callDecoration("isGroup"):
-                    new_node = copy.deepcopy(node.getParent()) #Copy the group node.
-                    new_node.callDecoration("setConvexHull",None)
+                new_node = self._copyNode(node)
+                new_node.callDecoration("setConvexHull", None)
+                if arrange:
+                    new_position = arrange.place(local_hull)
+                    if new_position is not None:
+                        new_node.setPosition(Vector(new_position[0], new_node.getPosition().y, new_position[1]))
+                op.addOperation(AddSceneNodeOperation(new_node, node.getParent()))
 
-                    op.addOperation(AddSceneNodeOperation(new_node,node.getParent().getParent()))
-                else:
-                    new_node = copy.deepcopy(node)
-                    new_node.callDecoration("setConvexHull", None)
-                    op.addOperation(AddSceneNodeOperation(new_node, node.getParent()))
+            op.push()
 
+    ##  Copy a node and its children, with the copies sharing the mesh data of
+    #   the originals.
+    #
+    #   The copies only differ from the originals in their transformation, so
+    #   there is no need to duplicate their vertices.
+    def _copyNode(self, node):
+        originals = [node] + node.getAllChildren()
+
+        # Let deepcopy take the mesh data as already copied.
+        memo = {}
+        for original in originals:
+            mesh_data = original.getMeshData()
+            if mesh_data:
+                memo[id(mesh_data)] = mesh_data
+
+        new_node = copy.deepcopy(node, memo)
+        for original, new_child in zip(originals, [new_node] + new_node.getAllChildren()):
+            if new_child.getMeshData() is not original.getMeshData():
+                new_child.setMeshData(original.getMeshData())
+        return new_node
+
+    ##  Arrange all objects on the build plate so that they do not overlap.
+    #
+    #   The largest objects are placed first. Objects that do not fit on the
+    #   build plate anymore, or whose convex hull is not known yet, are left
+    #   where they are.
+    @pyqtSlot()
+    def arrangeAll(self):
+        nodes = []
+        for node in self.getController().getScene().getRoot().getChildren():
+            if type(node) is not SceneNode:
+                continue
+            if not node.getMeshData() and not node.callDecoration("isGroup"):
+                continue  # Node that doesnt have a mesh and is not a group.
+            if Arrange.getArrangeHull(node) is None:
+                continue  # The hull is still being computed.
+            nodes.append(node)
+
+        arrange = self._createArrange(exclude = nodes)
+        if not nodes or not arrange:
+            return
+
+        # Place the nodes with the largest footprint first, so the small ones can fill the gaps.
+        def footprint(node):
+            points = Arrange.getArrangeHull(node).getPoints()
+            size = points.max(axis = 0) - points.min(axis = 0)
+            return size[0] * size[1]
+        nodes.sort(key = footprint, reverse = True)
+
+        operations = []
+        for node in nodes:
+            position = node.getWorldPosition()
+            local_hull = Arrange.getArrangeHull(node).getPoints() - numpy.array([position.x, position.z])
+            new_position = arrange.place(local_hull)
+            if new_position is not None:
+                operations.append(SetTransformOperation(node, Vector(new_position[0], node.getPosition().y, new_position[1])))
+
+        if operations:
+            op = GroupedOperation()
+            for operation in operations:
+                op.addOperation(operation)
             op.push()
 
+    ##  Create an arranger for the build plate, with everything that is on it.
+    #
+    #   \param exclude Nodes that should not take up space on the build plate.
+    #   \return An Arrange, or None if there is no machine.
+    def _createArrange(self, exclude = ()):
+        global_stack = self.getGlobalContainerStack()
+        if not global_stack:
+            return None
+        return Arrange.Arrange.create(self.getController().getScene().getRoot(), global_stack.getProperty("machine_width", "value"), global_stack.getProperty("machine_depth", "value"), self._volume.getDisallowedAreas(), exclude)
+
     ##  Center object on platform.
     @pyqtSlot("quint64")
     def centerObject(self, object_id):
@@ -583,14 +691,16 @@ class CuraApplication(QtApplication):
         if not nodes:
             return
 
+        # Copies of an object share their mesh data, so only read each mesh once.
+        nodes_by_mesh = collections.OrderedDict()
         for node in nodes:
-            if not node.getMeshData():
-                continue
+            nodes_by_mesh.setdefault(id(node.getMeshData()), []).append(node)
 
-            file_name = node.getMeshData().getFileName()
+        for mesh_nodes in nodes_by_mesh.values():
+            file_name = mesh_nodes[0].getMeshData().getFileName()
             if file_name:
                 job = ReadMeshJob(file_name)
-                job._node = node
+                job._nodes = mesh_nodes
                 job.finished.connect(self._reloadMeshFinished)
                 job.start()
     
@@ -724,7 +834,9 @@ class CuraApplication(QtApplication):
 
     def _reloadMeshFinished(self, job):
         # TODO; This needs to be fixed properly. We now make the assumption that we only load a single mesh!
-        job._node.setMeshData(job.getResult().getMeshData())
+        mesh_data = job.getResult().getMeshData()
+        for node in job._nodes:
+            node.setMeshData(mesh_data)
 
     def _openFile(self, file):
         job = ReadMeshJob(os.path.abspath(file))
@@ -0,0 +1,113 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import collections
+import threading
+
+##  A least-recently-used cache that is bounded by the total size of its
+#   entries.
+#
+#   Every entry is stored together with its size in bytes, as given by the
+#   caller. When adding an entry makes the cache exceed its maximum size, the
+#   entries that were used least recently are evicted until it fits again. An
+#   entry that is bigger than the maximum size on its own is not stored at all.
+#
+#   The cache may be used from multiple threads at the same time.
+class LRUCache:
+    ##  Creates a new, empty cache.
+    #
+    #   \param max_size The maximum total size of all entries, in bytes.
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict() # Key -> (value, size). The least recently used entry comes first.
+        self._size = 0
+        self._hit_count = 0
+        self._miss_count = 0
+        self._lock = threading.Lock()
+
+    ##  Get an entry from the cache and mark it as most recently used.
+    #
+    #   \param key The key of the entry.
+    #   \param default The value to return if there is no entry for the key.
+    #   \return The cached value, or the default if the key is not cached.
+    def get(self, key, default = None):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self._miss_count += 1
+                return default
+
+            self._entries[key] = (value, size)
+            self._hit_count += 1
+            return value
+
+    ##  Add an entry to the cache, replacing any entry with the same key.
+    #
+    #   \param key The key of the entry.
+    #   \param value The value to store.
+    #   \param size The size of the value in bytes.
+    def put(self, key, value, size):
+        with self._lock:
+            self._removeEntry(key)
+            if size > self._max_size:
+                return
+
+            self._entries[key] = (value, size)
+            self._size += size
+            self._evict()
+
+    ##  Remove an entry from the cache, if it is in the cache.
+    #
+    #   \param key The key of the entry to remove.
+    def remove(self, key):
+        with self._lock:
+            self._removeEntry(key)
+
+    ##  Remove all entries from the cache.
+    #
+    #   The hit and miss counters are not reset.
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    ##  Get the total size of all entries in the cache, in bytes.
+    def getSize(self):
+        return self._size
+
+    def getMaxSize(self):
+        return self._max_size
+
+    ##  Change the maximum size of the cache.
+    #
+    #   If the cache is now too big, the least recently used entries are
+    #   evicted.
+    def setMaxSize(self, max_size):
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    ##  Get the number of times get() found an entry.
+    def getHitCount(self):
+        return self._hit_count
+
+    ##  Get the number of times get() did not find an entry.
+    def getMissCount(self):
+        return self._miss_count
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _removeEntry(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _evict(self):
+        while self._size > self._max_size and self._entries:
+            _, (_, size) = self._entries.popitem(last = False)
+            self._size -= size
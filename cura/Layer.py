@@ -1,18 +1,35 @@
 from .LayerPolygon import LayerPolygon
 
-from UM.Math.Vector import Vector
-from UM.Mesh.MeshBuilder import MeshBuilder
+from UM.Mesh.MeshData import MeshData
 
 import numpy
 
+##  A single layer of sliced data.
+#
+#   The polygons of a layer are not stored as separate objects. Instead the
+#   points of all polygons are kept in one float32 array, together with arrays
+#   of the polygon offsets in that array, the polygon types and their line
+#   widths. The polygons property provides LayerPolygon views on these arrays
+#   for code that wants to look at one polygon at a time.
 class Layer:
     def __init__(self, layer_id):
         self._id = layer_id
         self._height = 0.0
         self._thickness = 0.0
-        self._polygons = []
         self._element_count = 0
 
+        self._points = numpy.empty((0, 3), numpy.float32) # Points of all polygons, one after the other.
+        self._polygon_offsets = numpy.zeros(1, numpy.int64) # Index of the first point of each polygon, followed by the total number of points.
+        self._types = numpy.empty(0, numpy.int32)
+        self._line_widths = numpy.empty(0, numpy.float64) # In millimetres.
+        self._added_polygons = [] # Polygons from addPolygon that were not merged into the arrays yet.
+        self._polygons = None # LayerPolygon views, created when they are first asked for.
+
+        # Line mesh buffers of this layer, created by build().
+        self._vertices = None
+        self._colors = None
+        self._indices = None
+
     @property
     def height(self):
         return self._height
@@ -23,6 +40,9 @@ class Layer:
 
     @property
     def polygons(self):
+        self._mergeAddedPolygons()
+        if self._polygons is None:
+            self._polygons = [LayerPolygon(self, index) for index in range(len(self._types))]
         return self._polygons
 
     @property
@@ -35,24 +55,109 @@ class Layer:
     def setThickness(self, thickness):
         self._thickness = thickness
 
-    def vertexCount(self):
-        result = 0
-        for polygon in self._polygons:
-            result += polygon.vertexCount()
-
-        return result
-
-    def build(self, offset, vertices, colors, indices):
-        result = offset
-        for polygon in self._polygons:
-            if polygon.type == LayerPolygon.InfillType or polygon.type == LayerPolygon.MoveCombingType or polygon.type == LayerPolygon.MoveRetractionType:
-                continue
+    ##  Set all polygons of this layer at once, replacing any polygons it had.
+    #
+    #   \param points The points of all polygons, as one float32 array of shape
+    #   (n, 3).
+    #   \param polygon_offsets The index of the first point of each polygon,
+    #   with the total number of points appended.
+    #   \param types The type of each polygon.
+    #   \param line_widths The line width of each polygon, in micrometres as
+    #   sent by the engine.
+    def setPolygons(self, points, polygon_offsets, types, line_widths):
+        self._points = points
+        self._polygon_offsets = numpy.asarray(polygon_offsets, numpy.int64)
+        self._types = numpy.asarray(types, numpy.int32)
+        self._line_widths = numpy.asarray(line_widths, numpy.float64) / 1000
+        self._added_polygons = []
+        self._polygons = None
+
+    ##  Add a single polygon to this layer.
+    #
+    #   When adding many polygons, setPolygons() is much faster.
+    #
+    #   \param polygon_type The type of the polygon.
+    #   \param data The points of the polygon, as a float32 array of shape (n, 3).
+    #   \param line_width The line width in micrometres as sent by the engine.
+    def addPolygon(self, polygon_type, data, line_width):
+        self._added_polygons.append((polygon_type, data, line_width))
+        self._polygons = None
+
+    ##  Add the polygons of another layer to the end of this layer.
+    #
+    #   The engine may send the polygons of one layer in several messages,
+    #   which are processed into separate layers first.
+    #
+    #   \param other The Layer to take the polygons from.
+    def addPolygonsOf(self, other):
+        offsets = self.getPolygonOffsets()
+        self._points = numpy.concatenate((self.getPoints(), other.getPoints()))
+        self._polygon_offsets = numpy.concatenate((offsets[:-1], other.getPolygonOffsets() + offsets[-1]))
+        self._types = numpy.concatenate((self.getPolygonTypes(), other.getPolygonTypes()))
+        self._line_widths = numpy.concatenate((self.getLineWidths(), other.getLineWidths()))
+        self._polygons = None
+        if self.isBuilt():
+            self.build()
+
+    def getPoints(self):
+        self._mergeAddedPolygons()
+        return self._points
+
+    def getPolygonOffsets(self):
+        self._mergeAddedPolygons()
+        return self._polygon_offsets
+
+    def getPolygonTypes(self):
+        self._mergeAddedPolygons()
+        return self._types
+
+    def getLineWidths(self):
+        self._mergeAddedPolygons()
+        return self._line_widths
 
-            polygon.build(result, vertices, colors, indices)
-            result += polygon.vertexCount()
-            self._element_count += polygon.elementCount
-
-        return result
+    def vertexCount(self):
+        return len(self.getPoints())
+
+    ##  Build the line mesh buffers of this layer.
+    #
+    #   The buffers are kept in the layer, so that LayerData.build() only needs
+    #   to join the buffers of all layers together. This way layers can be
+    #   built while other layers are still being sliced. The indices are
+    #   relative to the first vertex of this layer.
+    def build(self):
+        points = self.getPoints()
+        types = self.getPolygonTypes()
+        point_counts = numpy.diff(self.getPolygonOffsets())
+
+        # Infill and travel moves are not part of the line mesh.
+        included = (types != LayerPolygon.InfillType) & (types != LayerPolygon.MoveCombingType) & (types != LayerPolygon.MoveRetractionType) & (point_counts > 0)
+        counts = point_counts[included]
+        self._vertices = points[numpy.repeat(included, point_counts)]
+        vertex_count = len(self._vertices)
+
+        # Every vertex is connected to the next one, except the last vertex of
+        # each polygon, which is connected to the first one of its polygon.
+        begins = numpy.cumsum(counts) - counts
+        ends = begins + counts - 1
+        self._indices = numpy.empty((vertex_count, 2), numpy.int32)
+        self._indices[:, 0] = numpy.arange(vertex_count, dtype = numpy.int32)
+        self._indices[:, 1] = numpy.arange(1, vertex_count + 1, dtype = numpy.int32)
+        self._indices[ends, 1] = begins
+
+        colors = LayerPolygon.getColorArray() * numpy.array([0.5, 0.5, 0.5, 1.0], numpy.float32)
+        self._colors = colors[numpy.repeat(types[included], counts)]
+
+        self._element_count = vertex_count * 2 # Each vertex is used twice, by the line to it and the line from it.
+
+    ##  Whether build() has been called for this layer.
+    def isBuilt(self):
+        return self._vertices is not None
+
+    ##  Get the line mesh buffers created by build().
+    #
+    #   \return A tuple of vertices, colors and indices.
+    def getBuffers(self):
+        return self._vertices, self._colors, self._indices
 
     def createMesh(self):
         return self.createMeshOrJumps(True)
@@ -60,40 +165,82 @@ class Layer:
     def createJumps(self):
         return self.createMeshOrJumps(False)
 
+    ##  Create a mesh of quads for the lines of either the printed polygons or
+    #   the travel moves of this layer.
+    #
+    #   Every line is turned into a quad as wide as the line width of its
+    #   polygon. The quads of all polygons are computed at once, straight into
+    #   the vertex and color arrays of the mesh.
+    #
+    #   \param make_mesh True to create the mesh of the printed polygons, False
+    #   to create the mesh of the travel moves.
+    #   \return MeshData with the quads, as pairs of triangles.
     def createMeshOrJumps(self, make_mesh):
-        builder = MeshBuilder()
-
-        for polygon in self._polygons:
-            if make_mesh and (polygon.type == LayerPolygon.MoveCombingType or polygon.type == LayerPolygon.MoveRetractionType):
-                continue
-            if not make_mesh and not (polygon.type == LayerPolygon.MoveCombingType or polygon.type == LayerPolygon.MoveRetractionType):
-                continue
-
-            poly_color = polygon.getColor()
-
-            points = numpy.copy(polygon.data)
-            if polygon.type == LayerPolygon.InfillType or polygon.type == LayerPolygon.SkinType or polygon.type == LayerPolygon.SupportInfillType:
-                points[:,1] -= 0.01
-            if polygon.type == LayerPolygon.MoveCombingType or polygon.type == LayerPolygon.MoveRetractionType:
-                points[:,1] += 0.01
-
-            normals = polygon.getNormals()
-
-            # Scale all by the line width of the polygon so we can easily offset.
-            normals *= (polygon.lineWidth / 2)
-
-            #TODO: Use numpy magic to perform the vertex creation to speed up things.
-            for i in range(len(points)):
-                start = points[i - 1]
-                end = points[i]
-
-                normal = normals[i - 1]
-
-                point1 = Vector(data = start - normal)
-                point2 = Vector(data = start + normal)
-                point3 = Vector(data = end + normal)
-                point4 = Vector(data = end - normal)
-
-                builder.addQuad(point1, point2, point3, point4, color = poly_color)
-
-        return builder.getData()
\ No newline at end of file
+        mesh = MeshData()
+
+        types = self.getPolygonTypes()
+        point_counts = numpy.diff(self.getPolygonOffsets())
+        is_jump = (types == LayerPolygon.MoveCombingType) | (types == LayerPolygon.MoveRetractionType)
+        selected = (is_jump != make_mesh) & (point_counts > 0)
+        if not numpy.any(selected):
+            return mesh
+
+        counts = point_counts[selected]
+        selected_types = numpy.repeat(types[selected], counts)
+        points = self.getPoints()[numpy.repeat(selected, point_counts)]
+        vertex_count = len(points)
+
+        # Each line runs from the previous point of the polygon to the current
+        # one. The first point of a polygon is connected to its last point.
+        begins = numpy.cumsum(counts) - counts
+        previous = numpy.arange(-1, vertex_count - 1)
+        previous[begins] = begins + counts - 1
+        starts = points[previous]
+
+        # The 2D normal of each line, scaled to half the line width so that
+        # the sides of the quad can be found by offsetting the points.
+        normals = numpy.zeros((vertex_count, 3), numpy.float32)
+        normals[:, 0] = points[:, 2] - starts[:, 2]
+        normals[:, 2] = starts[:, 0] - points[:, 0]
+        lengths = numpy.sqrt(normals[:, 0] ** 2 + normals[:, 2] ** 2)
+        scale = numpy.repeat(self.getLineWidths()[selected], counts).astype(numpy.float32) / 2 / lengths
+        normals[:, 0] *= scale
+        normals[:, 2] *= scale
+
+        # Lift the travel moves and lower the infill a bit so they do not fight with the walls.
+        offsets = numpy.zeros(vertex_count, numpy.float32)
+        offsets[(selected_types == LayerPolygon.InfillType) | (selected_types == LayerPolygon.SkinType) | (selected_types == LayerPolygon.SupportInfillType)] = -0.01
+        offsets[(selected_types == LayerPolygon.MoveCombingType) | (selected_types == LayerPolygon.MoveRetractionType)] = 0.01
+        starts[:, 1] += offsets
+        ends = numpy.copy(points)
+        ends[:, 1] += offsets
+
+        # Two triangles per line: (1, 3, 2) and (1, 4, 3) of the corners
+        # 1 = start - normal, 2 = start + normal, 3 = end + normal and 4 = end - normal.
+        vertices = numpy.empty((vertex_count, 6, 3), numpy.float32)
+        vertices[:, 0] = starts - normals
+        vertices[:, 1] = ends + normals
+        vertices[:, 2] = starts + normals
+        vertices[:, 3] = vertices[:, 0]
+        vertices[:, 4] = ends - normals
+        vertices[:, 5] = vertices[:, 1]
+
+        colors = numpy.repeat(LayerPolygon.getColorArray()[selected_types], 6, axis = 0)
+
+        mesh.addVertices(vertices.reshape((-1, 3)))
+        mesh.addColors(colors)
+        return mesh
+
+    def _mergeAddedPolygons(self):
+        if not self._added_polygons:
+            return
+
+        added_points = [numpy.asarray(data, numpy.float32) for _, data, _ in self._added_polygons]
+        point_counts = [len(data) for data in added_points]
+        offsets = numpy.cumsum(point_counts, dtype = numpy.int64) + self._polygon_offsets[-1]
+
+        self._points = numpy.concatenate([self._points] + added_points)
+        self._polygon_offsets = numpy.concatenate((self._polygon_offsets, offsets))
+        self._types = numpy.concatenate((self._types, numpy.array([polygon_type for polygon_type, _, _ in self._added_polygons], numpy.int32)))
+        self._line_widths = numpy.concatenate((self._line_widths, numpy.array([line_width for _, _, line_width in self._added_polygons], numpy.float64) / 1000))
+        self._added_polygons = []
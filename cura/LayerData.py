@@ -1,7 +1,6 @@
 # Copyright (c) 2015 Ultimaker B.V.
 # Cura is released under the terms of the AGPLv3 or higher.
 from .Layer import Layer
-from .LayerPolygon import LayerPolygon
 from UM.Mesh.MeshData import MeshData
 
 import numpy
@@ -12,17 +11,26 @@ class LayerData(MeshData):
         super().__init__()
         self._layers = {}
         self._element_counts = {}
+        self._first_layer = 0
+        self._element_offsets = numpy.zeros(1, numpy.int64) # Number of elements before each layer number, starting at _first_layer.
 
     def addLayer(self, layer):
         if layer not in self._layers:
             self._layers[layer] = Layer(layer)
 
+    ##  Add a layer that was created elsewhere, for instance by a job that
+    #   processes layers while the rest of the slice is not done yet.
+    #
+    #   \param layer The number of the layer.
+    #   \param layer_object The Layer to add.
+    def setLayer(self, layer, layer_object):
+        self._layers[layer] = layer_object
+
     def addPolygon(self, layer, polygon_type, data, line_width):
         if layer not in self._layers:
             self.addLayer(layer)
 
-        p = LayerPolygon(self, polygon_type, data, line_width)
-        self._layers[layer].polygons.append(p)
+        self._layers[layer].addPolygon(polygon_type, data, line_width)
 
     def getLayer(self, layer):
         if layer in self._layers:
@@ -34,6 +42,18 @@ class LayerData(MeshData):
     def getElementCounts(self):
         return self._element_counts
 
+    ##  Get the number of elements of all layers up to and including a layer.
+    #
+    #   This is a single lookup in the cumulative element counts made by
+    #   build(), so it is cheap enough to call on every frame.
+    #
+    #   \param layer The number of the last layer to count.
+    #   \return The number of elements of the line mesh that belong to the
+    #   layers with a number of at most the given layer.
+    def getElementCountUpTo(self, layer):
+        index = min(max(layer - self._first_layer + 1, 0), len(self._element_offsets) - 1)
+        return int(self._element_offsets[index])
+
     def setLayerHeight(self, layer, height):
         if layer not in self._layers:
             self.addLayer(layer)
@@ -46,20 +66,43 @@ class LayerData(MeshData):
 
         self._layers[layer].setThickness(thickness)
 
+    ##  Create the line mesh of all layers.
+    #
+    #   Layers that were not built yet are built first. The buffers of the
+    #   layers are then joined together in the order of their layer numbers.
     def build(self):
+        layer_numbers = sorted(self._layers)
+
         vertex_count = 0
-        for layer, data in self._layers.items():
-            vertex_count += data.vertexCount()
+        for layer in layer_numbers:
+            data = self._layers[layer]
+            if not data.isBuilt():
+                data.build()
+            vertex_count += len(data.getBuffers()[0])
 
         vertices = numpy.empty((vertex_count, 3), numpy.float32)
         colors = numpy.empty((vertex_count, 4), numpy.float32)
         indices = numpy.empty((vertex_count, 2), numpy.int32)
 
+        self._element_counts = {}
         offset = 0
-        for layer, data in self._layers.items():
-            offset = data.build(offset, vertices, colors, indices)
+        for layer in layer_numbers:
+            data = self._layers[layer]
+            layer_vertices, layer_colors, layer_indices = data.getBuffers()
+            end = offset + len(layer_vertices)
+            vertices[offset:end] = layer_vertices
+            colors[offset:end] = layer_colors
+            numpy.add(layer_indices, offset, out = indices[offset:end])
+            offset = end
             self._element_counts[layer] = data.elementCount
 
+        # Layer numbers may have gaps, so the cumulative counts are stored for every number in the range.
+        self._first_layer = layer_numbers[0] if layer_numbers else 0
+        self._element_offsets = numpy.zeros(layer_numbers[-1] - self._first_layer + 2 if layer_numbers else 1, numpy.int64)
+        for layer, count in self._element_counts.items():
+            self._element_offsets[layer - self._first_layer + 1] = count
+        numpy.cumsum(self._element_offsets, out = self._element_offsets)
+
         self.clear()
         self.addVertices(vertices)
         self.addColors(colors)
@@ -3,6 +3,11 @@ from UM.Math.Color import Color
 import numpy
 
 
+##  A single polygon of a layer.
+#
+#   The data of the polygon is owned by its Layer, which stores the data of all
+#   its polygons in shared arrays. A LayerPolygon is only a light-weight view on
+#   one polygon in those arrays.
 class LayerPolygon:
     NoneType = 0
     Inset0Type = 1
@@ -15,55 +20,41 @@ class LayerPolygon:
     MoveCombingType = 8
     MoveRetractionType = 9
 
-    def __init__(self, mesh, polygon_type, data, line_width):
-        self._mesh = mesh
-        self._type = polygon_type
-        self._data = data
-        self._line_width = line_width / 1000
-        self._begin = 0
-        self._end = 0
-
-        self._color = self.__color_map[polygon_type]
-
-    def build(self, offset, vertices, colors, indices):
-        self._begin = offset
-        self._end = self._begin + len(self._data) - 1
-
-        vertices[self._begin:self._end + 1, :] = self._data[:, :]
-        colors[self._begin:self._end + 1, :] = numpy.array([self._color.r * 0.5, self._color.g * 0.5, self._color.b * 0.5, self._color.a], numpy.float32)
-
-        for i in range(self._begin, self._end):
-            indices[i, 0] = i
-            indices[i, 1] = i + 1
-
-        indices[self._end, 0] = self._end
-        indices[self._end, 1] = self._begin
+    ##  Creates a view on a polygon of a layer.
+    #
+    #   \param layer The Layer that holds the polygon.
+    #   \param index The index of the polygon in the layer.
+    def __init__(self, layer, index):
+        self._layer = layer
+        self._index = index
 
     def getColor(self):
-        return self._color
+        return self.__color_map[self.type]
 
     def vertexCount(self):
-        return len(self._data)
+        offsets = self._layer.getPolygonOffsets()
+        return int(offsets[self._index + 1] - offsets[self._index])
 
     @property
     def type(self):
-        return self._type
+        return int(self._layer.getPolygonTypes()[self._index])
 
     @property
     def data(self):
-        return self._data
+        offsets = self._layer.getPolygonOffsets()
+        return self._layer.getPoints()[offsets[self._index]:offsets[self._index + 1]]
 
     @property
     def elementCount(self):
-        return ((self._end - self._begin) + 1) * 2  # The range of vertices multiplied by 2 since each vertex is used twice
+        return self.vertexCount() * 2  # The number of vertices multiplied by 2 since each vertex is used twice
 
     @property
     def lineWidth(self):
-        return self._line_width
+        return float(self._layer.getLineWidths()[self._index])
 
     # Calculate normals for the entire polygon using numpy.
     def getNormals(self):
-        normals = numpy.copy(self._data)
+        normals = numpy.copy(self.data)
         normals[:, 1] = 0.0 # We are only interested in 2D normals
 
         # Calculate the edges between points.
@@ -97,3 +88,18 @@ class LayerPolygon:
         MoveCombingType: Color(0.0, 0.0, 1.0, 1.0),
         MoveRetractionType: Color(0.5, 0.5, 1.0, 1.0),
     }
+
+    __color_array = None
+
+    ##  Get the colors of all polygon types as one array.
+    #
+    #   \return A float32 array of shape (n, 4), where row i holds the RGBA color
+    #   of polygon type i.
+    @classmethod
+    def getColorArray(cls):
+        if cls.__color_array is None:
+            color_array = numpy.zeros((max(cls.__color_map) + 1, 4), numpy.float32)
+            for polygon_type, color in cls.__color_map.items():
+                color_array[polygon_type] = [color.r, color.g, color.b, color.a]
+            cls.__color_array = color_array
+        return cls.__color_array
@@ -3,18 +3,31 @@
 
 from UM.Scene.Iterator import Iterator
 from UM.Scene.SceneNode import SceneNode
-from functools import cmp_to_key
-from UM.Application import Application
+from UM.Logger import Logger
+
+import heapq
+import numpy
 
 ## Iterator that returns a list of nodes in the order that they need to be printed
 #  If there is no solution an empty list is returned.
 #  Take note that the list of nodes can have children (that may or may not contain mesh data)
+#
+#  An object must be printed before every object whose boundary is hit by its
+#  print head, so the order is a topological sort of these hits. When several
+#  objects can be printed next, the one that comes last in the scene is taken.
 class OneAtATimeIterator(Iterator.Iterator):
+    ##  Maximum number of elements in the arrays of the hit tests of a batch
+    #   of pairs of hulls.
+    MaxChunkElements = 4 * 1024 * 1024
+
+    ##  The hit shapes of the objects and the hit map of the last iteration.
+    _hit_map_cache = None
+
     def __init__(self, scene_node):
         super().__init__(scene_node) # Call super to make multiple inheritence work.
-        self._hit_map = [[]]
+        self._hit_map = numpy.zeros((0, 0), numpy.bool_)
         self._original_node_list = []
-    
+
     def _fillStack(self):
         node_list = []
         for node in self._scene_node.getChildren():
@@ -26,86 +39,123 @@ class OneAtATimeIterator(Iterator.Iterator):
 
         if len(node_list) < 2:
             self._node_stack = node_list[:]
-            return 
+            return
 
         # Copy the list
         self._original_node_list = node_list[:]
 
         ## Initialise the hit map (pre-compute all hits between all objects)
-        self._hit_map = [[self._checkHit(i,j) for i in node_list] for j in node_list]
-
-        # Check if we have to files that block eachother. If this is the case, there is no solution!
-        for a in range(0,len(node_list)):
-            for b in range(0,len(node_list)):
-                if a != b and self._hit_map[a][b] and self._hit_map[b][a]:
-                    return 
-
-        # Sort the original list so that items that block the most other objects are at the beginning.
-        # This does not decrease the worst case running time, but should improve it in most cases.
-        sorted(node_list, key = cmp_to_key(self._calculateScore))
-
-        todo_node_list = [_ObjectOrder([], node_list)]
-        while len(todo_node_list) > 0:
-            current = todo_node_list.pop()
-            for node in current.todo:
-                # Check if the object can be placed with what we have and still allows for a solution in the future
-                if not self._checkHitMultiple(node, current.order) and not self._checkBlockMultiple(node, current.todo):
-                    # We found a possible result. Create new todo & order list.
-                    new_todo_list = current.todo[:]
-                    new_todo_list.remove(node)
-                    new_order = current.order[:] + [node]
-                    if len(new_todo_list) == 0: 
-                        # We have no more nodes to check, so quit looking.
-                        todo_node_list = None
-                        self._node_stack = new_order
-
-                        return
-                    todo_node_list.append(_ObjectOrder(new_order, new_todo_list))
-        self._node_stack = [] #No result found!
-
-
-    # Check if first object can be printed before the provided list (using the hit map)
-    def _checkHitMultiple(self, node, other_nodes):
-        node_index = self._original_node_list.index(node)
-        for other_node in other_nodes:
-            other_node_index = self._original_node_list.index(other_node)
-            if self._hit_map[node_index][other_node_index]:
-                return True
-        return False
-
-    def _checkBlockMultiple(self, node, other_nodes):
-        node_index = self._original_node_list.index(node)
-        for other_node in other_nodes:
-            other_node_index = self._original_node_list.index(other_node)
-            if self._hit_map[other_node_index][node_index] and node_index != other_node_index:
-                return True
-        return False
-
-    ##  Calculate score simply sums the number of other objects it 'blocks'
-    def _calculateScore(self, a, b):
-        score_a = sum(self._hit_map[self._original_node_list.index(a)])
-        score_b = sum(self._hit_map[self._original_node_list.index(b)])
-        return score_a - score_b
-
-    #   Checks if A can be printed before B
-    def _checkHit(self, a, b):
-        if a == b:
-            return False
-
-        overlap = a.callDecoration("getConvexHullBoundary").intersectsPolygon(b.callDecoration("getConvexHullHeadFull"))
-        if overlap:
-            return True
-        else: 
-            return False
-
-
-## Internal object used to keep track of a possible order in which to print objects.      
-class _ObjectOrder():
-    def __init__(self, order, todo):
-        """
-        :param order:   List of indexes in which to print objects, ordered by printing order.
-        :param todo:    List of indexes which are not yet inserted into the order list.
-        """
-        self.order = order
-        self.todo = todo
-
+        # hit_map[a, b] is True if object a has to be printed before object b.
+        self._hit_map = self._createHitMap(node_list)
+
+        order = self._sortTopologically(self._hit_map)
+        if order is None: # No result found!
+            self._node_stack = []
+            return
+        self._node_stack = [node_list[index] for index in order]
+
+    ##  Compute which objects have to be printed before which other objects.
+    #
+    #   An object has to be printed before another object if its full head
+    #   hull intersects the boundary of the other object. All pairs of hulls
+    #   are tested at once with a separating axis test: two convex polygons
+    #   don't intersect if and only if their projections on the normal of one
+    #   of their edges don't overlap. Only the pairs of hulls whose bounding
+    #   boxes overlap are tested.
+    #
+    #   The result is kept until the hull of any of the objects changes.
+    #
+    #   \param node_list The objects to print.
+    #   \return A square boolean array, where [a, b] is True if object a must
+    #   be printed before object b.
+    def _createHitMap(self, node_list):
+        shapes = [node.callDecoration("getConvexHullHitShapes") for node in node_list]
+        cached = OneAtATimeIterator._hit_map_cache
+        if cached is not None and len(cached[0]) == len(shapes) and all(a is b for a, b in zip(cached[0], shapes)):
+            return cached[1]
+
+        boundary_points, boundary_normals, boundary_boxes = _padShapes([boundary for boundary, _ in shapes])
+        head_points, head_normals, head_boxes = _padShapes([head for _, head in shapes])
+
+        # [a, b] is True if the box of the head of a overlaps the box of the boundary of b.
+        candidates = (head_boxes[:, None, 0] <= boundary_boxes[None, :, 2]) & (head_boxes[:, None, 2] >= boundary_boxes[None, :, 0])
+        candidates &= (head_boxes[:, None, 1] <= boundary_boxes[None, :, 3]) & (head_boxes[:, None, 3] >= boundary_boxes[None, :, 1])
+        numpy.fill_diagonal(candidates, False)
+        heads, boundaries = numpy.nonzero(candidates)
+
+        hit_map = numpy.zeros((len(node_list), len(node_list)), numpy.bool_)
+        point_count = head_points.shape[1]
+        chunk_size = max(1, self.MaxChunkElements // (point_count * point_count)) # Bound the memory of the projections.
+        for start in range(0, len(heads), chunk_size):
+            a = heads[start:start + chunk_size]
+            b = boundaries[start:start + chunk_size]
+            axes = numpy.concatenate((head_normals[a], boundary_normals[b]), axis = 1)
+            head_projections = numpy.einsum("pad,pkd->pak", axes, head_points[a])
+            boundary_projections = numpy.einsum("pad,pkd->pak", axes, boundary_points[b])
+            separated = (head_projections.min(axis = 2) > boundary_projections.max(axis = 2)) | (boundary_projections.min(axis = 2) > head_projections.max(axis = 2))
+            hit_map[a, b] = ~separated.any(axis = 1)
+
+        OneAtATimeIterator._hit_map_cache = (shapes, hit_map)
+        return hit_map
+
+    ##  Order the objects so that every object comes before the objects it hits.
+    #
+    #   \param hit_map See _createHitMap().
+    #   \return A list of object indices in print order, or None if there is
+    #   no such order.
+    def _sortTopologically(self, hit_map):
+        blocked_by_count = hit_map.sum(axis = 0) # Number of objects that have to be printed before each object.
+        ready = [-index for index in numpy.nonzero(blocked_by_count == 0)[0]] # Negative, to take the last object first.
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            index = -heapq.heappop(ready)
+            order.append(index)
+            for blocked in numpy.nonzero(hit_map[index])[0]:
+                blocked_by_count[blocked] -= 1
+                if blocked_by_count[blocked] == 0:
+                    heapq.heappush(ready, -blocked)
+
+        if len(order) < len(hit_map):
+            self._logCycles(hit_map, blocked_by_count > 0)
+            return None
+        return order
+
+    ##  Report the objects that block each other, so that there is no order to
+    #   print them in.
+    #
+    #   \param hit_map See _createHitMap().
+    #   \param unordered Boolean array of the objects that could not be ordered.
+    def _logCycles(self, hit_map, unordered):
+        remaining = hit_map & unordered[:, None] & unordered[None, :]
+        pairs = []
+        for a, b in zip(*numpy.nonzero(remaining)):
+            pairs.append("{0} before {1}".format(self._original_node_list[a].getName(), self._original_node_list[b].getName()))
+        Logger.log("w", "No order to print the objects one at a time, because they block each other: %s", ", ".join(pairs))
+
+
+##  Put hit shapes with different numbers of points in one array.
+#
+#   Shorter shapes are padded by repeating their last point, which doesn't
+#   change their projection on any axis, and with zero normals, which never
+#   separate anything.
+#
+#   \param shapes List of (points, normals) tuples.
+#   \return A tuple of the points and normals as arrays of shape (n, k, 2),
+#   and the bounding boxes (min x, min y, max x, max y) of the shapes. Empty
+#   shapes get a box that doesn't overlap anything.
+def _padShapes(shapes):
+    point_count = max(1, max(len(points) for points, _ in shapes))
+    all_points = numpy.zeros((len(shapes), point_count, 2))
+    all_normals = numpy.zeros((len(shapes), point_count, 2))
+    boxes = numpy.empty((len(shapes), 4))
+    boxes[:] = (numpy.inf, numpy.inf, -numpy.inf, -numpy.inf)
+    for index, (points, normals) in enumerate(shapes):
+        if len(points) == 0:
+            continue
+        all_points[index, :len(points)] = points
+        all_points[index, len(points):] = points[-1]
+        all_normals[index, :len(normals)] = normals
+        boxes[index, :2] = points.min(axis = 0)
+        boxes[index, 2:] = points.max(axis = 0)
+    return all_points, all_normals, boxes
@@ -7,19 +7,27 @@ from UM.Scene.SceneNode import SceneNode
 from UM.Scene.Iterator.BreadthFirstIterator import BreadthFirstIterator
 from UM.Math.Vector import Vector
 from UM.Math.AxisAlignedBox import AxisAlignedBox
-from UM.Application import Application
 from UM.Scene.Selection import Selection
 from UM.Preferences import Preferences
+from UM.Math.Polygon import Polygon
 
 from cura.ConvexHullDecorator import ConvexHullDecorator
+from cura.ConvexHullBroadPhase import ConvexHullBroadPhase
 
 from . import PlatformPhysicsOperation
+from . import PlatformPhysicsGroupedOperation
 from . import ConvexHullJob
 from . import ZOffsetDecorator
 
+import collections
 import copy
+import numpy
 
 class PlatformPhysics:
+    ##  Maximum number of times that push free moves overlapping nodes apart
+    #   in one go.
+    MaxPushFreeIterations = 50
+
     def __init__(self, controller, volume):
         super().__init__()
         self._controller = controller
@@ -30,6 +38,8 @@ class PlatformPhysics:
 
         self._enabled = True
 
+        self._broad_phase = ConvexHullBroadPhase() # Finds the nodes whose hulls may overlap.
+
         self._change_timer = QTimer()
         self._change_timer.setInterval(100)
         self._change_timer.setSingleShot(True)
@@ -45,6 +55,8 @@ class PlatformPhysics:
             return
 
         root = self._controller.getScene().getRoot()
+        move_vectors = collections.OrderedDict() # Node -> how far to move it, in the order the nodes were visited.
+        colliding_nodes = set() # Nodes that take part in push free.
         for node in BreadthFirstIterator(root):
             if node is root or type(node) is not SceneNode:
                 continue
@@ -70,6 +82,7 @@ class PlatformPhysics:
                     move_vector.setY(-bbox.bottom + z_offset)
                 elif bbox.bottom < z_offset:
                     move_vector.setY((-bbox.bottom) - z_offset)
+            move_vectors[node] = move_vector
 
             #if not Float.fuzzyCompare(bbox.bottom, 0.0):
             #   pass#move_vector.setY(-bbox.bottom)
@@ -78,70 +91,107 @@ class PlatformPhysics:
             if not node.getDecorator(ConvexHullDecorator):
                 node.addDecorator(ConvexHullDecorator())
             
-            if not node.callDecoration("getConvexHull"):
+            convex_hull = node.callDecoration("getConvexHull")
+            if not convex_hull:
                 if not node.callDecoration("getConvexHullJob"):
                     job = ConvexHullJob.ConvexHullJob(node)
                     job.start()
                     node.callDecoration("setConvexHullJob", job)
-                    
-            elif Preferences.getInstance().getValue("physics/automatic_push_free"):
-                # Check for collisions between convex hulls
-                for other_node in BreadthFirstIterator(root):
-                    # Ignore root, ourselves and anything that is not a normal SceneNode.
-                    if other_node is root or type(other_node) is not SceneNode or other_node is node:
-                        continue
-                    
-                    # Ignore colissions of a group with it's own children
-                    if other_node in node.getAllChildren() or node in other_node.getAllChildren():
-                        continue
-                    
-                    # Ignore colissions within a group
-                    if other_node.getParent().callDecoration("isGroup") is not None or node.getParent().callDecoration("isGroup") is not None:
-                        continue
-                        #if node.getParent().callDecoration("isGroup") is other_node.getParent().callDecoration("isGroup"):
-                        #    continue
-                    
-                    # Ignore nodes that do not have the right properties set.
-                    if not other_node.callDecoration("getConvexHull") or not other_node.getBoundingBox():
-                        continue
-
-                    # Check to see if the bounding boxes intersect. If not, we can ignore the node as there is no way the hull intersects.
-                    #if node.getBoundingBox().intersectsBox(other_node.getBoundingBox()) == AxisAlignedBox.IntersectionResult.NoIntersection:
-                    #    continue
-
-                    # Get the overlap distance for both convex hulls. If this returns None, there is no intersection.
-                    try:
-                        head_hull = node.callDecoration("getConvexHullHead")
-                        if head_hull:
-                            overlap = head_hull.intersectsPolygon(other_node.callDecoration("getConvexHull"))
-                            if not overlap:
-                                other_head_hull = other_node.callDecoration("getConvexHullHead")
-                                if other_head_hull:
-                                    overlap = node.callDecoration("getConvexHull").intersectsPolygon(other_head_hull)
-                        else:
-                            overlap = node.callDecoration("getConvexHull").intersectsPolygon(other_node.callDecoration("getConvexHull"))
-                    except:
-                        overlap = None #It can sometimes occur that the calculated convex hull has no size, in which case there is no overlap.
-
-                    if overlap is None:
-                        continue
-                    move_vector.setX(overlap[0] * 1.1)
-                    move_vector.setZ(overlap[1] * 1.1)
-            convex_hull = node.callDecoration("getConvexHull")
-            if convex_hull:
-                if not convex_hull.isValid():
-                    return
-                # Check for collisions between disallowed areas and the object
-                for area in self._build_volume.getDisallowedAreas():
-                    overlap = convex_hull.intersectsPolygon(area)
-                    if overlap is None:
-                        continue
-
-                    node._outside_buildarea = True
-
-            if move_vector != Vector():
-                op = PlatformPhysicsOperation.PlatformPhysicsOperation(node, move_vector)
-                op.push()
+                continue
+
+            if not convex_hull.isValid():
+                continue #It can sometimes occur that the calculated convex hull has no size, so it can't collide with anything.
+
+            # Nodes within a group do not collide with anything, the group itself does.
+            if node.getParent().callDecoration("isGroup") is None:
+                # The head hull contains the hull, so its box can be used for both collision tests.
+                head_hull = node.callDecoration("getConvexHullHead")
+                if head_hull and head_hull.isValid():
+                    self._broad_phase.update(node, head_hull)
+                    colliding_nodes.add(node)
+
+            # Check for collisions between disallowed areas and the object
+            for area in self._build_volume.getDisallowedAreas():
+                overlap = convex_hull.intersectsPolygon(area)
+                if overlap is None:
+                    continue
+
+                node._outside_buildarea = True
+
+        self._broad_phase.retain(colliding_nodes)
+
+        if Preferences.getInstance().getValue("physics/automatic_push_free"):
+            for node, offset in self._resolveOverlaps(colliding_nodes).items():
+                move_vectors[node].setX(float(offset[0]))
+                move_vectors[node].setZ(float(offset[1]))
+
+        # Push all moves as one operation, so they are undone together with the operation that caused them.
+        operations = [PlatformPhysicsOperation.PlatformPhysicsOperation(node, move_vector) for node, move_vector in move_vectors.items() if move_vector != Vector()]
+        if operations:
+            op = PlatformPhysicsGroupedOperation.PlatformPhysicsGroupedOperation()
+            for operation in operations:
+                op.addOperation(operation)
+            op.push()
+
+    ##  Find how far to move nodes so that none of their hulls overlap.
+    #
+    #   All overlapping pairs are pushed apart at the same time, each node of a
+    #   pair over a bit more than half the overlap. Moving nodes apart may make
+    #   them overlap other nodes, so this is repeated with the moved hulls
+    #   until nothing overlaps anymore or MaxPushFreeIterations is reached.
+    #   The nodes themselves are not moved.
+    #
+    #   \param nodes The nodes that can collide. They must be in the broad phase.
+    #   \return A dictionary of how far to move each node that needs to move, as
+    #   numpy arrays of the distance in x and z direction.
+    def _resolveOverlaps(self, nodes):
+        hulls = {} # Node -> (hull, head hull) in their original position.
+        moved_hulls = {} # Node -> (hull, head hull) moved by the offset of the node so far.
+        for node in nodes:
+            hulls[node] = (node.callDecoration("getConvexHull").getPoints(), node.callDecoration("getConvexHullHead").getPoints())
+            moved_hulls[node] = (node.callDecoration("getConvexHull"), node.callDecoration("getConvexHullHead"))
+        offsets = {}
+
+        for _ in range(self.MaxPushFreeIterations):
+            moved_nodes = set()
+            for node, other_node in self._broad_phase.getCandidatePairs():
+                overlap = self._getOverlap(moved_hulls[node], moved_hulls[other_node])
+                if overlap is None:
+                    continue
+                push = numpy.array(overlap, numpy.float64) * 0.55
+                offsets[node] = offsets.get(node, 0) + push
+                offsets[other_node] = offsets.get(other_node, 0) - push
+                moved_nodes.add(node)
+                moved_nodes.add(other_node)
+
+            if not moved_nodes:
+                break
+
+            for node in moved_nodes:
+                hull, head_hull = hulls[node]
+                moved_hulls[node] = (Polygon(hull + offsets[node]), Polygon(head_hull + offsets[node]))
+                self._broad_phase.update(node, moved_hulls[node][1])
+
+        return offsets
+
+    ##  Get the distance over which the hulls of two nodes overlap.
+    #
+    #   \param hulls The hull and head hull of the first node.
+    #   \param other_hulls The hull and head hull of the other node.
+    #   \return The distance to move the first node to no longer overlap the
+    #   other node, or None if they do not overlap.
+    def _getOverlap(self, hulls, other_hulls):
+        hull, head_hull = hulls
+        other_hull, other_head_hull = other_hulls
+
+        # Get the overlap distance for both convex hulls. If this returns None, there is no intersection.
+        try:
+            overlap = head_hull.intersectsPolygon(other_hull)
+            if not overlap:
+                overlap = hull.intersectsPolygon(other_head_hull)
+        except:
+            overlap = None #It can sometimes occur that the calculated convex hull has no size, in which case there is no overlap.
+        return overlap
 
     def _onToolOperationStarted(self, tool):
         self._enabled = False
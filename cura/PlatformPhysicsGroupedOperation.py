@@ -0,0 +1,24 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Operations.GroupedOperation import GroupedOperation
+
+##  A group of PlatformPhysicsOperations that is undone and redone as one.
+#
+#   Like a single PlatformPhysicsOperation, it modifies the previous operation:
+#   it is always merged into the operation that caused the moves.
+class PlatformPhysicsGroupedOperation(GroupedOperation):
+    def __init__(self):
+        super().__init__()
+        self._always_merge = True
+
+    def mergeWith(self, other):
+        group = GroupedOperation()
+
+        group.addOperation(self)
+        group.addOperation(other)
+
+        return group
+
+    def __repr__(self):
+        return "PlatformPhysicsGroupedOperation(operations = {0})".format(len(self._children))
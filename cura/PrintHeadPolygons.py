@@ -0,0 +1,106 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Application import Application
+from UM.Math.Polygon import Polygon
+
+import copy
+import numpy
+import threading
+
+##  The shapes of the print head of the current machine, as used for the hulls
+#   of objects that are printed one at a time.
+#
+#   The shapes only depend on the head settings of the machine, so they are
+#   made once and shared by the hulls of all objects, until one of those
+#   settings changes or another stack becomes the global stack. Every time that
+#   happens the generation increases, so that hulls that were made with the old
+#   shapes can be told apart.
+class PrintHeadPolygons:
+    ##  The settings that the shapes are made of.
+    _head_setting_keys = {"machine_head_with_fans_polygon", "machine_head_polygon"}
+
+    ##  The settings that decide whether the shapes are part of the hulls.
+    _sequence_setting_keys = {"print_sequence"}
+
+    def __init__(self):
+        self._stack = None
+        self._polygons = None # Tuple of the head with fans, its intersection with its mirror image and the head without fans.
+        self._generation = 0 # Increases whenever the shapes change.
+        self._lock = threading.Lock() # The shapes are used by hull jobs on other threads.
+
+        Application.getInstance().globalContainerStackChanged.connect(self._onGlobalContainerStackChanged)
+        self._onGlobalContainerStackChanged()
+
+    ##  Get the head with its fans.
+    #
+    #   The full head hull of an object is made with this.
+    def getHeadAndFans(self):
+        return self._getPolygons()[0]
+
+    ##  Get the part of the head with its fans that is on all sides of the
+    #   nozzle: the intersection of the head with its mirror image.
+    #
+    #   The head hull of an object is made with this.
+    def getMirroredHeadAndFans(self):
+        return self._getPolygons()[1]
+
+    ##  Get the head without its fans.
+    #
+    #   The hull of an object is made with this.
+    def getHead(self):
+        return self._getPolygons()[2]
+
+    ##  Get the generation of the shapes.
+    #
+    #   The generation also increases when the print sequence changes, since
+    #   that decides whether the shapes are used at all. The hulls of objects
+    #   that were made while the generation was different are out of date.
+    def getGeneration(self):
+        return self._generation
+
+    def _getPolygons(self):
+        with self._lock:
+            if self._polygons is None:
+                self._polygons = self._createPolygons()
+            return self._polygons
+
+    def _createPolygons(self):
+        if not self._stack:
+            empty = Polygon(numpy.zeros((0, 2), numpy.float32))
+            return empty, empty, empty
+
+        head_and_fans = Polygon(numpy.array(self._stack.getProperty("machine_head_with_fans_polygon", "value"), numpy.float32))
+        mirrored = copy.deepcopy(head_and_fans)
+        mirrored.mirror([0, 0], [0, 1]) #Mirror horizontally.
+        mirrored.mirror([0, 0], [1, 0]) #Mirror vertically.
+        mirrored_head_and_fans = head_and_fans.intersectionConvexHulls(mirrored)
+        head = Polygon(numpy.array(self._stack.getProperty("machine_head_polygon", "value"), numpy.float32))
+        return head_and_fans, mirrored_head_and_fans, head
+
+    def _onPropertyChanged(self, key, property_name):
+        if key in self._head_setting_keys:
+            self._invalidate()
+        elif key in self._sequence_setting_keys:
+            with self._lock:
+                self._generation += 1
+
+    def _onContainersChanged(self, container = None):
+        self._invalidate()
+
+    def _invalidate(self):
+        with self._lock:
+            self._polygons = None
+            self._generation += 1
+
+    def _onGlobalContainerStackChanged(self):
+        if self._stack:
+            self._stack.propertyChanged.disconnect(self._onPropertyChanged)
+            self._stack.containersChanged.disconnect(self._onContainersChanged)
+
+        self._stack = Application.getInstance().getGlobalContainerStack()
+
+        if self._stack:
+            self._stack.propertyChanged.connect(self._onPropertyChanged)
+            self._stack.containersChanged.connect(self._onContainersChanged)
+        self._onContainersChanged()
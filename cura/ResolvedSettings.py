@@ -0,0 +1,154 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Application import Application
+from UM.Settings.Validator import ValidatorState
+
+import threading
+
+##  The resolved values of all settings of the global container stack.
+#
+#   Resolving a setting through the stack evaluates its inheritance, which is
+#   slow when it is done for every setting. This keeps the resolved values
+#   and validation states, so that the code that needs all settings (slicing,
+#   validation and writing g-code) only resolves the settings that changed
+#   since the last time.
+#
+#   A setting is resolved again when the stack reports that one of its
+#   properties changed. Everything is resolved again when the containers of
+#   the stack change or when another stack becomes the global stack.
+#
+#   The settings with an invalid value are tracked the same way: only the
+#   settings that changed are validated again.
+class ResolvedSettings:
+    def __init__(self):
+        self._stack = None
+        self._keys = None # The keys of all settings in the stack, or None if not known yet.
+        self._values = {}
+        self._validation_states = {}
+        self._invalid_keys = set()
+        self._unvalidated_keys = None # Keys that changed since they were last validated, or None for all keys.
+        self._generation = 0 # Increases whenever anything is forgotten, so that results resolved outside the lock can be checked for being stale.
+        self._lock = threading.RLock() # Resolving a setting may cause signals that come back here.
+
+        Application.getInstance().globalContainerStackChanged.connect(self._onGlobalContainerStackChanged)
+        self._onGlobalContainerStackChanged()
+
+    ##  Get the keys of all settings.
+    def getAllKeys(self):
+        with self._lock:
+            if self._keys is not None:
+                return self._keys
+            stack = self._stack
+            generation = self._generation
+
+        keys = set(stack.getAllKeys()) if stack else set()
+        with self._lock:
+            if self._generation == generation:
+                self._keys = keys
+        return keys
+
+    ##  Get the value of a setting.
+    def getValue(self, key):
+        return self._getProperties([key], "value")[key]
+
+    ##  Get the validation state of a setting.
+    #
+    #   \return The validation state, or None if no instance overrides the
+    #   setting.
+    def getValidationState(self, key):
+        return self._getProperties([key], "validationState")[key]
+
+    ##  Get the keys of all settings that have an invalid value.
+    #
+    #   Only the settings that changed since the last call are validated.
+    #
+    #   \return A set of setting keys.
+    def getInvalidKeys(self):
+        keys = self.getAllKeys()
+        with self._lock:
+            unvalidated_keys = keys if self._unvalidated_keys is None else set(self._unvalidated_keys)
+            invalid_keys = set(self._invalid_keys)
+            generation = self._generation
+
+        validation_states = self._getProperties([key for key in unvalidated_keys if key in keys], "validationState")
+        for key in unvalidated_keys:
+            #Only setting instances have a validation state, so settings which
+            #are not overwritten by any instance will have none. The property
+            #then, and only then, evaluates to None. We make the assumption that
+            #the definition defines the setting with a default value that is
+            #valid. Therefore we can allow both ValidatorState.Valid and None as
+            #allowable validation states.
+            validation_state = validation_states.get(key)
+            if validation_state is not None and validation_state != ValidatorState.Valid:
+                invalid_keys.add(key)
+            else:
+                invalid_keys.discard(key)
+
+        with self._lock:
+            if self._generation == generation: #Otherwise settings changed while validating, so validate them again next time.
+                self._invalid_keys = invalid_keys
+                self._unvalidated_keys = set()
+        return set(invalid_keys)
+
+    ##  Get the values of all settings.
+    #
+    #   \return A new dictionary of setting keys to their values.
+    def getAllValues(self):
+        return self._getProperties(self.getAllKeys(), "value")
+
+    ##  Get a property of settings, resolving the ones that are not known yet.
+    #
+    #   The settings are resolved without holding the lock, so that the
+    #   signals of the stack are not blocked while resolving many settings on
+    #   another thread. The resolved properties are only kept if no setting
+    #   changed in the meantime.
+    #
+    #   \param keys The keys of the settings.
+    #   \param property_name The name of the property, either "value" or
+    #   "validationState".
+    #   \return A new dictionary of the setting keys to their properties.
+    def _getProperties(self, keys, property_name):
+        with self._lock:
+            cache = self._values if property_name == "value" else self._validation_states
+            properties = { key: cache[key] for key in keys if key in cache }
+            stack = self._stack
+            generation = self._generation
+
+        resolved = { key: stack.getProperty(key, property_name) if stack else None for key in keys if key not in properties }
+        if resolved:
+            with self._lock:
+                if self._generation == generation:
+                    cache.update(resolved)
+            properties.update(resolved)
+        return properties
+
+    def _onPropertyChanged(self, key, property_name):
+        with self._lock:
+            # Any property of a setting can change its value or validation state, so forget both.
+            self._generation += 1
+            self._values.pop(key, None)
+            self._validation_states.pop(key, None)
+            if self._unvalidated_keys is not None:
+                self._unvalidated_keys.add(key)
+
+    def _onContainersChanged(self, container = None):
+        with self._lock:
+            self._generation += 1
+            self._keys = None
+            self._values = {}
+            self._validation_states = {}
+            self._invalid_keys = set()
+            self._unvalidated_keys = None
+
+    def _onGlobalContainerStackChanged(self):
+        if self._stack:
+            self._stack.propertyChanged.disconnect(self._onPropertyChanged)
+            self._stack.containersChanged.disconnect(self._onContainersChanged)
+
+        self._stack = Application.getInstance().getGlobalContainerStack()
+
+        if self._stack:
+            self._stack.propertyChanged.connect(self._onPropertyChanged)
+            self._stack.containersChanged.connect(self._onContainersChanged)
+        self._onContainersChanged()
@@ -11,15 +11,18 @@ from UM.Qt.Bindings.BackendProxy import BackendState #To determine the state of
 from UM.Message import Message
 from UM.PluginRegistry import PluginRegistry
 from UM.Resources import Resources
-from UM.Settings.Validator import ValidatorState #To find if a setting is in an error state. We can't slice then.
 
 from cura.OneAtATimeIterator import OneAtATimeIterator
 from . import ProcessSlicedLayersJob
 from . import ProcessGCodeJob
 from . import StartSliceJob
+from . import SliceCache
+from . import SpliceGroupsJob
 
+import collections
 import os
 import sys
+import time
 
 from PyQt5.QtCore import QTimer
 
@@ -45,6 +48,12 @@ class CuraEngineBackend(Backend):
             default_engine_location += ".exe"
         default_engine_location = os.path.abspath(default_engine_location)
         Preferences.getInstance().addPreference("backend/location", default_engine_location)
+        Preferences.getInstance().addPreference("backend/persistent_engine", True) #Keep the engine running when a slice is cancelled, instead of restarting it.
+        Preferences.getInstance().addPreference("backend/slice_cache_memory_size", 256) #Maximum size of the slice results kept in memory, in MB.
+        Preferences.getInstance().addPreference("backend/slice_cache_disk_size", 0) #Maximum size of the slice results kept on disk, in MB. 0 keeps results in memory only.
+        Preferences.getInstance().addPreference("backend/send_settings_delta", False) #Only send the settings that changed since the last slice to a persistent engine, if the engine reports that it supports this.
+        Preferences.getInstance().addPreference("backend/slice_groups_separately", False) #When printing one at a time, slice and cache every group of objects on its own and join the g-code.
+        Preferences.getInstance().addPreference("backend/send_indexed_meshes", False) #Send meshes as unique vertices with indices instead of three vertices for every face. Requires an engine that reads the indices.
 
         self._scene = Application.getInstance().getController().getScene()
         self._scene.sceneChanged.connect(self._onSceneChanged)
@@ -67,6 +76,13 @@ class CuraEngineBackend(Backend):
         self._change_timer.setSingleShot(True)
         self._change_timer.timeout.connect(self.slice)
 
+        #The engine can't be told to stop a slice, so a cancelled slice keeps the engine busy until it is done.
+        #If it takes longer than restarting the engine would, the engine is restarted so that the next slice doesn't have to wait for it.
+        self._stale_slice_timer = QTimer()
+        self._stale_slice_timer.setInterval(self.MinimumStaleSliceTime)
+        self._stale_slice_timer.setSingleShot(True)
+        self._stale_slice_timer.timeout.connect(self._onStaleSliceTimeout)
+
         #Listeners for receiving messages from the back-end.
         self._message_handlers["cura.proto.Layer"] = self._onLayerMessage
         self._message_handlers["cura.proto.Progress"] = self._onProgressMessage
@@ -74,13 +90,41 @@ class CuraEngineBackend(Backend):
         self._message_handlers["cura.proto.GCodePrefix"] = self._onGCodePrefixMessage
         self._message_handlers["cura.proto.ObjectPrintTime"] = self._onObjectPrintTimeMessage
         self._message_handlers["cura.proto.SlicingFinished"] = self._onSlicingFinishedMessage
+        self._message_handlers["cura.proto.SettingsResync"] = self._onSettingsResyncMessage
+        self._message_handlers["cura.proto.EngineFeatures"] = self._onEngineFeaturesMessage
 
         self._start_slice_job = None
         self._slicing = False #Are we currently slicing?
         self._restart = False #Back-end is currently restarting?
         self._enabled = True #Should we be slicing? Slicing might be paused when, for instance, the user is dragging the mesh around.
-        self._always_restart = True #Always restart the engine when starting a new slice. Don't keep the process running. TODO: Fix engine statelessness.
+        self._always_restart = not Preferences.getInstance().getValue("backend/persistent_engine") #Always restart the engine when starting a new slice. Don't keep the process running.
+        self._slice_in_engine = False #Has the slice message of the current slice been sent to the engine?
+        self._stale_slices = 0 #Number of slices that were sent to the engine but were cancelled since. Their output is discarded.
+        self._engine_start_time = None #When the engine process was started, if it didn't connect yet.
         self._process_layers_job = None #The currently active job to process layers, or None if it is not processing layers.
+        self._send_settings_delta = Preferences.getInstance().getValue("backend/send_settings_delta") #Only send the settings that changed to a persistent engine.
+        self._engine_settings_delta = False #Did the engine report that it can apply only the settings that changed?
+        self._sent_settings = None #The global settings that the engine has, as sent to it, or None if the engine has no settings.
+        self._settings_generation = 0 #Generation of the last settings message sent to the engine. Never decreases, so an old generation can't be mistaken for a new one.
+
+        #Results of earlier slices, so that slicing the same scene with the same settings again doesn't need the engine.
+        self._slice_cache = SliceCache.SliceCache(
+            Preferences.getInstance().getValue("backend/slice_cache_memory_size") * 1024 * 1024,
+            Preferences.getInstance().getValue("backend/slice_cache_disk_size") * 1024 * 1024,
+            os.path.join(Resources.getCacheStoragePath(), "slice_cache"))
+        self._slice_cache_key = None #Key under which to cache the result of the slice in the engine, or None if it should not be cached.
+        self._print_times = [] #(Time, material amount) of each ObjectPrintTime message of the current slice.
+
+        #Slicing groups of objects separately when printing one at a time.
+        self._slice_groups_separately = Preferences.getInstance().getValue("backend/slice_groups_separately")
+        self._group_slices = [] #(Cache key, slice message) of each group of the current slice, or empty if the groups are sliced together.
+        self._group_results = [] #SliceResult of each group of the current slice, or None if the engine didn't send it yet.
+        self._pending_groups = collections.deque() #Indices of the groups that were sent to the engine and are not finished yet.
+        self._group_slice_count = 0 #Number of groups of the current slice that were sent to the engine.
+        self._group_gcode = None #(Start g-code, end g-code) as sent to the engine for the current slice.
+        self._unspliceable_gcode = None #(Start g-code, end g-code) with which the groups could not be joined, so slice as a whole.
+        self._slice_groups_together = False #Slice the groups of the next slice together, because joining them failed.
+        self._splice_groups_job = None #The job that joins the results of the groups of the current slice, if it is running.
 
         self._message = None #Pop-up message that shows the slicing progress bar (or an error message).
 
@@ -91,6 +135,8 @@ class CuraEngineBackend(Backend):
         Application.getInstance().getController().toolOperationStarted.connect(self._onToolOperationStarted)
         Application.getInstance().getController().toolOperationStopped.connect(self._onToolOperationStopped)
 
+        Preferences.getInstance().preferenceChanged.connect(self._onPreferenceChanged)
+
     ##  Called when closing the application.
     #
     #   This function should terminate the engine process.
@@ -109,11 +155,30 @@ class CuraEngineBackend(Backend):
     def close(self):
         self._terminate()   # Forcefully shutdown the backend.
 
+    ##  Start the engine process.
+    #
+    #   The time it takes the engine to connect is how long it takes to
+    #   restart the engine, which determines how long a cancelled slice may keep
+    #   running in it.
+    def startEngine(self):
+        self._engine_start_time = time.monotonic()
+        super().startEngine()
+
+    ##  Get the cache with the results of earlier slices.
+    #
+    #   The cache keeps track of its hit and miss counts.
+    def getSliceCache(self):
+        return self._slice_cache
+
     ##  Emitted when we get a message containing print duration and material amount. This also implies the slicing has finished.
     #   \param time The amount of time the print will take.
     #   \param material_amount The amount of material the print will use.
     printDurationMessage = Signal()
 
+    ##  Minimum time to let a cancelled slice finish in the engine before
+    #   restarting the engine, in milliseconds.
+    MinimumStaleSliceTime = 1000
+
     ##  Emitted when the slicing process starts.
     slicingStarted = Signal()
 
@@ -128,32 +193,25 @@ class CuraEngineBackend(Backend):
             return
 
         if self._slicing: #We were already slicing. Stop the old job.
-            self._terminate()
+            self._stopSlicing()
 
-        if self._process_layers_job: #We were processing layers. Stop that, the layers are going to change soon.
-            self._process_layers_job.abort()
-            self._process_layers_job = None
+        self._abortProcessingLayers() #The layers are going to change soon.
 
         #Don't slice if there is a setting with an error value.
-        stack = Application.getInstance().getGlobalContainerStack()
-        for key in stack.getAllKeys():
-            validation_state = stack.getProperty(key, "validationState")
-            #Only setting instances have a validation state, so settings which
-            #are not overwritten by any instance will have none. The property
-            #then, and only then, evaluates to None. We make the assumption that
-            #the definition defines the setting with a default value that is
-            #valid. Therefore we can allow both ValidatorState.Valid and None as
-            #allowable validation states.
-            #TODO: This assumption is wrong! If the definition defines an inheritance function that through inheritance evaluates to a disallowed value, a setting is still invalid even though it's default!
-            #TODO: Therefore we must also validate setting definitions.
-            if validation_state != None and validation_state != ValidatorState.Valid:
-                Logger.log("w", "Setting %s is not valid, but %s. Aborting slicing.", key, validation_state)
-                if self._message: #Hide any old message before creating a new one.
-                    self._message.hide()
-                    self._message = None
-                self._message = Message(catalog.i18nc("@info:status", "Unable to slice. Please check your setting values for errors."))
-                self._message.show()
-                return
+        #The invalid settings are tracked as settings change, so this doesn't need to validate all settings.
+        #TODO: Settings that are not overwritten by any instance are assumed to be valid. This assumption is wrong! If the definition defines an inheritance function that through inheritance evaluates to a disallowed value, a setting is still invalid even though it's default!
+        #TODO: Therefore we must also validate setting definitions.
+        invalid_keys = Application.getInstance().getResolvedSettings().getInvalidKeys()
+        if invalid_keys:
+            Logger.log("w", "Settings %s are not valid. Aborting slicing.", ", ".join(sorted(invalid_keys)))
+            if self._message: #Hide any old message before creating a new one.
+                self._message.hide()
+                self._message = None
+            stack = Application.getInstance().getGlobalContainerStack()
+            labels = sorted(str(stack.getProperty(key, "label") or key) for key in invalid_keys)
+            self._message = Message(catalog.i18nc("@info:status", "Unable to slice. Please check your setting values for errors: {0}").format(", ".join(labels)))
+            self._message.show()
+            return
 
         self.processingProgress.emit(0.0)
         self.backendStateChange.emit(BackendState.NOT_STARTED)
@@ -164,22 +222,100 @@ class CuraEngineBackend(Backend):
             self._message.show()
 
         self._scene.gcode_list = []
+        self._print_times = []
+        self._slice_cache_key = None
         self._slicing = True
         self.slicingStarted.emit()
 
         slice_message = self._socket.createMessage("cura.proto.Slice")
         settings_message = self._socket.createMessage("cura.proto.SettingList");
-        self._start_slice_job = StartSliceJob.StartSliceJob(slice_message, settings_message)
+        sent_settings = None
+        if self._send_settings_delta and self._engine_settings_delta and not self._always_restart:
+            sent_settings = self._sent_settings
+        create_message = None
+        if self._slice_groups_separately and not self._always_restart and not self._slice_groups_together: #Several slices are sent at once, so the engine must keep running.
+            create_message = self._socket.createMessage
+        self._slice_groups_together = False
+        self._start_slice_job = StartSliceJob.StartSliceJob(slice_message, settings_message, sent_settings, self._settings_generation, create_message, self._slice_cache)
         self._start_slice_job.start()
         self._start_slice_job.finished.connect(self._onStartSliceCompleted)
 
+    ##  Stop the slice that is currently in progress.
+    #
+    #   With a persistent engine the slice is cancelled in-band: the engine
+    #   process is kept and whatever it still sends for the cancelled slice is
+    #   discarded. Otherwise the engine process is terminated.
+    #
+    #   The engine can't be told to stop a slice, so it still finishes every
+    #   cancelled slice before it starts on the next one. To not let the next
+    #   slice wait for more than one cancelled slice, the engine process is
+    #   terminated as well if a cancelled slice is still running in it, or if
+    #   several groups were sent to it. A cancelled slice that doesn't finish
+    #   within the time a restart of the engine takes gets the engine terminated
+    #   too, see _onStaleSliceTimeout().
+    def _stopSlicing(self):
+        if self._always_restart or self._stale_slices > 0 or len(self._pending_groups) > 1:
+            self._terminate()
+        else:
+            self._cancelSlice()
+
+    ##  Cancel the current slice without terminating the engine process.
+    #
+    #   The engine handles its messages in order, so the output of a cancelled
+    #   slice always arrives before the output of any slice sent after it. We
+    #   only need to count how many cancelled slices are still in the engine and
+    #   ignore their messages up to and including their SlicingFinished message.
+    def _cancelSlice(self):
+        self._slicing = False
+        self._slice_cache_key = None
+        self._splice_groups_job = None
+        self._stored_layer_data = []
+        if self._start_slice_job is not None:
+            self._start_slice_job.cancel()
+        self._abortProcessingLayers()
+
+        if self._slice_in_engine:
+            self._stale_slices += max(1, len(self._pending_groups)) #Every group that was sent is a slice of its own.
+            self._slice_in_engine = False
+            self._stale_slice_timer.start()
+        self._clearGroupSlices()
+
+        self.slicingCancelled.emit()
+        self.processingProgress.emit(0)
+        Logger.log("d", "Cancelled the current slice, %s stale slice(s) left in the engine", self._stale_slices)
+
+        if self._message:
+            self._message.hide()
+            self._message = None
+
+    ##  Called when a cancelled slice didn't finish within the time that
+    #   restarting the engine takes.
+    #
+    #   Waiting for it would make the next slice slower than restarting the
+    #   engine, so the engine is terminated. Once the new engine is connected,
+    #   the scene is sliced again.
+    def _onStaleSliceTimeout(self):
+        if not self._stale_slices:
+            return
+        Logger.log("d", "A cancelled slice is still running in the engine, restarting the engine")
+        self._terminate()
+
     ##  Terminate the engine process.
     def _terminate(self):
         self._slicing = False
         self._restart = True
+        self._slice_in_engine = False
+        self._stale_slices = 0 #The process is gone, so are the slices in it.
+        self._stale_slice_timer.stop()
+        self._splice_groups_job = None
+        self._sent_settings = None #And so are the settings it had.
+        self._engine_settings_delta = False
+        self._slice_cache_key = None
+        self._clearGroupSlices()
         self._stored_layer_data = []
         if self._start_slice_job is not None:
             self._start_slice_job.cancel()
+        self._abortProcessingLayers()
 
         self.slicingCancelled.emit()
         self.processingProgress.emit(0)
@@ -215,9 +351,50 @@ class CuraEngineBackend(Backend):
                 self._message = None
             return
         else:
+            cache_key = job.getCacheKey()
+            result = job.getCachedResult()
+            if result:
+                #We sliced exactly this before. Use that result instead of asking the engine.
+                Logger.log("d", "Using cached slice result %s (%s hits, %s misses)", cache_key, self._slice_cache.getHitCount(), self._slice_cache.getMissCount())
+                self._scene.gcode_list = list(result.getGCodeList())
+                for time, material_amount in result.getPrintTimes():
+                    self.printDurationMessage.emit(time, material_amount)
+                self._stored_layer_data = list(result.getLayers())
+                self._finishSlicing()
+                return
+
+            self._slice_cache_key = cache_key
+            group_slices = job.getGroupSlices()
+            if group_slices:
+                encoded_settings = job.getEncodedSettings()
+                self._group_gcode = (encoded_settings["machine_start_gcode"].decode("utf-8"), encoded_settings["machine_end_gcode"].decode("utf-8"))
+                if self._group_gcode == self._unspliceable_gcode: #Joining the groups would fail again.
+                    self._slice_groups_together = True
+                    self._group_gcode = None
+                    self.slice()
+                    return
+
+                self._group_slices = group_slices
+                self._group_results = list(job.getCachedGroupResults())
+                self._pending_groups = collections.deque(index for index, result in enumerate(self._group_results) if result is None)
+                self._group_slice_count = len(self._pending_groups)
+                Logger.log("d", "Slicing %s of %s groups, the others are cached", self._group_slice_count, len(group_slices))
+                if not self._pending_groups:
+                    self._finishGroupSlicing()
+                    return
+
             # Preparation completed, send it to the backend.
-            self._socket.sendMessage(job.getSettingsMessage())
-            self._socket.sendMessage(job.getSliceMessage())
+            self._settings_generation += 1
+            settings_message = job.getSettingsMessage()
+            settings_message.generation = self._settings_generation
+            self._socket.sendMessage(settings_message)
+            if self._pending_groups:
+                for index in self._pending_groups:
+                    self._socket.sendMessage(self._group_slices[index][1])
+            else:
+                self._socket.sendMessage(job.getSliceMessage())
+            self._sent_settings = job.getEncodedSettings()
+            self._slice_in_engine = True
 
     ##  Listener for when the scene has changed.
     #
@@ -247,7 +424,7 @@ class CuraEngineBackend(Backend):
             return
 
         super()._onSocketError(error)
-        self._terminate()
+        self._terminate() #Also for a persistent engine: we can't trust the process any more, so restart it.
 
         if error.getErrorCode() not in [Arcus.ErrorCode.BindFailedError, Arcus.ErrorCode.ConnectionResetError, Arcus.ErrorCode.Debug]:
             Logger.log("e", "A socket error caused the connection to be reset")
@@ -264,22 +441,147 @@ class CuraEngineBackend(Backend):
     #
     #   \param message The protobuf message containing sliced layer data.
     def _onLayerMessage(self, message):
+        if self._stale_slices:
+            return
         self._stored_layer_data.append(message)
 
+        #Process the layers for the layer view while the engine is still busy with the rest of the slice.
+        #A job that was started keeps getting the layers, also if the user left the layer view since.
+        #Groups that are sliced separately are only shown once they are joined.
+        if self._process_layers_job is not None:
+            self._process_layers_job.addLayer(message)
+        elif self._layer_view_active and not self._pending_groups:
+            self._startProcessingLayers()
+
     ##  Called when a progress message is received from the engine.
     #
     #   \param message The protobuf message containing the slicing progress.
     def _onProgressMessage(self, message):
+        if self._stale_slices:
+            return
+        amount = message.amount
+        if self._pending_groups: #The engine reports the progress of each group separately.
+            amount = (self._group_slice_count - len(self._pending_groups) + amount) / self._group_slice_count
         if self._message:
-            self._message.setProgress(round(message.amount * 100))
+            self._message.setProgress(round(amount * 100))
 
-        self.processingProgress.emit(message.amount)
+        self.processingProgress.emit(amount)
         self.backendStateChange.emit(BackendState.PROCESSING)
 
     ##  Called when the engine sends a message that slicing is finished.
     #
     #   \param message The protobuf message signalling that slicing is finished.
     def _onSlicingFinishedMessage(self, message):
+        if self._stale_slices: #This is the end of a cancelled slice. The slice after it is the next one to send output.
+            self._stale_slices -= 1
+            return
+
+        if self._pending_groups: #One of the groups that are sliced separately is done.
+            index = self._pending_groups.popleft()
+            result = SliceCache.SliceResult(list(self._scene.gcode_list), list(self._stored_layer_data), list(self._print_times))
+            self._slice_cache.put(self._group_slices[index][0], result)
+            self._group_results[index] = result
+            self._scene.gcode_list = []
+            self._stored_layer_data = []
+            self._print_times = []
+            if not self._pending_groups:
+                self._slice_in_engine = False
+                self._finishGroupSlicing()
+            return
+
+        self._slice_in_engine = False
+        if self._slice_cache_key:
+            self._slice_cache.put(self._slice_cache_key, SliceCache.SliceResult(list(self._scene.gcode_list), list(self._stored_layer_data), list(self._print_times)))
+            self._slice_cache_key = None
+
+        self._finishSlicing()
+
+    ##  Join the results of the groups that were sliced separately.
+    #
+    #   This is done by a job, since it reads all g-code and layers of all
+    #   groups. If the results can't be joined, the slice is started again with
+    #   all groups together.
+    def _finishGroupSlicing(self):
+        stack = Application.getInstance().getGlobalContainerStack()
+        start_gcode, end_gcode = self._group_gcode
+        retraction_amount = stack.getProperty("retraction_amount", "value") if stack.getProperty("retraction_enable", "value") else 0
+        self._splice_groups_job = SpliceGroupsJob.SpliceGroupsJob(self._group_results, start_gcode, end_gcode, stack.getProperty("speed_travel", "value"), stack.getProperty("machine_height", "value"),
+                                                                  retraction_amount, stack.getProperty("retraction_retract_speed", "value"), stack.getProperty("retraction_prime_speed", "value"))
+        self._clearGroupSlices()
+        self._splice_groups_job.finished.connect(self._onSpliceGroupsCompleted)
+        self._splice_groups_job.start()
+
+    ##  Called when the job that joins the results of the groups is done.
+    #
+    #   \param job The SpliceGroupsJob that is done.
+    def _onSpliceGroupsCompleted(self, job):
+        if job is not self._splice_groups_job: #The slice was cancelled in the meantime.
+            return
+        self._splice_groups_job = None
+
+        result = job.getResult()
+        if result is None:
+            Logger.log("w", "Unable to find the start and end g-code or the first move in the g-code of the groups. Slicing all groups together.")
+            self._unspliceable_gcode = job.getGCode()
+            self._slice_groups_together = True
+            self._slice_cache_key = None
+            self.slice()
+            return
+
+        if self._slice_cache_key:
+            self._slice_cache.put(self._slice_cache_key, result)
+            self._slice_cache_key = None
+        self._scene.gcode_list = list(result.getGCodeList())
+        self._print_times = list(result.getPrintTimes())
+        for time, material_amount in self._print_times:
+            self.printDurationMessage.emit(time, material_amount)
+        self._stored_layer_data = list(result.getLayers())
+        self._finishSlicing()
+
+    ##  Forget the groups of the current slice.
+    def _clearGroupSlices(self):
+        self._group_slices = []
+        self._group_results = []
+        self._pending_groups = collections.deque()
+        self._group_slice_count = 0
+        self._group_gcode = None
+
+    ##  Called when the engine didn't have the settings that the settings
+    #   message of a slice only contained the changes of.
+    #
+    #   The engine skipped that slice. It sends this message instead of the
+    #   SlicingFinished message of the slice.
+    #
+    #   \param message The protobuf message with the generation of the
+    #   settings that the engine could not apply.
+    def _onSettingsResyncMessage(self, message):
+        Logger.log("d", "Engine requested all settings again for settings generation %s", message.generation)
+        self._sent_settings = None #Send all settings with the next slice.
+        if self._stale_slices: #A cancelled slice was skipped. Nothing to do for it.
+            self._stale_slices -= 1
+            return
+
+        #The current slice was skipped, so start it again with all settings.
+        #The engine skips any other groups that were sent with the same settings as well.
+        if self._pending_groups:
+            self._stale_slices += len(self._pending_groups) - 1
+        self._slice_in_engine = False
+        self._slice_cache_key = None
+        self.slice()
+
+    ##  Called when the engine reports which optional features of the
+    #   protocol it supports.
+    #
+    #   \param message The protobuf message with the features.
+    def _onEngineFeaturesMessage(self, message):
+        self._engine_settings_delta = message.settings_delta
+        Logger.log("d", "Engine supports settings deltas: %s", self._engine_settings_delta)
+
+    ##  Finish a slice once all of its output has been received.
+    #
+    #   This is called both for slices from the engine and for slices of which
+    #   the result was found in the slice cache.
+    def _finishSlicing(self):
         self.backendStateChange.emit(BackendState.DONE)
         self.processingProgress.emit(1.0)
 
@@ -290,15 +592,36 @@ class CuraEngineBackend(Backend):
             self._message.hide()
             self._message = None
 
-        if self._layer_view_active and (self._process_layers_job is None or not self._process_layers_job.isRunning()):
-            self._process_layers_job = ProcessSlicedLayersJob.ProcessSlicedLayersJob(self._stored_layer_data)
-            self._process_layers_job.start()
+        #A job that is processing the layers waits for the rest of them, whatever the active view is now.
+        if self._process_layers_job is not None:
+            self._process_layers_job.finishLayers()
+            self._stored_layer_data = []
+        elif self._layer_view_active:
+            self._startProcessingLayers()
             self._stored_layer_data = []
 
+    ##  Start a job that turns the layer messages into layer data.
+    #
+    #   While slicing, the job keeps processing layers as they come in until
+    #   the slice is finished.
+    def _startProcessingLayers(self):
+        self._process_layers_job = ProcessSlicedLayersJob.ProcessSlicedLayersJob(self._stored_layer_data)
+        if not self._slicing:
+            self._process_layers_job.finishLayers()
+        self._process_layers_job.start()
+
+    ##  Stop processing layers, if we were.
+    def _abortProcessingLayers(self):
+        if self._process_layers_job:
+            self._process_layers_job.abort()
+            self._process_layers_job = None
+
     ##  Called when a g-code message is received from the engine.
     #
     #   \param message The protobuf message containing g-code, encoded as UTF-8.
     def _onGCodeLayerMessage(self, message):
+        if self._stale_slices:
+            return
         self._scene.gcode_list.append(message.data.decode("utf-8", "replace"))
 
     ##  Called when a g-code prefix message is received from the engine.
@@ -306,6 +629,8 @@ class CuraEngineBackend(Backend):
     #   \param message The protobuf message containing the g-code prefix,
     #   encoded as UTF-8.
     def _onGCodePrefixMessage(self, message):
+        if self._stale_slices:
+            return
         self._scene.gcode_list.insert(0, message.data.decode("utf-8", "replace"))
 
     ##  Called when a print time message is received from the engine.
@@ -313,7 +638,11 @@ class CuraEngineBackend(Backend):
     #   \param message The protobuf message containing the print time and
     #   material amount.
     def _onObjectPrintTimeMessage(self, message):
-        self.printDurationMessage.emit(message.time, message.material_amount)
+        if self._stale_slices:
+            return
+        self._print_times.append((message.time, message.material_amount))
+        if not self._pending_groups: #The print time of groups that are sliced separately is only known once they are joined.
+            self.printDurationMessage.emit(message.time, message.material_amount)
 
     ##  Creates a new socket connection.
     def _createSocket(self):
@@ -331,6 +660,12 @@ class CuraEngineBackend(Backend):
 
     ##  Called when the back-end connects to the front-end.
     def _onBackendConnected(self):
+        self._sent_settings = None #A new connection may well be a new engine.
+        self._engine_settings_delta = False #Until it reports otherwise.
+        if self._engine_start_time is not None:
+            start_time = time.monotonic() - self._engine_start_time
+            self._engine_start_time = None
+            self._stale_slice_timer.setInterval(max(self.MinimumStaleSliceTime, round(start_time * 1000)))
         if self._restart:
             self._onChanged()
             self._restart = False
@@ -342,7 +677,10 @@ class CuraEngineBackend(Backend):
     #
     #   \param tool The tool that the user is using.
     def _onToolOperationStarted(self, tool):
-        self._terminate() # Do not continue slicing once a tool has started
+        if self._always_restart:
+            self._terminate() # Do not continue slicing once a tool has started
+        elif self._slicing:
+            self._stopSlicing() # Keep the engine running if we can, but don't continue this slice
         self._enabled = False # Do not reslice when a tool is doing it's 'thing'
 
     ##  Called when the user stops using some tool.
@@ -359,12 +697,12 @@ class CuraEngineBackend(Backend):
             view = Application.getInstance().getController().getActiveView()
             if view.getPluginId() == "LayerView": #If switching to layer view, we should process the layers if that hasn't been done yet.
                 self._layer_view_active = True
-                # There is data and we're not slicing at the moment
-                # if we are slicing, there is no need to re-calculate the data as it will be invalid in a moment.
-                if self._stored_layer_data and not self._slicing:
-                    self._process_layers_job = ProcessSlicedLayersJob.ProcessSlicedLayersJob(self._stored_layer_data)
-                    self._process_layers_job.start()
-                    self._stored_layer_data = []
+                # There is data that wasn't processed yet. If we are still slicing, the job
+                # will process the rest of the layers as they come in.
+                if self._stored_layer_data and self._process_layers_job is None:
+                    self._startProcessingLayers()
+                    if not self._slicing:
+                        self._stored_layer_data = []
             else:
                 self._layer_view_active = False
 
@@ -372,7 +710,29 @@ class CuraEngineBackend(Backend):
     #
     #   We should reset our state and start listening for new connections.
     def _onBackendQuit(self):
+        self._slice_in_engine = False
+        self._stale_slices = 0
+        self._stale_slice_timer.stop()
+        self._sent_settings = None
+        self._engine_settings_delta = False
+        self._clearGroupSlices()
+        self._abortProcessingLayers() #No more layers come, so don't let the job wait for them.
         if not self._restart and self._process:
             Logger.log("d", "Backend quit with return code %s. Resetting process and socket.", self._process.wait())
             self._process = None
             self._createSocket()
+
+    ##  Called when a preference has changed.
+    #
+    #   \param preference The key of the preference that has changed.
+    def _onPreferenceChanged(self, preference):
+        if preference == "backend/persistent_engine":
+            self._always_restart = not Preferences.getInstance().getValue("backend/persistent_engine")
+        elif preference == "backend/slice_groups_separately":
+            self._slice_groups_separately = Preferences.getInstance().getValue("backend/slice_groups_separately")
+        elif preference == "backend/send_settings_delta":
+            self._send_settings_delta = Preferences.getInstance().getValue("backend/send_settings_delta")
+        elif preference == "backend/slice_cache_memory_size":
+            self._slice_cache.setMemorySize(Preferences.getInstance().getValue(preference) * 1024 * 1024)
+        elif preference == "backend/slice_cache_disk_size":
+            self._slice_cache.setDiskSize(Preferences.getInstance().getValue(preference) * 1024 * 1024)
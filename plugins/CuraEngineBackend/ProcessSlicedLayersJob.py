@@ -12,21 +12,88 @@ from UM.i18n import i18nCatalog
 
 from UM.Math.Vector import Vector
 
+from cura import Layer
 from cura import LayerData
 from cura import LayerDataDecorator
 
+from . import SliceCache
+
+import collections
 import numpy
+import threading
+import time
 
 catalog = i18nCatalog("cura")
 
 
+##  Job that turns the layer messages of the engine into layer data for the
+#   layer view.
+#
+#   The job can be started before the engine is done slicing. Layers that are
+#   added with addLayer() are processed as they come in, and while the engine
+#   is still working the layers that were processed so far are shown in the
+#   layer view now and then. When all layers have been added, finishLayers()
+#   must be called so the job can create the final layer data.
+#
+#   The job doesn't wait for layers in a thread of the job queue. When it has
+#   processed all layers that were added so far, it stops running, and adding
+#   another layer puts it in the job queue again.
 class ProcessSlicedLayersJob(Job):
+    ##  Minimum time between two updates of the layer view while layers are
+    #   still coming in, in seconds.
+    PreviewInterval = 1.0
+
+    ##  How much the line mesh must have grown since the last update of the
+    #   layer view before it is updated again while layers are still coming
+    #   in. Every update joins the buffers of all layers so far, so letting the
+    #   mesh grow by a factor between updates keeps the total work linear.
+    PreviewGrowth = 1.5
+
+    ##  Creates a new job to process layers.
+    #
+    #   \param layers The layer messages that are already available.
     def __init__(self, layers):
         super().__init__()
-        self._layers = layers
+        self._lock = threading.Lock() # Layers are added from another thread than the one that runs the job.
+        self._layer_queue = collections.deque()
+        self._added_layer_count = 0
+        self._layer_count = None # Total number of layers, known once finishLayers() is called.
+        self._scheduled = False # Whether the job is in the job queue or running.
+        self._started = False # Whether the job did its preparations.
+        self._done = False # Whether the job finished or was aborted.
         self._scene = Application.getInstance().getController().getScene()
         self._progress = None
         self._abort_requested = False
+        self._layer_data_node = None # Scene node that currently shows the processed layers.
+        self._layers = {} # Processed layers by the layer number of the engine.
+        self._element_count = 0 # Number of elements of all processed layers.
+        self._last_preview_time = time.monotonic()
+        self._preview_element_count = 0 # Number of elements that the last update of the layer view showed.
+
+        for layer in layers:
+            self._layer_queue.append(layer)
+            self._added_layer_count += 1
+
+    ##  Put the job in the job queue.
+    def start(self):
+        with self._lock:
+            self._scheduled = True
+        super().start()
+
+    ##  Add a layer message to process.
+    #
+    #   This may be called from any thread, also while the job is running.
+    def addLayer(self, layer):
+        with self._lock:
+            self._added_layer_count += 1
+            self._layer_queue.append(layer)
+        self._schedule()
+
+    ##  Indicate that all layers have been added.
+    def finishLayers(self):
+        with self._lock:
+            self._layer_count = self._added_layer_count
+        self._schedule()
 
     ##  Aborts the processing of layers.
     #
@@ -36,8 +103,85 @@ class ProcessSlicedLayersJob(Job):
     #   that the abort will stop the job any time soon or even at all.
     def abort(self):
         self._abort_requested = True
+        self._schedule() # Let the job clean up, also when it was waiting for layers.
+
+    ##  Put the job in the job queue again if it stopped to wait for layers.
+    def _schedule(self):
+        with self._lock:
+            if self._scheduled or not self._started or self._done:
+                return
+            self._scheduled = True
+        super().start()
 
     def run(self):
+        if not self._started:
+            prepared = self._prepare()
+            with self._lock:
+                self._started = True
+                self._done = not prepared
+            if not prepared:
+                return
+
+        while True:
+            with self._lock:
+                if self._abort_requested:
+                    self._done = True
+                    break
+                if not self._layer_queue:
+                    if self._layer_count is None:
+                        # Wait for more layers without keeping a thread of the job queue busy.
+                        self._scheduled = False
+                        return
+                    self._done = True
+                    break
+                message = self._layer_queue.popleft()
+
+            layer_number, layer = _processLayer(*_readLayerMessage(message))
+            self._element_count += layer.elementCount
+            self._addProcessedLayer(self._layers, layer_number, layer)
+            Job.yieldThread()
+
+            if self._progress and self._layer_count:
+                self._progress.setProgress((len(self._layers) / self._layer_count) * 100)
+
+            # While the engine is still slicing, show what we have so far now and then.
+            if self._layer_count is None and time.monotonic() - self._last_preview_time > self.PreviewInterval:
+                if self._element_count >= self._preview_element_count * self.PreviewGrowth:
+                    if Application.getInstance().getController().getActiveView().getPluginId() == "LayerView":
+                        self._showLayerData(self._createLayerData(self._layers))
+                        self._preview_element_count = self._element_count
+                    self._last_preview_time = time.monotonic()
+
+        if self._abort_requested:
+            self._onAborted()
+            return
+
+        # We are done processing all the layers we got from the engine, now create a mesh out of the data
+        layer_data = self._createLayerData(self._layers)
+
+        if self._abort_requested:
+            self._onAborted()
+            return
+
+        self._showLayerData(layer_data) # Note: After this we can no longer abort!
+
+        if self._progress:
+            self._progress.setProgress(100)
+
+        view = Application.getInstance().getController().getActiveView()
+        if view.getPluginId() == "LayerView":
+            view.resetLayerData()
+
+        if self._progress:
+            self._progress.hide()
+
+        # Clear the processed layers. This saves us a bunch of memory if the Job does not get destroyed.
+        self._layers = {}
+
+    ##  Show the progress and remove the layer data of an earlier slice.
+    #
+    #   \return False if the job was aborted in the meantime.
+    def _prepare(self):
         if Application.getInstance().getController().getActiveView().getPluginId() == "LayerView":
             self._progress = Message(catalog.i18nc("@info:status", "Processing Layers"), 0, False, -1)
             self._progress.show()
@@ -45,12 +189,10 @@ class ProcessSlicedLayersJob(Job):
             if self._abort_requested:
                 if self._progress:
                     self._progress.hide()
-                return
+                return False
 
         Application.getInstance().getController().activeViewChanged.connect(self._onActiveViewChanged)
 
-        new_node = SceneNode()
-
         ## Remove old layer data (if any)
         for node in DepthFirstIterator(self._scene.getRoot()):
             if type(node) is SceneNode and node.getMeshData():
@@ -60,95 +202,70 @@ class ProcessSlicedLayersJob(Job):
             if self._abort_requested:
                 if self._progress:
                     self._progress.hide()
-                return
-
-        mesh = MeshData()
-        layer_data = LayerData.LayerData()
-        layer_count = len(self._layers)
+                return False
+        return True
 
-        # Find the minimum layer number
+    ##  Add a processed layer to the processed layers.
+    #
+    #   The engine may send several messages with the same layer number. Their
+    #   polygons are joined into one layer, like LayerData.addPolygon() does.
+    #
+    #   \param layers Dictionary of processed layers by engine layer number.
+    #   \param layer_number The layer number of the engine.
+    #   \param layer The processed Layer.
+    def _addProcessedLayer(self, layers, layer_number, layer):
+        if layer_number in layers:
+            layers[layer_number].addPolygonsOf(layer)
+        else:
+            layers[layer_number] = layer
+
+    ##  Join processed layers together into layer data.
+    #
+    #   \param layers Dictionary of processed layers by engine layer number.
+    def _createLayerData(self, layers):
         # When using a raft, the raft layers are sent as layers < 0. Instead of allowing layers < 0, we
         # instead simply offset all other layers so the lowest layer is always 0.
-        min_layer_number = 0
-        for layer in self._layers:
-            if(layer.id < min_layer_number):
-                min_layer_number = layer.id
-
-        current_layer = 0
+        min_layer_number = min(0, min(layers)) if layers else 0
 
-        for layer in self._layers:
-            abs_layer_number = layer.id + abs(min_layer_number)
-
-            layer_data.addLayer(abs_layer_number)
-            layer_data.setLayerHeight(abs_layer_number, layer.height)
-            layer_data.setLayerThickness(abs_layer_number, layer.thickness)
-
-            for p in range(layer.repeatedMessageCount("polygons")):
-                polygon = layer.getRepeatedMessage("polygons", p)
-
-                points = numpy.fromstring(polygon.points, dtype="i8")  # Convert bytearray to numpy array
-                points = points.reshape((-1,2))  # We get a linear list of pairs that make up the points, so make numpy interpret them correctly.
-
-                # Create a new 3D-array, copy the 2D points over and insert the right height.
-                # This uses manual array creation + copy rather than numpy.insert since this is
-                # faster.
-                new_points = numpy.empty((len(points), 3), numpy.float32)
-                new_points[:,0] = points[:,0]
-                new_points[:,1] = layer.height
-                new_points[:,2] = -points[:,1]
-
-                new_points /= 1000
-
-                layer_data.addPolygon(abs_layer_number, polygon.type, new_points, polygon.line_width)
-                Job.yieldThread()
-            Job.yieldThread()
-            current_layer += 1
-            progress = (current_layer / layer_count) * 100
-            # TODO: Rebuild the layer data mesh once the layer has been processed.
-            # This needs some work in LayerData so we can add the new layers instead of recreating the entire mesh.
-
-            if self._abort_requested:
-                if self._progress:
-                    self._progress.hide()
-                return
-            if self._progress:
-                self._progress.setProgress(progress)
+        layer_data = LayerData.LayerData()
+        for layer_number, layer in layers.items():
+            layer_data.setLayer(layer_number + abs(min_layer_number), layer)
 
-        # We are done processing all the layers we got from the engine, now create a mesh out of the data
         layer_data.build()
+        return layer_data
 
-        if self._abort_requested:
-            if self._progress:
-                self._progress.hide()
-            return
+    ##  Put layer data in the scene, replacing the layer data that was shown
+    #   before by this job.
+    def _showLayerData(self, layer_data):
+        new_node = SceneNode()
 
         # Add LayerDataDecorator to scene node to indicate that the node has layer data
         decorator = LayerDataDecorator.LayerDataDecorator()
         decorator.setLayerData(layer_data)
         new_node.addDecorator(decorator)
 
-        new_node.setMeshData(mesh)
-        new_node.setParent(self._scene.getRoot())  # Note: After this we can no longer abort!
+        new_node.setMeshData(MeshData())
 
         settings = Application.getInstance().getGlobalContainerStack()
         if not settings.getProperty("machine_center_is_zero", "value"):
             new_node.setPosition(Vector(-settings.getProperty("machine_width", "value") / 2, 0.0, settings.getProperty("machine_depth", "value") / 2))
 
-        if self._progress:
-            self._progress.setProgress(100)
-
-        view = Application.getInstance().getController().getActiveView()
-        if view.getPluginId() == "LayerView":
-            view.resetLayerData()
-
+        # Add the new node before removing the old one, so the layer view never sees the layers disappear.
+        old_node = self._layer_data_node
+        new_node.setParent(self._scene.getRoot())
+        self._layer_data_node = new_node
+        if old_node:
+            old_node.setParent(None)
+
+    def _onAborted(self):
+        if self._layer_data_node: # Don't leave a partial result behind.
+            self._layer_data_node.setParent(None)
+            self._layer_data_node = None
         if self._progress:
             self._progress.hide()
 
-        # Clear the unparsed layers. This saves us a bunch of memory if the Job does not get destroyed.
-        self._layers = None
-
     def _onActiveViewChanged(self):
-        if self.isRunning():
+        if self._started and not self._done:
             if Application.getInstance().getController().getActiveView().getPluginId() == "LayerView":
                 if not self._progress:
                     self._progress = Message(catalog.i18nc("@info:status", "Processing Layers"), 0, False, 0)
@@ -158,3 +275,56 @@ class ProcessSlicedLayersJob(Job):
                 if self._progress:
                     self._progress.hide()
 
+
+##  Copy the data out of a layer message.
+#
+#   \param layer The cura.proto.Layer message.
+#   \return The arguments for _processLayer.
+def _readLayerMessage(layer):
+    return SliceCache.readLayerMessage(layer)
+
+##  Decode the polygons of a layer into one compact array.
+#
+#   All polygons of the layer are converted in a single pass. The result is
+#   exactly the same as converting each polygon on its own.
+#
+#   \param height The height of the layer.
+#   \param polygons List of (type, points, line width) tuples, where the points
+#   are the raw bytes from the engine.
+#   \return A tuple of the points of all polygons as one float32 array, the
+#   offsets of the polygons in that array (with the total number of points
+#   appended), the polygon types and the line widths.
+def decodeLayer(height, polygons):
+    point_counts = numpy.fromiter((len(points) // 16 for _, points, _ in polygons), dtype = numpy.int64, count = len(polygons)) # Every point is a pair of 8-byte integers.
+    offsets = numpy.zeros(len(polygons) + 1, dtype = numpy.int64)
+    numpy.cumsum(point_counts, out = offsets[1:])
+
+    points = numpy.frombuffer(b"".join(points for _, points, _ in polygons), dtype = "i8")  # Convert bytearray to numpy array
+    points = points.reshape((-1, 2))  # We get a linear list of pairs that make up the points, so make numpy interpret them correctly.
+
+    # Create a new 3D-array, copy the 2D points over and insert the right height.
+    # This uses manual array creation + copy rather than numpy.insert since this is
+    # faster.
+    new_points = numpy.empty((len(points), 3), numpy.float32)
+    new_points[:, 0] = points[:, 0]
+    new_points[:, 1] = height
+    new_points[:, 2] = -points[:, 1]
+
+    new_points /= 1000
+
+    types = numpy.array([polygon_type for polygon_type, _, _ in polygons], dtype = numpy.int32)
+    line_widths = numpy.array([line_width for _, _, line_width in polygons], dtype = numpy.float32)
+    return new_points, offsets, types, line_widths
+
+##  Decode a layer and build its part of the line mesh.
+#
+#   \return A tuple of the layer number and the built Layer.
+def _processLayer(layer_number, height, thickness, polygons):
+    result = Layer.Layer(layer_number)
+    result.setHeight(height)
+    result.setThickness(thickness)
+
+    result.setPolygons(*decodeLayer(height, polygons))
+
+    result.build()
+    return layer_number, result
@@ -0,0 +1,320 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Job import Job
+from UM.Logger import Logger
+
+from cura.LRUCache import LRUCache
+
+import json
+import os
+import struct
+import threading
+
+##  Start of the files of the cache on disk.
+_FileMagic = b"CURASLICE\n"
+
+##  Lock that is held while reading a layer message of the engine.
+_message_lock = threading.Lock()
+
+##  Copy the data out of a layer message of the engine.
+#
+#   The same messages are read by the job that processes layers for the layer
+#   view, by the job that stores a result in the cache and by the job that
+#   joins the results of groups. The messages must not be read from several
+#   threads at the same time, so all of them read the messages with this
+#   function, which reads one message at a time.
+#
+#   \param layer The cura.proto.Layer message, or a CachedLayer.
+#   \return A tuple of the layer number, the height, the thickness and a list
+#   of (type, points, line width) tuples of the polygons.
+def readLayerMessage(layer):
+    if type(layer) is CachedLayer:
+        return layer.id, layer.height, layer.thickness, layer.getPolygonData()
+
+    with _message_lock:
+        polygons = []
+        for p in range(layer.repeatedMessageCount("polygons")):
+            polygon = layer.getRepeatedMessage("polygons", p)
+            polygons.append((polygon.type, polygon.points, polygon.line_width))
+        return layer.id, layer.height, layer.thickness, polygons
+
+##  The output of a finished slice: the g-code, the layer data and the print
+#   times.
+#
+#   A result is created from the messages the engine sent. Those messages are
+#   converted to plain Python data by compact(), after which the result can be
+#   kept in memory and written to disk. The layers of a compacted result behave
+#   like cura.proto.Layer messages as far as ProcessSlicedLayersJob is
+#   concerned.
+class SliceResult:
+    ##  Creates a new slice result.
+    #
+    #   \param gcode_list The list of g-code strings, including the prefix.
+    #   \param layers The cura.proto.Layer messages of the slice.
+    #   \param print_times List of (time, material amount) tuples, one for each
+    #   ObjectPrintTime message.
+    def __init__(self, gcode_list, layers, print_times):
+        self._gcode_list = gcode_list
+        self._layers = layers
+        self._print_times = print_times
+        self._size = 0
+
+    def getGCodeList(self):
+        return self._gcode_list
+
+    def getLayers(self):
+        return self._layers
+
+    def getPrintTimes(self):
+        return self._print_times
+
+    ##  Get the approximate size of the result in memory, in bytes.
+    #
+    #   This is only known after the result is compacted.
+    def getSize(self):
+        return self._size
+
+    ##  Convert the layer messages to plain data that can be serialised.
+    #
+    #   This copies all polygon data out of the messages, so it should not be
+    #   done on the main thread.
+    def compact(self):
+        layers = []
+        size = sum(len(gcode) for gcode in self._gcode_list)
+        for layer in self._layers:
+            if type(layer) is not CachedLayer:
+                layer = CachedLayer(*readLayerMessage(layer))
+            layers.append(layer)
+            size += layer.getSize()
+        self._layers = layers
+        self._size = size
+
+    ##  Serialise a compacted result to a string of bytes.
+    #
+    #   The result is stored as data only, so that reading a file from the
+    #   cache directory can't run any code: the size of a JSON description of
+    #   the g-code, the print times and the layers, that description, and then
+    #   the points of all polygons one after the other.
+    def serialise(self):
+        layers = []
+        points = []
+        for layer in self._layers:
+            polygons = []
+            for polygon_type, polygon_points, line_width in layer.getPolygonData():
+                polygons.append((polygon_type, line_width, len(polygon_points)))
+                points.append(bytes(polygon_points))
+            layers.append((layer.id, layer.height, layer.thickness, polygons))
+        description = json.dumps({ "version": SliceCache.version, "gcode": self._gcode_list, "layers": layers, "print_times": self._print_times }).encode("utf-8")
+        return b"".join([_FileMagic, struct.pack("<Q", len(description)), description] + points)
+
+    ##  Create a compacted result from a string of bytes made by serialise().
+    #
+    #   \return A slice result, or None if the data has an unknown format or
+    #   version.
+    #   \exception ValueError The data is damaged.
+    @classmethod
+    def deserialise(cls, data):
+        if not data.startswith(_FileMagic):
+            return None
+        offset = len(_FileMagic)
+        description_size = struct.unpack_from("<Q", data, offset)[0]
+        offset += 8
+        description = json.loads(data[offset:offset + description_size].decode("utf-8"))
+        offset += description_size
+        if description.get("version") != SliceCache.version:
+            return None
+
+        layers = []
+        for layer_id, height, thickness, polygon_descriptions in description["layers"]:
+            polygons = []
+            for polygon_type, line_width, size in polygon_descriptions:
+                polygons.append((polygon_type, data[offset:offset + size], line_width))
+                offset += size
+            layers.append(CachedLayer(layer_id, height, thickness, polygons))
+        if offset != len(data):
+            raise ValueError("The size of the points doesn't match the description of the layers")
+
+        result = cls(description["gcode"], layers, [tuple(print_time) for print_time in description["print_times"]])
+        result.compact()
+        return result
+
+
+##  Plain Python stand-in for a cura.proto.Layer message.
+class CachedLayer:
+    def __init__(self, layer_id, height, thickness, polygons):
+        self.id = layer_id
+        self.height = height
+        self.thickness = thickness
+        self._polygons = polygons # List of (type, points, line width) tuples.
+
+    def repeatedMessageCount(self, field):
+        return len(self._polygons)
+
+    def getRepeatedMessage(self, field, index):
+        return CachedPolygon(*self._polygons[index])
+
+    def getPolygonData(self):
+        return self._polygons
+
+    def getSize(self):
+        return sum(len(polygon[1]) for polygon in self._polygons)
+
+
+##  Plain Python stand-in for a cura.proto.Polygon message.
+class CachedPolygon:
+    def __init__(self, polygon_type, points, line_width):
+        self.type = polygon_type
+        self.points = points
+        self.line_width = line_width
+
+
+##  Content-addressed cache of slice results.
+#
+#   Results are stored under a key that describes everything that goes into a
+#   slice: the transformed meshes and the settings. The most recently used
+#   results are kept in memory. If the cache on disk has a size, all results
+#   are also written to a directory on disk so they survive a restart. Both are
+#   bounded by size; the least recently used results are evicted first.
+class SliceCache:
+    ##  Version of the files on disk. Increment when changing the format.
+    version = 2
+
+    ##  Creates a new slice cache.
+    #
+    #   \param memory_size Maximum size of the results in memory, in bytes.
+    #   \param disk_size Maximum size of the results on disk, in bytes. If 0,
+    #   nothing is read from or written to disk.
+    #   \param path Directory to store the results on disk in, or None to only
+    #   keep results in memory. It is created when the first result is written.
+    def __init__(self, memory_size, disk_size, path = None):
+        self._memory = LRUCache(memory_size)
+        self._disk_size = disk_size
+        self._path = path
+        self._hit_count = 0
+        self._miss_count = 0
+
+    ##  Find the result of an earlier slice.
+    #
+    #   Results that are not in memory are read from disk, which can take long
+    #   for big results, so this should not be called on the main thread.
+    #
+    #   \param key The key of the slice.
+    #   \return The slice result, or None if there is none with that key.
+    def get(self, key):
+        result = self._memory.get(key)
+        if result is None:
+            result = self._load(key)
+            if result is not None:
+                self._memory.put(key, result, result.getSize())
+
+        if result is None:
+            self._miss_count += 1
+        else:
+            self._hit_count += 1
+        return result
+
+    ##  Store the result of a slice.
+    #
+    #   The result is compacted and written to disk in a job, so this returns
+    #   immediately. The result becomes available when the job is done.
+    #
+    #   \param key The key of the slice.
+    #   \param result The SliceResult to store.
+    def put(self, key, result):
+        job = _StoreSliceResultJob(self, key, result)
+        job.start()
+
+    ##  Remove all results from memory and from disk.
+    def clear(self):
+        self._memory.clear()
+        for file_path in self._getFiles():
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def setMemorySize(self, size):
+        self._memory.setMaxSize(size)
+
+    def setDiskSize(self, size):
+        self._disk_size = size
+        self._trimDisk()
+
+    ##  Get the number of times get() found a result.
+    def getHitCount(self):
+        return self._hit_count
+
+    ##  Get the number of times get() did not find a result.
+    def getMissCount(self):
+        return self._miss_count
+
+    def _store(self, key, result):
+        result.compact()
+        self._memory.put(key, result, result.getSize())
+
+        if not self._path or self._disk_size <= 0 or result.getSize() > self._disk_size:
+            return
+        try:
+            os.makedirs(self._path, exist_ok = True)
+            with open(self._getFilePath(key), "wb") as f:
+                f.write(result.serialise())
+        except OSError:
+            Logger.logException("w", "Could not write slice result %s to the cache", key)
+            return
+        self._trimDisk()
+
+    def _load(self, key):
+        if not self._path or self._disk_size <= 0:
+            return None
+        file_path = self._getFilePath(key)
+        try:
+            with open(file_path, "rb") as f:
+                result = SliceResult.deserialise(f.read())
+            os.utime(file_path) # Mark as recently used.
+        except FileNotFoundError:
+            return None
+        except Exception:
+            Logger.logException("w", "Could not read slice result %s from the cache", key)
+            return None
+        return result
+
+    ##  Remove the least recently used files until the cache on disk fits.
+    def _trimDisk(self):
+        files = []
+        for file_path in self._getFiles():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file_path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total_size <= self._disk_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total_size -= size
+
+    def _getFiles(self):
+        if not self._path or not os.path.isdir(self._path):
+            return []
+        return [os.path.join(self._path, file_name) for file_name in os.listdir(self._path) if file_name.endswith(".slice")]
+
+    def _getFilePath(self, key):
+        return os.path.join(self._path, key + ".slice")
+
+
+##  Job that compacts a slice result and stores it in the cache.
+class _StoreSliceResultJob(Job):
+    def __init__(self, cache, key, result):
+        super().__init__()
+        self._cache = cache
+        self._key = key
+        self._result = result
+
+    def run(self):
+        self._cache._store(self._key, self._result)
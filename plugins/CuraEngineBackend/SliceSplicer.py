@@ -0,0 +1,313 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from . import SliceCache
+
+import collections
+import re
+
+##  Distance to move the nozzle up above the highest group printed so far,
+#   before travelling to the next group, in mm.
+SafeTravelClearance = 5.0
+
+##  Lines of the g-code header with a total for the whole print, such as the
+#   print time and the material used. The groups of the match are the name, the
+#   space after the colon, the number and the unit.
+_SummedHeaderLine = re.compile(r"^;(TIME|PRINT\.TIME|MATERIAL\d*|Filament used|EXTRUDER_TRAIN\.\d+\.MATERIAL\.VOLUME_USED):(\s*)(-?\d+(?:\.\d+)?)([a-zA-Z]*)[ \t]*$\n?", re.MULTILINE)
+
+##  A g-code command, followed by its parameters up to any comment.
+_Command = re.compile(r"^\s*([GM]\d+)(?![\d.])([^;]*)")
+
+##  A parameter of a g-code command: a letter and a number.
+_Parameter = re.compile(r"([A-Z])\s*(-?\d*\.?\d+)")
+
+##  A tool change command. The group of the match is the number of the tool.
+_ToolChange = re.compile(r"^\s*T(\d+)", re.MULTILINE)
+
+##  Join the results of groups of objects that were sliced separately into the
+#   result of a print that prints the groups one at a time.
+#
+#   Every group was sliced as a print of its own, so its g-code starts with
+#   the start g-code and ends with the end g-code. Those are removed between
+#   the groups, and a hand-over is put in their place that leaves the printer
+#   the way the engine expects it at the start of a print: the fan is turned
+#   off, the filament is retracted, the nozzle is lifted above everything that
+#   was printed so far and only then travels to the first position of the next
+#   group, where the filament is primed again and the extruder position is
+#   reset. The nozzle then only goes down vertically, onto the next group.
+#   If the start g-code or the groups switch to relative extrusion (M83), the
+#   hand-over retracts and primes with relative moves instead.
+#   The header before the start g-code is taken from the first group, with
+#   the totals in it (print time, material used) summed over all groups.
+#
+#   This is only done if the start and end g-code can be found exactly once
+#   in the g-code of each group, and if the first move of every group but the
+#   first goes to an X and Y position. Otherwise it is not clear which part of
+#   the g-code belongs to them or where the next group starts, and the slice
+#   should be done as a whole. The same goes for g-code that uses more than
+#   one tool, since the state of each extruder at the end of a group is not
+#   tracked.
+#
+#   \param results The SliceResult of each group, in print order.
+#   \param start_gcode The start g-code as it was sent to the engine.
+#   \param end_gcode The end g-code as it was sent to the engine.
+#   \param travel_speed The travel speed, in mm/s.
+#   \param machine_height The height of the build volume, in mm.
+#   \param retraction_amount The distance to retract the filament over
+#   between groups, or 0 to not retract.
+#   \param retraction_retract_speed The speed to retract with, in mm/s.
+#   \param retraction_prime_speed The speed to prime with, in mm/s.
+#   \return A SliceResult of the whole print, or None if the results can't be
+#   joined.
+def spliceGroupResults(results, start_gcode, end_gcode, travel_speed, machine_height, retraction_amount, retraction_retract_speed, retraction_prime_speed):
+    if not start_gcode.strip() or not end_gcode.strip():
+        return None
+
+    tools = { tool for result in results for chunk in result.getGCodeList() for tool in _ToolChange.findall(chunk) }
+    if len(tools) > 1:
+        return None
+
+    headers = [_getHeader(result.getGCodeList(), start_gcode) for result in results]
+    if None in headers:
+        return None
+    header_totals = _sumHeaderValues(headers)
+
+    group_gcode = [] #The g-code of each group without the start and end g-code.
+    for index, result in enumerate(results):
+        gcode = list(result.getGCodeList())
+        if index > 0:
+            gcode = _removeUpTo(gcode, start_gcode)
+        else:
+            gcode = _rewriteHeader(gcode, start_gcode, header_totals)
+        if gcode is not None and index < len(results) - 1:
+            gcode = _removeFrom(gcode, end_gcode)
+        if gcode is None:
+            return None
+        group_gcode.append(gcode)
+
+    gcode_list = list(group_gcode[0])
+    printed_height = 0.0 #Height of the highest group printed so far, in mm.
+    for index in range(1, len(results)):
+        heights = [layer.height for layer in results[index - 1].getLayers()]
+        if heights:
+            printed_height = max(printed_height, max(heights) / 1000) #Layer heights are in micrometres.
+        position = _getFirstPosition(group_gcode[index])
+        if position is None:
+            return None
+        travel_height = min(printed_height + SafeTravelClearance, machine_height)
+        gcode_list.append(_createHandOver(group_gcode[index - 1], position, travel_height, travel_speed, retraction_amount, retraction_retract_speed, retraction_prime_speed))
+        gcode_list.extend(group_gcode[index])
+
+    total_time = 0
+    total_material = 0
+    for result in results:
+        for time, material_amount in result.getPrintTimes():
+            total_time += time
+            total_material += material_amount
+
+    return SliceCache.SliceResult(gcode_list, _mergeLayers(results), [(total_time, total_material)])
+
+##  Create the g-code to go from the end of one group to the start of the
+#   next group.
+#
+#   \param previous_gcode The g-code of the group that was printed last.
+#   \param position The X and Y position of the first move of the next group.
+#   \param travel_height The height to travel to the next group at, in mm.
+#   See spliceGroupResults() for the other parameters.
+#   \return The g-code of the hand-over, as one string.
+def _createHandOver(previous_gcode, position, travel_height, travel_speed, retraction_amount, retraction_retract_speed, retraction_prime_speed):
+    relative_extrusion = _isRelativeExtrusion(previous_gcode)
+    retracted, firmware_retraction, retracted_distance = _getRetractionState(previous_gcode, relative_extrusion)
+    lines = [";Next group", "M107"]
+    prime_distance = 0.0 #Distance to prime over after the travel, with relative extrusion.
+    if firmware_retraction:
+        if not retracted:
+            lines.append("G10")
+        if not relative_extrusion:
+            lines.append("G92 E0")
+    elif relative_extrusion:
+        if retracted:
+            prime_distance = retracted_distance
+        elif retraction_amount > 0:
+            lines.append("G1 F{0:.0f} E{1:.5f}".format(retraction_retract_speed * 60, -retraction_amount))
+            prime_distance = retraction_amount
+    elif retracted:
+        lines.append("G92 E{0:.5f}".format(-retracted_distance)) #Priming goes back to 0, where the next group starts.
+    else:
+        lines.append("G92 E0")
+        if retraction_amount > 0:
+            lines.append("G1 F{0:.0f} E{1:.5f}".format(retraction_retract_speed * 60, -retraction_amount))
+    lines.append("G0 F{0:.0f} Z{1:.3f}".format(travel_speed * 60, travel_height))
+    lines.append("G0 F{0:.0f} X{1:.3f} Y{2:.3f}".format(travel_speed * 60, position[0], position[1]))
+    if firmware_retraction:
+        lines.append("G11")
+    elif relative_extrusion:
+        if prime_distance > 0:
+            lines.append("G1 F{0:.0f} E{1:.5f}".format(retraction_prime_speed * 60, prime_distance))
+    elif retracted or retraction_amount > 0:
+        lines.append("G1 F{0:.0f} E0".format(retraction_prime_speed * 60))
+    return "\n".join(lines) + "\n"
+
+##  Find out whether the extruder position is relative at the end of some
+#   g-code.
+#
+#   \return True if the last extrusion mode command is M83, or False if it is
+#   M82 or there is none.
+def _isRelativeExtrusion(gcode_list):
+    for line in _reverseLines(gcode_list):
+        command, _ = _parseCommand(line)
+        if command == "M82" or command == "M83":
+            return command == "M83"
+    return False
+
+##  Find out whether the filament is retracted at the end of some g-code.
+#
+#   This looks for the last retraction or prime. With firmware retraction
+#   those are G10 and G11. Otherwise they are moves of only the extruder, and
+#   the extruder position before them tells which of the two it is. With
+#   relative extrusion the direction of the move itself tells.
+#
+#   \param relative_extrusion Whether the extruder position is relative.
+#   \return A tuple of whether the filament is retracted, whether firmware
+#   retraction is used and the distance over which the filament is retracted.
+def _getRetractionState(gcode_list, relative_extrusion = False):
+    retraction_position = None #Extruder position after the last retraction or prime.
+    for line in _reverseLines(gcode_list):
+        command, parameters = _parseCommand(line)
+        if retraction_position is None:
+            if command == "G10" or command == "G11":
+                return command == "G10", True, 0.0
+            if command in ("G0", "G1") and "E" in parameters and not any(axis in parameters for axis in "XYZ"):
+                if relative_extrusion:
+                    return parameters["E"] < 0, False, max(-parameters["E"], 0.0)
+                retraction_position = parameters["E"]
+        elif command in ("G0", "G1", "G92") and "E" in parameters:
+            distance = parameters["E"] - retraction_position
+            return distance > 0, False, max(distance, 0.0)
+    if retraction_position is not None: #The extruder starts at 0.
+        return retraction_position < 0, False, max(-retraction_position, 0.0)
+    return False, False, 0.0
+
+##  Find the X and Y position of the first move in some g-code.
+#
+#   \return A tuple of the X and Y position, or None if the first move
+#   doesn't go to an X and Y position.
+def _getFirstPosition(gcode_list):
+    for chunk in gcode_list:
+        for line in chunk.split("\n"):
+            command, parameters = _parseCommand(line)
+            if command in ("G0", "G1") and any(axis in parameters for axis in "XYZ"):
+                if "X" in parameters and "Y" in parameters:
+                    return parameters["X"], parameters["Y"]
+                return None
+    return None
+
+##  Get the lines of some g-code from the last to the first.
+def _reverseLines(gcode_list):
+    for chunk in reversed(gcode_list):
+        yield from reversed(chunk.split("\n"))
+
+##  Get the command and its parameters from a line of g-code.
+#
+#   \return A tuple of the command, such as "G1", or None if the line has no
+#   command, and a dictionary of the parameters to their values.
+def _parseCommand(line):
+    match = _Command.match(line)
+    if not match:
+        return None, {}
+    return match.group(1), { name: float(value) for name, value in _Parameter.findall(match.group(2)) }
+
+##  Get the header of the g-code of a group: everything before the start
+#   g-code.
+#
+#   \return The header, or None if the start g-code isn't in the g-code
+#   exactly once.
+def _getHeader(gcode_list, start_gcode):
+    index = _findOnce(gcode_list, start_gcode)
+    if index is None:
+        return None
+    return "".join(gcode_list[:index]) + gcode_list[index][:gcode_list[index].index(start_gcode)]
+
+##  Sum the totals in the headers of the groups.
+#
+#   \return A dictionary of the names of the totals to their sums, or to None
+#   if not all groups have that total.
+def _sumHeaderValues(headers):
+    totals = {}
+    counts = collections.Counter()
+    for header in headers:
+        for match in _SummedHeaderLine.finditer(header):
+            name = match.group(1)
+            totals[name] = totals.get(name, 0) + float(match.group(3))
+            counts[name] += 1
+    return { name: total if counts[name] == len(headers) else None for name, total in totals.items() }
+
+##  Replace the totals in the header with the totals of all groups.
+#
+#   Totals that are not known for all groups are removed, rather than left
+#   at the value of one group.
+def _rewriteHeader(gcode_list, start_gcode, totals):
+    def replaceTotal(match):
+        total = totals.get(match.group(1))
+        if total is None:
+            return ""
+        number = match.group(3)
+        decimals = len(number.split(".")[1]) if "." in number else 0
+        line_end = "\n" if match.group(0).endswith("\n") else ""
+        return ";{0}:{1}{2:.{3}f}{4}{5}".format(match.group(1), match.group(2), total, decimals, match.group(4), line_end)
+
+    index = _findOnce(gcode_list, start_gcode)
+    position = gcode_list[index].index(start_gcode)
+    rewritten = [_SummedHeaderLine.sub(replaceTotal, chunk) for chunk in gcode_list[:index]]
+    rewritten.append(_SummedHeaderLine.sub(replaceTotal, gcode_list[index][:position]) + gcode_list[index][position:])
+    return rewritten + gcode_list[index + 1:]
+
+##  Remove everything up to and including a piece of g-code.
+#
+#   \return The remaining g-code strings, or None if the piece isn't in the
+#   g-code exactly once.
+def _removeUpTo(gcode_list, gcode):
+    index = _findOnce(gcode_list, gcode)
+    if index is None:
+        return None
+    remainder = gcode_list[index][gcode_list[index].index(gcode) + len(gcode):]
+    return [remainder] + gcode_list[index + 1:]
+
+##  Remove everything from a piece of g-code onwards, including that piece.
+#
+#   \return The remaining g-code strings, or None if the piece isn't in the
+#   g-code exactly once.
+def _removeFrom(gcode_list, gcode):
+    index = _findOnce(gcode_list, gcode)
+    if index is None:
+        return None
+    return gcode_list[:index] + [gcode_list[index][:gcode_list[index].index(gcode)]]
+
+##  Find the g-code string that contains a piece of g-code.
+#
+#   \return The index of the string, or None if the piece isn't in the g-code
+#   exactly once.
+def _findOnce(gcode_list, gcode):
+    found = None
+    for index, chunk in enumerate(gcode_list):
+        count = chunk.count(gcode)
+        if count == 0:
+            continue
+        if count > 1 or found is not None:
+            return None
+        found = index
+    return found
+
+##  Merge the layers of the groups, joining layers with the same number.
+#
+#   \return A list of SliceCache.CachedLayer.
+def _mergeLayers(results):
+    layers = collections.OrderedDict() #Layer number -> (height, thickness, polygons).
+    for result in results:
+        for layer in result.getLayers():
+            layer_id, height, thickness, polygons = SliceCache.readLayerMessage(layer)
+            if layer_id in layers:
+                layers[layer_id][2].extend(polygons)
+            else:
+                layers[layer_id] = (height, thickness, list(polygons)) #A copy, since polygons of other groups are added to it.
+    return [SliceCache.CachedLayer(layer_id, height, thickness, polygons) for layer_id, (height, thickness, polygons) in layers.items()]
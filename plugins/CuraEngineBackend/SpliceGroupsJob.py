@@ -0,0 +1,37 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from UM.Job import Job
+
+from . import SliceSplicer
+
+##  Job that joins the results of groups of objects that were sliced
+#   separately, see SliceSplicer.spliceGroupResults().
+#
+#   All g-code and all polygons of all groups are read for this, which takes
+#   too long for the main thread with large prints. The result is the joined
+#   SliceResult, or None if the groups can't be joined.
+class SpliceGroupsJob(Job):
+    ##  Creates a new job to join the results of groups.
+    #
+    #   \param results The SliceResult of each group, in print order.
+    #   \param start_gcode The start g-code as it was sent to the engine.
+    #   \param end_gcode The end g-code as it was sent to the engine.
+    #   \param splice_arguments The other arguments of
+    #   SliceSplicer.spliceGroupResults().
+    def __init__(self, results, start_gcode, end_gcode, *splice_arguments):
+        super().__init__()
+        self._results = results
+        self._start_gcode = start_gcode
+        self._end_gcode = end_gcode
+        self._splice_arguments = splice_arguments
+
+    ##  Get the start and end g-code that the groups are joined with.
+    #
+    #   \return A tuple of the start and the end g-code.
+    def getGCode(self):
+        return self._start_gcode, self._end_gcode
+
+    def run(self):
+        self.setResult(SliceSplicer.spliceGroupResults(self._results, self._start_gcode, self._end_gcode, *self._splice_arguments))
+        self._results = None # Don't keep the results of the groups alive with the job.
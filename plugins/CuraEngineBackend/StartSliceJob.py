@@ -3,47 +3,247 @@
 
 import numpy
 from string import Formatter
+import re
+import hashlib
+import os
 import traceback
+import weakref
 
 from UM.Job import Job
 from UM.Application import Application
 from UM.Logger import Logger
+from UM.Preferences import Preferences
 
 from UM.Scene.SceneNode import SceneNode
 from UM.Scene.Iterator.DepthFirstIterator import DepthFirstIterator
 
 from cura.OneAtATimeIterator import OneAtATimeIterator
+from cura.LRUCache import LRUCache
 
 
 ##  Formatter class that handles token expansion in start/end gcod
+#
+#   Every placeholder that can't be replaced is only reported the first time
+#   this formatter finds it.
 class GcodeStartEndFormatter(Formatter):
+    def __init__(self):
+        super().__init__()
+        self._reported_keys = set() #Placeholders that were already reported as a problem.
+
     def get_value(self, key, args, kwargs):  # [CodeStyle: get_value is an overridden function from the Formatter class]
         if isinstance(key, str):
             try:
                 return kwargs[key]
             except KeyError:
-                Logger.log("w", "Unable to replace '%s' placeholder in start/end gcode", key)
+                if key not in self._reported_keys:
+                    self._reported_keys.add(key)
+                    Logger.log("w", "Unable to replace '%s' placeholder in start/end gcode", key)
                 return "{" + key + "}"
         else:
-            Logger.log("w", "Incorrectly formatted placeholder '%s' in start/end gcode", key)
+            if key not in self._reported_keys:
+                self._reported_keys.add(key)
+                Logger.log("w", "Incorrectly formatted placeholder '%s' in start/end gcode", key)
             return "{" + str(key) + "}"
 
+##  A start or end g-code template, parsed once for all slices.
+#
+#   The template knows which settings its placeholders refer to. It keeps the
+#   result of the last expansion, together with the values of those settings,
+#   so it is only expanded again when one of them changed. Templates are
+#   shared by the jobs of all slices, so the values and the result are stored
+#   and read as one tuple.
+class GcodeTemplate:
+    ##  Parses a template.
+    #
+    #   \param template The g-code with placeholders for setting values.
+    def __init__(self, template):
+        self._template = template
+        self._formatter = GcodeStartEndFormatter()
+        self._fields = [] #(Literal text, field name or None, format spec, conversion) for each part of the template.
+        self._keys = [] #The setting keys that the placeholders refer to, in the order in which they are first used.
+        self._parse_error = None
+        try:
+            self._fields = self._parse(template)
+        except ValueError as e:
+            self._parse_error = e
+            Logger.log("w", "Unable to parse start/end gcode: %s", str(e))
+
+        self._last_expansion = None #Tuple of the values of the referenced settings and the result of the last expansion.
+
+    ##  Get the keys of the settings that the placeholders of this template
+    #   refer to.
+    def getKeys(self):
+        return self._keys
+
+    ##  Replace the placeholders with the values of the settings.
+    #
+    #   \param settings Dictionary of setting keys to values. Only the keys
+    #   that the template refers to are looked up.
+    #   \return The expanded g-code as utf-8 bytes.
+    def expand(self, settings):
+        values = tuple(settings.get(key, _missing) for key in self._keys)
+        last_expansion = self._last_expansion
+        if last_expansion is not None and values == last_expansion[0]:
+            return last_expansion[1]
+
+        if self._parse_error is not None:
+            result = self._template
+        else:
+            kwargs = {key: value for key, value in zip(self._keys, values) if value is not _missing}
+            try:
+                result = self._expandFields(self._fields, kwargs)
+            except Exception:
+                Logger.log("w", "Unabled to do token replacement on start/end gcode %s", traceback.format_exc())
+                result = self._template
+
+        result = str(result).encode("utf-8")
+        self._last_expansion = (values, result)
+        return result
+
+    def _parse(self, template):
+        fields = []
+        auto_index = 0
+        for literal, field_name, format_spec, conversion in self._formatter.parse(template):
+            if field_name is not None:
+                if field_name == "": #Automatically numbered, just like Formatter.vformat does.
+                    if auto_index is None:
+                        raise ValueError("cannot switch from manual field specification to automatic field numbering")
+                    field_name = str(auto_index)
+                    auto_index += 1
+                elif field_name[0].isdigit():
+                    if auto_index:
+                        raise ValueError("cannot switch from manual field specification to automatic field numbering")
+                    auto_index = None
+                key = re.split(r"[.\[]", field_name, 1)[0]
+                if not key.isdigit() and key not in self._keys:
+                    self._keys.append(key)
+                if format_spec and "{" in format_spec: #Nested placeholders in the format spec.
+                    format_spec = self._parse(format_spec)
+            fields.append((literal, field_name, format_spec, conversion))
+        return fields
+
+    def _expandFields(self, fields, kwargs):
+        result = []
+        for literal, field_name, format_spec, conversion in fields:
+            result.append(literal)
+            if field_name is None:
+                continue
+            value = self._formatter.get_field(field_name, (), kwargs)[0]
+            value = self._formatter.convert_field(value, conversion)
+            if isinstance(format_spec, list):
+                format_spec = self._expandFields(format_spec, kwargs)
+            result.append(self._formatter.format_field(value, format_spec))
+        return "".join(result)
+
+_missing = object() #Value of settings that don't exist, to tell them apart from settings with value None.
+
+##  Merge the vertices of a mesh that are exactly the same.
+#
+#   Only vertices with the same bits are merged, so the faces that the indices
+#   describe are exactly the faces of the original vertices.
+#
+#   \param vertices The vertices of a mesh without indices, three for every
+#   face.
+#   \return A tuple of the unique vertices and the int32 indices of the
+#   vertices of every face in the unique vertices.
+def weldVertices(vertices):
+    vertices = numpy.ascontiguousarray(vertices)
+    # Find the unique rows by looking at each row as an opaque group of bytes.
+    vertex_byte_view = vertices.view(numpy.dtype((numpy.void, vertices.dtype.itemsize * vertices.shape[1]))).reshape(-1)
+    _, first_indices, indices = numpy.unique(vertex_byte_view, return_index = True, return_inverse = True)
+    return vertices[first_indices], indices.astype(numpy.int32).reshape(-1)
+
 ##  Job class that builds up the message of scene data to send to CuraEngine.
 class StartSliceJob(Job):
-    def __init__(self, slice_message, settings_message):
+    ##  Vertex data as sent to the engine, by mesh and transformation.
+    _vertex_cache = LRUCache(256 * 1024 * 1024)
+
+    ##  Unique vertices and indices of meshes, by mesh.
+    _welded_mesh_cache = LRUCache(256 * 1024 * 1024)
+
+    ##  Parsed start and end g-code templates, by their text.
+    _gcode_template_cache = LRUCache(16 * 1024 * 1024)
+
+    ##  Creates a new job to build the messages of a slice.
+    #
+    #   \param slice_message The message to fill with the scene data.
+    #   \param settings_message The message to fill with the global settings.
+    #   \param sent_settings Dictionary of setting keys to encoded values that
+    #   the engine already has, or None if the engine has no settings. Only
+    #   the settings that differ from these are added to the settings message.
+    #   \param base_generation The generation of the settings that the engine
+    #   already has.
+    #   \param create_message Function to create a new message with, or None.
+    #   If given and the objects are printed one at a time, every group of
+    #   objects gets its own slice message instead of all groups going into
+    #   the slice message, so the groups can be sliced and cached separately.
+    #   \param slice_cache The SliceCache to look up earlier results of the
+    #   slice in, or None to not look them up.
+    def __init__(self, slice_message, settings_message, sent_settings = None, base_generation = 0, create_message = None, slice_cache = None):
         super().__init__()
 
         self._scene = Application.getInstance().getController().getScene()
         self._slice_message = slice_message
         self._settings_message = settings_message
+        self._sent_settings = sent_settings
+        self._base_generation = base_generation
+        self._create_message = create_message
+        self._group_slices = [] #(Cache key, slice message) of each group, when the groups are sliced separately.
+        self._encoded_settings = {} #All global settings as they are sent to the engine.
         self._is_cancelled = False
+        self._cache_key = hashlib.sha1() #Hash of everything that is sent to the engine, to find earlier results of the same slice.
+        self._group_key = None #Hash of the global settings and everything that is sent for the current group.
+        self._slice_cache = slice_cache
+        self._cached_result = None #Result of an earlier slice with the same cache key.
+        self._cached_group_results = [] #Result of an earlier slice of each group with the same cache key, or None.
 
     def getSettingsMessage(self):
         return self._settings_message
 
+    ##  Get all global settings of this slice, as they are known by the engine
+    #   once the settings message is sent.
+    #
+    #   \return Dictionary of setting keys to encoded values.
+    def getEncodedSettings(self):
+        return self._encoded_settings
+
     def getSliceMessage(self):
         return self._slice_message
 
+    ##  Get the key under which the result of this slice can be cached.
+    #
+    #   The key is a digest of the transformed meshes and of all settings that
+    #   are sent to the engine, so two slices with the same key give the same
+    #   result.
+    def getCacheKey(self):
+        return self._cache_key.hexdigest()
+
+    ##  Get the slice messages of the groups of objects, if they are sliced
+    #   separately.
+    #
+    #   The key of a group is a digest of the global settings, the position of
+    #   the group in the print sequence and the transformed meshes and
+    #   per-object settings of the group.
+    #
+    #   \return A list of (cache key, slice message) tuples in print order, or
+    #   an empty list if all groups are in the slice message.
+    def getGroupSlices(self):
+        return self._group_slices
+
+    ##  Get the result of an earlier slice with the same cache key.
+    #
+    #   \return A SliceResult, or None if it is not in the slice cache.
+    def getCachedResult(self):
+        return self._cached_result
+
+    ##  Get the results of earlier slices of the groups of objects, if they
+    #   are sliced separately.
+    #
+    #   \return A list with a SliceResult or None for each group slice, or an
+    #   empty list if there is a result of the whole slice.
+    def getCachedGroupResults(self):
+        return self._cached_group_results
+
     ##  Runs the job that initiates the slicing.
     def run(self):
         stack = Application.getInstance().getGlobalContainerStack()
@@ -93,31 +293,134 @@ class StartSliceJob(Job):
             if not object_groups:
                 return
 
+            self._addEngineToCacheKey()
             self._buildGlobalSettingsMessage(stack)
 
-            for group in object_groups:
-                group_message = self._slice_message.addRepeatedMessage("object_lists")
+            indexed = Preferences.getInstance().getValue("backend/send_indexed_meshes")
+            transformed_meshes = {} # Copies of an object share their mesh, so only transform it once for all copies.
+            slice_groups_separately = self._create_message is not None and len(object_groups) > 1 and stack.getProperty("print_sequence", "value") == "one_at_a_time"
+            settings_key = self._cache_key.copy()
+            for index, group in enumerate(object_groups):
+                if slice_groups_separately:
+                    group_slice_message = self._create_message("cura.proto.Slice")
+                    group_message = group_slice_message.addRepeatedMessage("object_lists")
+                    self._group_key = settings_key.copy()
+                    self._group_key.update(("group %d" % index).encode("utf-8"))
+                else:
+                    group_message = self._slice_message.addRepeatedMessage("object_lists")
+                self._updateCacheKey(b"object_list")
                 if group[0].getParent().callDecoration("isGroup"):
                     self._handlePerObjectSettings(group[0].getParent(), group_message)
                 for object in group:
-                    mesh_data = object.getMeshData().getTransformed(object.getWorldTransformation())
-
                     obj = group_message.addRepeatedMessage("objects")
                     obj.id = id(object)
-                    verts = numpy.array(mesh_data.getVertices())
-
-                    # Convert from Y up axes to Z up axes. Equals a 90 degree rotation.
-                    verts[:, [1, 2]] = verts[:, [2, 1]]
-                    verts[:, 1] *= -1
+                    vertex_data, index_data, vertex_digest = self._getVertexData(object, indexed, transformed_meshes)
 
-                    obj.vertices = verts
+                    obj.vertices = vertex_data
+                    if index_data is not None:
+                        obj.indices = index_data
+                    self._updateCacheKey(vertex_digest)
 
                     self._handlePerObjectSettings(object, obj)
 
                     Job.yieldThread()
 
+                if slice_groups_separately:
+                    self._group_slices.append((self._group_key.hexdigest(), group_slice_message))
+                    self._group_key = None
+
+        # Results that are not in memory are read from disk, which is too slow for the main thread.
+        if self._slice_cache is not None and not self._is_cancelled:
+            self._cached_result = self._slice_cache.get(self.getCacheKey())
+            if self._cached_result is None:
+                self._cached_group_results = [self._slice_cache.get(key) for key, _ in self._group_slices]
+
         self.setResult(True)
 
+    ##  Get the vertex data of a node as it is sent to the engine.
+    #
+    #   The vertex data is cached by mesh and transformation between slices,
+    #   so when only settings changed, nothing needs to be transformed.
+    #
+    #   \param node The node to get the vertex data of.
+    #   \param indexed Whether to send the mesh as unique vertices and indices
+    #   instead of three vertices for every face.
+    #   \param transformed_meshes See _transformVertices().
+    #   \return A tuple of the vertices as bytes of float32 values with Z up,
+    #   the indices as bytes of int32 values or None if not indexed, and the
+    #   digest of both for the cache key of the slice.
+    def _getVertexData(self, node, indexed, transformed_meshes):
+        mesh_data = node.getMeshData()
+        key = (id(mesh_data), node.getWorldTransformation().getData().tobytes(), indexed)
+        cached = self._vertex_cache.get(key)
+        if cached is not None and cached[0]() is mesh_data:
+            return cached[1:]
+
+        index_data = None
+        if indexed:
+            vertices, indices = self._getWeldedMesh(mesh_data)
+            index_data = indices.tobytes()
+        else:
+            vertices = mesh_data.getVertices()
+
+        vertex_data = self._transformVertices(node, vertices, indexed, transformed_meshes).tobytes()
+        vertex_digest = hashlib.sha1(vertex_data)
+        if index_data is not None:
+            vertex_digest.update(b"indices")
+            vertex_digest.update(index_data)
+        vertex_digest = vertex_digest.digest()
+
+        # The mesh is referenced weakly, so a cached entry of a mesh that is gone is
+        # recognised when it is looked up, even if another mesh reuses its id.
+        # There is no callback to remove the entry: that could run from the garbage
+        # collector while this thread holds the lock of the cache.
+        mesh_reference = weakref.ref(mesh_data)
+        size = len(vertex_data) + (len(index_data) if index_data is not None else 0)
+        self._vertex_cache.put(key, (mesh_reference, vertex_data, index_data, vertex_digest), size)
+        return vertex_data, index_data, vertex_digest
+
+    ##  Get the unique vertices and the indices of a mesh.
+    #
+    #   Welding is done once per mesh, in the coordinates of the mesh itself,
+    #   so it is shared by all copies and transformations of the mesh.
+    def _getWeldedMesh(self, mesh_data):
+        cached = self._welded_mesh_cache.get(id(mesh_data))
+        if cached is not None and cached[0]() is mesh_data:
+            return cached[1], cached[2]
+
+        vertices, indices = weldVertices(mesh_data.getVertices())
+        mesh_reference = weakref.ref(mesh_data) # No callback, for the same reason as in _getVertexData().
+        self._welded_mesh_cache.put(id(mesh_data), (mesh_reference, vertices, indices), vertices.nbytes + indices.nbytes)
+        return vertices, indices
+
+    ##  Get vertices of a node in the coordinates of the engine.
+    #
+    #   The vertices are rotated and scaled once for all nodes that share the
+    #   mesh and that have the same rotation and scale. Only the translation
+    #   is applied for each node.
+    #
+    #   \param node The node to get the vertices of.
+    #   \param vertices The vertices of the mesh of the node, or the welded
+    #   vertices of that mesh.
+    #   \param indexed Whether the vertices are welded.
+    #   \param transformed_meshes Dictionary of meshes that were already rotated
+    #   and scaled, kept for the duration of the job.
+    #   \return A float32 array of the vertices, with Z up.
+    def _transformVertices(self, node, vertices, indexed, transformed_meshes):
+        mesh_data = node.getMeshData()
+        matrix = node.getWorldTransformation().getData()
+        key = (id(mesh_data), matrix[:3, :3].tobytes(), indexed)
+        if key not in transformed_meshes:
+            verts = numpy.dot(vertices, matrix[:3, :3].T)
+
+            # Convert from Y up axes to Z up axes. Equals a 90 degree rotation.
+            verts[:, [1, 2]] = verts[:, [2, 1]]
+            verts[:, 1] *= -1
+            transformed_meshes[key] = (mesh_data, verts) # Keep the mesh, so that its id can't be reused during the job.
+
+        translation = numpy.array([matrix[0, 3], -matrix[2, 3], matrix[1, 3]])
+        return (transformed_meshes[key][1] + translation).astype(numpy.float32)
+
     def cancel(self):
         super().cancel()
         self._is_cancelled = True
@@ -125,53 +428,112 @@ class StartSliceJob(Job):
     def isCancelled(self):
         return self._is_cancelled
 
+    ##  Replace the placeholders in start or end g-code with setting values.
+    #
+    #   Any setting can be used as a placeholder. The template is parsed once
+    #   and only expanded again when a setting it refers to changed.
+    #
+    #   \param key The key of the g-code setting.
+    #   \param value The g-code with placeholders.
+    #   \param settings Dictionary of setting keys to values.
+    #   \return The expanded g-code as utf-8 bytes.
     def _expandGcodeTokens(self, key, value, settings):
-        try:
-            # any setting can be used as a token
-            fmt = GcodeStartEndFormatter()
-            return str(fmt.format(value, **settings)).encode("utf-8")
-        except:
-            Logger.log("w", "Unabled to do token replacement on start/end gcode %s", traceback.format_exc())
-            return str(value).encode("utf-8")
+        template_text = str(value)
+        template = self._gcode_template_cache.get(template_text)
+        if template is None:
+            template = GcodeTemplate(template_text)
+            self._gcode_template_cache.put(template_text, template, len(template_text) * 4) #Rough size of the text, its parsed form and its expansion.
+        return template.expand(settings)
 
     ##  Sends all global settings to the engine.
     #
     #   The settings are taken from the global stack. This does not include any
     #   per-extruder settings or per-object settings.
     def _buildGlobalSettingsMessage(self, stack):
-        keys = stack.getAllKeys()
-        settings = {}
-        for key in keys:
-            settings[key] = stack.getProperty(key, "value")
+        settings = Application.getInstance().getResolvedSettings().getAllValues()
 
         start_gcode = settings["machine_start_gcode"]
         settings["material_bed_temp_prepend"] = "{material_bed_temperature}" not in start_gcode #Pre-compute material material_bed_temp_prepend and material_print_temp_prepend
         settings["material_print_temp_prepend"] = "{material_print_temperature}" not in start_gcode
 
-        for key, value in settings.items(): #Add all submessages for each individual setting.
-            setting_message = self._settings_message.addRepeatedMessage("settings")
-            setting_message.name = key
+        encoded_settings = {}
+        for key, value in settings.items():
             if key == "machine_start_gcode" or key == "machine_end_gcode": #If it's a g-code message, use special formatting.
-                setting_message.value = self._expandGcodeTokens(key, value, settings)
+                encoded_settings[key] = self._expandGcodeTokens(key, value, settings)
             else:
-                setting_message.value = str(value).encode("utf-8")
+                encoded_settings[key] = str(value).encode("utf-8")
+        self._encoded_settings = encoded_settings
+        self._addSettingsToCacheKey(encoded_settings)
+
+        #If the engine has the settings of an earlier slice, only send what changed since then.
+        #A delta can't remove settings, so send everything if any setting is gone.
+        sent_settings = self._sent_settings
+        if sent_settings is not None and sent_settings.keys() <= encoded_settings.keys():
+            self._settings_message.base_generation = self._base_generation
+        else:
+            sent_settings = {}
+            self._settings_message.base_generation = 0
+
+        for key, value in encoded_settings.items(): #Add all submessages for each individual setting.
+            if sent_settings.get(key) == value:
+                continue
+            setting_message = self._settings_message.addRepeatedMessage("settings")
+            setting_message.name = key
+            setting_message.value = value
 
     def _handlePerObjectSettings(self, node, message):
+        encoded_settings = {}
         profile = node.callDecoration("getProfile")
         if profile:
             for key, value in profile.getAllSettingValues().items():
                 setting = message.addRepeatedMessage("settings")
                 setting.name = key
-                setting.value = str(value).encode()
+                encoded_settings[key] = str(value).encode()
+                setting.value = encoded_settings[key]
 
                 Job.yieldThread()
 
         object_settings = node.callDecoration("getAllSettingValues")
-        if not object_settings:
-            return
-        for key, value in object_settings.items():
-            setting = message.addRepeatedMessage("settings")
-            setting.name = key
-            setting.value = str(value).encode()
+        if object_settings:
+            for key, value in object_settings.items():
+                setting = message.addRepeatedMessage("settings")
+                setting.name = key
+                encoded_settings[key] = str(value).encode()
+                setting.value = encoded_settings[key]
+
+                Job.yieldThread()
+
+        self._addSettingsToCacheKey(encoded_settings)
 
-            Job.yieldThread()
+    ##  Add the identity of the engine and of the application to the cache
+    #   key of this slice.
+    #
+    #   Results that are cached on disk must not be used after the engine or
+    #   Cura is upgraded, since another version may slice differently.
+    def _addEngineToCacheKey(self):
+        engine_location = Preferences.getInstance().getValue("backend/location")
+        try:
+            engine_modified = os.path.getmtime(engine_location)
+        except OSError:
+            engine_modified = 0
+        engine_identity = "{0}\0{1}\0{2}".format(engine_location, engine_modified, Application.getInstance().getVersion())
+        self._updateCacheKey(engine_identity.encode("utf-8") + b"\1")
+
+    ##  Add settings to the cache key of this slice.
+    #
+    #   The settings are added in sorted order, so the key doesn't depend on
+    #   the order in which the settings were collected.
+    #
+    #   \param encoded_settings Dictionary of setting keys to the encoded values
+    #   as they are sent to the engine.
+    def _addSettingsToCacheKey(self, encoded_settings):
+        for key in sorted(encoded_settings):
+            self._updateCacheKey(key.encode("utf-8") + b"\0" + encoded_settings[key] + b"\0")
+        self._updateCacheKey(b"\1") #Separate this set of settings from the next.
+
+    ##  Add data to the cache key of this slice, and to the cache key of the
+    #   current group if the groups are sliced separately.
+    def _updateCacheKey(self, data):
+        self._cache_key.update(data)
+        if self._group_key is not None:
+            self._group_key.update(data)
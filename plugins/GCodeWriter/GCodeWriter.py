@@ -70,8 +70,12 @@ class GCodeWriter(MeshWriter):
 
         all_settings = InstanceContainer("G-code-imported-profile") #Create a new 'profile' with ALL settings so that the slice can be precisely reproduced.
         all_settings.setDefinition(settings.getBottom())
-        for key in settings.getAllKeys():
-            all_settings.setProperty(key, "value", settings.getProperty(key, "value")) #Just copy everything over to the setting instance.
+        if settings is Application.getInstance().getGlobalContainerStack():
+            values = Application.getInstance().getResolvedSettings().getAllValues() #The global stack was resolved already for slicing.
+        else:
+            values = { key: settings.getProperty(key, "value") for key in settings.getAllKeys() }
+        for key, value in values.items():
+            all_settings.setProperty(key, "value", value) #Just copy everything over to the setting instance.
         serialised = all_settings.serialize()
 
         # Escape characters that have a special meaning in g-code comments.
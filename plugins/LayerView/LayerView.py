@@ -15,10 +15,13 @@ from UM.View.RenderBatch import RenderBatch
 from UM.View.GL.OpenGL import OpenGL
 
 from cura.ConvexHullNode import ConvexHullNode
+from cura.LRUCache import LRUCache
 
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import QApplication
 
+import numpy
+
 from . import LayerViewProxy
 
 from UM.i18n import i18nCatalog
@@ -26,6 +29,17 @@ catalog = i18nCatalog("cura")
 
 ## View used to display g-code paths.
 class LayerView(View):
+    ##  Maximum size of the meshes of single layers that are kept around for
+    #   when the user moves to another layer, in bytes.
+    LayerMeshCacheSize = 128 * 1024 * 1024
+
+    ##  Number of layers to create meshes for ahead of the current layer, in
+    #   the direction the user is moving through the layers.
+    PrefetchLayerCount = 10
+
+    ##  Maximum size of the meshes that a single prefetch creates, in bytes.
+    PrefetchMemoryBudget = 32 * 1024 * 1024
+
     def __init__(self):
         super().__init__()
         self._shader = None
@@ -35,14 +49,20 @@ class LayerView(View):
         self._proxy = LayerViewProxy.LayerViewProxy()
         self._controller.getScene().getRoot().childrenChanged.connect(self._onSceneChanged)
         self._max_layers = 0
+        self._follow_top_layer = True # Whether to show the top layer when the number of layers changes.
         self._current_layer_num = 0
         self._current_layer_mesh = None
         self._current_layer_jumps = None
         self._top_layers_job = None
+        self._prefetch_job = None
+        self._layer_direction = 0 # 1 when the user is moving up through the layers, -1 when moving down.
         self._activity = False
 
         self._solid_layers = 5
 
+        # Meshes of single layers by (layer number, make_mesh), with the colors not yet scaled by brightness.
+        self._layer_mesh_cache = LRUCache(self.LayerMeshCacheSize)
+
         self._top_layer_timer = QTimer()
         self._top_layer_timer.setInterval(50)
         self._top_layer_timer.setSingleShot(True)
@@ -57,6 +77,7 @@ class LayerView(View):
         return self._current_layer_num
 
     def _onSceneChanged(self, node):
+        self._clearLayerMeshCache() # The layer data may have been replaced.
         self.calculateMaxLayers()
 
     def getMaxLayers(self):
@@ -75,6 +96,16 @@ class LayerView(View):
     def resetLayerData(self):
         self._current_layer_mesh = None
         self._current_layer_jumps = None
+        self._clearLayerMeshCache()
+
+    ##  Forget the cached meshes of single layers.
+    #
+    #   A new cache is created instead of clearing the old one, so that a job
+    #   that is still running for the old layer data cannot put its meshes in
+    #   the new cache.
+    def _clearLayerMeshCache(self):
+        self._cancelPrefetch()
+        self._layer_mesh_cache = LRUCache(self.LayerMeshCacheSize)
 
     def beginRendering(self):
         scene = self.getController().getScene()
@@ -101,12 +132,7 @@ class LayerView(View):
                     # Render all layers below a certain number as line mesh instead of vertices.
                     if self._current_layer_num - self._solid_layers > -1:
                         start = 0
-                        end = 0
-                        element_counts = layer_data.getElementCounts()
-                        for layer, counts in element_counts.items():
-                            if layer + self._solid_layers > self._current_layer_num:
-                                break
-                            end += counts
+                        end = layer_data.getElementCountUpTo(self._current_layer_num - self._solid_layers)
 
                         # This uses glDrawRangeElements internally to only draw a certain range of lines.
                         renderer.queueNode(node, mesh = layer_data, mode = RenderBatch.RenderMode.Lines, range = (start, end))
@@ -119,6 +145,11 @@ class LayerView(View):
 
     def setLayer(self, value):
         if self._current_layer_num != value:
+            direction = 1 if value > self._current_layer_num else -1
+            if direction != self._layer_direction:
+                self._cancelPrefetch() # The layers it creates are now behind us.
+            self._layer_direction = direction
+
             self._current_layer_num = value
             if self._current_layer_num < 0:
                 self._current_layer_num = 0
@@ -150,7 +181,17 @@ class LayerView(View):
             if new_max_layers < len(layer_data.getLayers()):
                 new_max_layers = len(layer_data.getLayers()) - 1
 
+        if new_max_layers == 0:
+            self._follow_top_layer = True # The next layer data is a new slice, so start at its top.
+
         if new_max_layers > 0 and new_max_layers != self._old_max_layers:
+            # While layers are still coming in, only move along with the top layer if it was shown,
+            # so that the layers below it can be looked at in the meantime.
+            if self._follow_top_layer or self._current_layer_num >= self._old_max_layers:
+                new_layer = new_max_layers
+            else:
+                new_layer = min(self._current_layer_num, new_max_layers)
+            self._follow_top_layer = False
             self._max_layers = new_max_layers
 
             # The qt slider has a bit of weird behavior that if the maxvalue needs to be changed first
@@ -158,9 +199,9 @@ class LayerView(View):
             # slider. 
             if new_max_layers > self._current_layer_num:
                 self.maxLayersChanged.emit()
-                self.setLayer(int(self._max_layers))
+                self.setLayer(int(new_layer))
             else:
-                self.setLayer(int(self._max_layers))
+                self.setLayer(int(new_layer))
                 self.maxLayersChanged.emit()
         self._top_layer_timer.start()
 
@@ -193,7 +234,7 @@ class LayerView(View):
 
         self.setBusy(True)
 
-        self._top_layers_job = _CreateTopLayersJob(self._controller.getScene(), self._current_layer_num, self._solid_layers)
+        self._top_layers_job = _CreateTopLayersJob(self._controller.getScene(), self._current_layer_num, self._solid_layers, self._layer_mesh_cache)
         self._top_layers_job.finished.connect(self._updateCurrentLayerMesh)
         self._top_layers_job.start()
 
@@ -209,33 +250,52 @@ class LayerView(View):
 
         self._top_layers_job = None
 
+        self._startPrefetch()
+
+    ##  Create the meshes of the layers the user is likely to look at next,
+    #   while the user is looking at the current layer.
+    def _startPrefetch(self):
+        self._cancelPrefetch() # Layers that the previous prefetch already created are skipped.
+        if self._layer_direction == 0:
+            return
+
+        self._prefetch_job = _PrefetchLayersJob(self._controller.getScene(), self._current_layer_num, self._layer_direction, self._solid_layers, self._layer_mesh_cache)
+        self._prefetch_job.start()
+
+    def _cancelPrefetch(self):
+        if self._prefetch_job:
+            self._prefetch_job.cancel()
+            self._prefetch_job = None
+
+##  Job that creates the meshes of the top layers that are shown as solid
+#   lines, and the jumps of the current layer.
+#
+#   The meshes of single layers are taken from a cache when possible, so that
+#   moving one layer up or down only needs to create the mesh of one layer.
 class _CreateTopLayersJob(Job):
-    def __init__(self, scene, layer_number, solid_layers):
+    def __init__(self, scene, layer_number, solid_layers, layer_mesh_cache):
         super().__init__()
 
         self._scene = scene
         self._layer_number = layer_number
         self._solid_layers = solid_layers
+        self._layer_mesh_cache = layer_mesh_cache
         self._cancel = False
 
     def run(self):
-        layer_data = None
-        for node in DepthFirstIterator(self._scene.getRoot()):
-            layer_data = node.callDecoration("getLayerData")
-            if layer_data:
-                break
-
+        layer_data = _findLayerData(self._scene)
         if self._cancel or not layer_data:
             return
 
-        layer_mesh = MeshData()
+        vertices = []
+        colors = []
         for i in range(self._solid_layers):
             layer_number = self._layer_number - i
             if layer_number < 0:
                 continue
 
             try:
-                layer = layer_data.getLayer(layer_number).createMesh()
+                layer = _getLayerMesh(self._layer_mesh_cache, layer_data, layer_number, True)
             except Exception as e:
                 print(e)
                 return
@@ -243,12 +303,12 @@ class _CreateTopLayersJob(Job):
             if not layer or layer.getVertices() is None:
                 continue
 
-            layer_mesh.addVertices(layer.getVertices())
+            vertices.append(layer.getVertices())
 
             # Scale layer color by a brightness factor based on the current layer number
             # This will result in a range of 0.5 - 1.0 to multiply colors by.
             brightness = (2.0 - (i / self._solid_layers)) / 2.0
-            layer_mesh.addColors(layer.getColors() * brightness)
+            colors.append(layer.getColors() * brightness)
 
             if self._cancel:
                 return
@@ -258,8 +318,13 @@ class _CreateTopLayersJob(Job):
         if self._cancel:
             return
 
+        layer_mesh = MeshData()
+        if vertices:
+            layer_mesh.addVertices(numpy.concatenate(vertices))
+            layer_mesh.addColors(numpy.concatenate(colors))
+
         Job.yieldThread()
-        jump_mesh = layer_data.getLayer(self._layer_number).createJumps()
+        jump_mesh = _getLayerMesh(self._layer_mesh_cache, layer_data, self._layer_number, False)
         if not jump_mesh or jump_mesh.getVertices() is None:
             jump_mesh = None
 
@@ -268,3 +333,97 @@ class _CreateTopLayersJob(Job):
     def cancel(self):
         self._cancel = True
         super().cancel()
+
+
+##  Job that creates the meshes of the layers ahead of the current layer, so
+#   that they are already in the cache when the user gets there.
+#
+#   The job stops when it has created PrefetchMemoryBudget bytes of meshes, so
+#   that it does not push the layers around the current layer out of the cache.
+class _PrefetchLayersJob(Job):
+    ##  Creates a new prefetch job.
+    #
+    #   \param scene The scene with the layer data.
+    #   \param layer_number The current layer.
+    #   \param direction 1 to prefetch the layers above the current layer, -1
+    #   to prefetch the layers below it.
+    #   \param solid_layers The number of layers shown as solid mesh.
+    #   \param layer_mesh_cache The cache to put the meshes in.
+    def __init__(self, scene, layer_number, direction, solid_layers, layer_mesh_cache):
+        super().__init__()
+
+        self._scene = scene
+        self._layer_number = layer_number
+        self._direction = direction
+        self._solid_layers = solid_layers
+        self._layer_mesh_cache = layer_mesh_cache
+        self._cancel = False
+
+    def run(self):
+        layer_data = _findLayerData(self._scene)
+        if self._cancel or not layer_data:
+            return
+
+        created_size = 0
+        for step in range(1, LayerView.PrefetchLayerCount + 1):
+            # Moving up adds the next layer to the top of the solid layers. Moving down
+            # adds the layer below the bottom solid layer. Both need the jumps of the new current layer.
+            layer_number = self._layer_number + step * self._direction
+            if self._direction > 0:
+                keys = [(layer_number, True), (layer_number, False)]
+            else:
+                keys = [(layer_number - self._solid_layers + 1, True), (layer_number, False)]
+
+            for layer, make_mesh in keys:
+                if layer < 0 or (layer, make_mesh) in self._layer_mesh_cache:
+                    continue
+                mesh = _getLayerMesh(self._layer_mesh_cache, layer_data, layer, make_mesh)
+                if mesh is None:
+                    return # Went past the top or the bottom of the print.
+                if mesh.getVertices() is not None:
+                    created_size += mesh.getVertices().nbytes + mesh.getColors().nbytes
+
+                Job.yieldThread()
+                if self._cancel or created_size > LayerView.PrefetchMemoryBudget:
+                    return
+
+    def cancel(self):
+        self._cancel = True
+        super().cancel()
+
+
+##  Find the layer data in the scene.
+#
+#   \return The LayerData of the first node that has layer data, or None.
+def _findLayerData(scene):
+    for node in DepthFirstIterator(scene.getRoot()):
+        layer_data = node.callDecoration("getLayerData")
+        if layer_data:
+            return layer_data
+    return None
+
+##  Get the mesh or the jumps of a single layer, from the cache if possible.
+#
+#   Meshes that are not in the cache yet are created and put in the cache.
+#
+#   \param layer_mesh_cache The LRUCache of layer meshes.
+#   \param layer_data The layer data to create the mesh from.
+#   \param layer_number The number of the layer.
+#   \param make_mesh True for the mesh of the layer, False for its jumps.
+#   \return The MeshData, or None if there is no such layer.
+def _getLayerMesh(layer_mesh_cache, layer_data, layer_number, make_mesh):
+    key = (layer_number, make_mesh)
+    mesh = layer_mesh_cache.get(key)
+    if mesh is not None:
+        return mesh
+
+    layer = layer_data.getLayer(layer_number)
+    if not layer:
+        return None
+    mesh = layer.createMeshOrJumps(make_mesh)
+
+    size = 0
+    if mesh.getVertices() is not None:
+        size = mesh.getVertices().nbytes + mesh.getColors().nbytes
+    layer_mesh_cache.put(key, mesh, size)
+    return mesh
@@ -30,6 +30,7 @@ Item
     property alias reloadAll: reloadAllAction;
     property alias resetAllTranslation: resetAllTranslationAction;
     property alias resetAll: resetAllAction;
+    property alias arrangeAll: arrangeAllAction;
 
     property alias addMachine: addMachineAction;
     property alias configureMachines: settingsAction;
@@ -252,6 +253,13 @@ Item
         onTriggered: Printer.resetAll();
     }
 
+    Action
+    {
+        id: arrangeAllAction;
+        text: catalog.i18nc("@action:inmenu menubar:edit","&Arrange All Objects");
+        onTriggered: Printer.arrangeAll();
+    }
+
     Action
     {
         id: openAction;
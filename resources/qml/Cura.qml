@@ -137,6 +137,7 @@ UM.MainWindow
                 MenuItem { action: Actions.deleteAll; }
                 MenuItem { action: Actions.resetAllTranslation; }
                 MenuItem { action: Actions.resetAll; }
+                MenuItem { action: Actions.arrangeAll; }
                 MenuSeparator { }
                 MenuItem { action: Actions.groupObjects;}
                 MenuItem { action: Actions.mergeObjects;}
@@ -643,6 +644,7 @@ UM.MainWindow
         MenuItem { action: Actions.reloadAll; }
         MenuItem { action: Actions.resetAllTranslation; }
         MenuItem { action: Actions.resetAll; }
+        MenuItem { action: Actions.arrangeAll; }
         MenuSeparator { }
         MenuItem { action: Actions.groupObjects; }
         MenuItem { action: Actions.mergeObjects; }
@@ -695,6 +697,7 @@ UM.MainWindow
         MenuItem { action: Actions.reloadAll; }
         MenuItem { action: Actions.resetAllTranslation; }
         MenuItem { action: Actions.resetAll; }
+        MenuItem { action: Actions.arrangeAll; }
         MenuSeparator { }
         MenuItem { action: Actions.groupObjects; }
         MenuItem { action: Actions.mergeObjects; }
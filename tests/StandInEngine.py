@@ -0,0 +1,177 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+##  Stand-in for CuraEngine, for tests of the communication with the engine.
+#
+#   It is started like the engine: StandInEngine.py connect 127.0.0.1:<port>
+#   It connects to the front-end over Arcus with the messages of Cura.proto and
+#   "slices" every Slice message it gets, one after the other like the engine
+#   does. Instead of real g-code it sends back what it got, so that tests can
+#   check what arrived in the engine:
+#
+#   ;PID:<process id of the engine>
+#   ;SLICE:<number of the Slice message, starting at 1>
+#   ;SETTING:<name>=<value> for every global setting it has
+#   ;MESH:<object id>:<SHA-1 of the float32 vertices of all faces>
+#
+#   The faces are rebuilt from the indices if an object has them. The setting
+#   "standin_slice_time" makes slicing take that many seconds.
+#
+#   With --settings-delta it reports that it supports setting lists with only
+#   the changed settings, with an EngineFeatures message. It then answers a
+#   Slice with SettingsResync if the settings it got were changes to settings
+#   that it doesn't have. Without it, it behaves like an engine that doesn't
+#   know about either message.
+
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import numpy
+
+import Arcus
+
+ProtocolFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "CuraEngineBackend", "Cura.proto")
+
+
+class _Listener(Arcus.SocketListener):
+    def __init__(self, engine):
+        super().__init__()
+        self._engine = engine
+
+    def stateChanged(self, state):
+        self._engine.wake()
+
+    def messageReceived(self):
+        self._engine.wake()
+
+    def error(self, error):
+        self._engine.wake()
+
+
+class StandInEngine:
+    def __init__(self, address, port, settings_delta = False):
+        self._address = address
+        self._port = port
+        self._settings_delta = settings_delta
+        self._condition = threading.Condition()
+        self._settings = {}
+        self._generation = 0 #Generation of the settings that the engine has.
+        self._resync_generation = None #Generation of the settings that could not be applied, if any.
+        self._slice_count = 0
+        self._socket = Arcus.Socket()
+        self._listener = _Listener(self)
+        self._socket.addListener(self._listener)
+        if not self._socket.registerAllMessageTypes(ProtocolFile):
+            raise RuntimeError("Could not register the message types of " + ProtocolFile)
+
+    ##  Wake up the engine to look at the socket again.
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    ##  Handle messages until the front-end closes the connection.
+    def run(self):
+        self._socket.connect(self._address, self._port)
+        if self._settings_delta:
+            with self._condition:
+                while self._socket.getState() != Arcus.SocketState.Connected:
+                    if self._socket.getState() in (Arcus.SocketState.Closed, Arcus.SocketState.Error):
+                        return
+                    self._condition.wait(0.1)
+            features = self._socket.createMessage("cura.proto.EngineFeatures")
+            features.settings_delta = True
+            self._socket.sendMessage(features)
+
+        while True:
+            with self._condition:
+                message = self._socket.takeNextMessage()
+                if message is None:
+                    if self._socket.getState() in (Arcus.SocketState.Closed, Arcus.SocketState.Error):
+                        return
+                    self._condition.wait(0.1)
+                    continue
+            if message.getTypeName() == "cura.proto.SettingList":
+                self._onSettingList(message)
+            elif message.getTypeName() == "cura.proto.Slice":
+                self._onSlice(message)
+
+    def _onSettingList(self, message):
+        if message.base_generation and self._settings_delta:
+            if message.base_generation != self._generation:
+                self._resync_generation = message.generation
+                return
+        else: #Like an engine without support for deltas, take every list as all settings.
+            self._settings = {}
+        self._resync_generation = None
+        self._generation = message.generation
+        for index in range(message.repeatedMessageCount("settings")):
+            setting = message.getRepeatedMessage("settings", index)
+            self._settings[setting.name] = setting.value
+
+    def _onSlice(self, message):
+        self._slice_count += 1
+        if self._resync_generation is not None:
+            resync = self._socket.createMessage("cura.proto.SettingsResync")
+            resync.generation = self._resync_generation
+            self._socket.sendMessage(resync)
+            return
+        gcode = [";PID:{0}\n".format(os.getpid()), ";SLICE:{0}\n".format(self._slice_count)]
+        for name, value in sorted(self._settings.items()):
+            gcode.append(";SETTING:{0}={1}\n".format(name, value.decode("utf-8")))
+
+        for list_index in range(message.repeatedMessageCount("object_lists")):
+            object_list = message.getRepeatedMessage("object_lists", list_index)
+            for object_index in range(object_list.repeatedMessageCount("objects")):
+                obj = object_list.getRepeatedMessage("objects", object_index)
+                gcode.append(";MESH:{0}:{1}\n".format(obj.id, hashlib.sha1(rebuildFaces(obj.vertices, obj.indices).tobytes()).hexdigest()))
+
+        progress = self._socket.createMessage("cura.proto.Progress")
+        progress.amount = 0.5
+        self._socket.sendMessage(progress)
+        time.sleep(float(self._settings.get("standin_slice_time", b"0")))
+
+        layer = self._socket.createMessage("cura.proto.Layer")
+        layer.id = 0
+        layer.height = 0.2
+        layer.thickness = 0.2
+        polygon = layer.addRepeatedMessage("polygons")
+        polygon.type = 1
+        polygon.points = numpy.array([0, 0, 1000, 0, 1000, 1000], numpy.int64).tobytes()
+        polygon.line_width = 400
+        self._socket.sendMessage(layer)
+
+        prefix = self._socket.createMessage("cura.proto.GCodePrefix")
+        prefix.data = ";FLAVOR:RepRap\n".encode("utf-8")
+        self._socket.sendMessage(prefix)
+        gcode_layer = self._socket.createMessage("cura.proto.GCodeLayer")
+        gcode_layer.data = "".join(gcode).encode("utf-8")
+        self._socket.sendMessage(gcode_layer)
+        print_time = self._socket.createMessage("cura.proto.ObjectPrintTime")
+        print_time.time = 60
+        print_time.material_amount = 1
+        self._socket.sendMessage(print_time)
+        self._socket.sendMessage(self._socket.createMessage("cura.proto.SlicingFinished"))
+
+
+##  Get the vertices of all faces of an object as the engine gets them.
+#
+#   \param vertices The bytes of the float32 vertices of the object.
+#   \param indices The bytes of the int32 indices of the faces, or empty if the
+#   vertices are those of all faces already.
+#   \return A float32 array with three vertices for every face.
+def rebuildFaces(vertices, indices):
+    vertices = numpy.frombuffer(vertices, dtype = numpy.float32).reshape((-1, 3))
+    if not indices:
+        return vertices
+    return vertices[numpy.frombuffer(indices, dtype = numpy.int32)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "connect":
+        print("Usage: StandInEngine.py connect <address>:<port> [-j <definition>] [-vv] [--settings-delta]")
+        sys.exit(1)
+    address, port = sys.argv[2].rsplit(":", 1)
+    StandInEngine(address, int(port), "--settings-delta" in sys.argv).run()
@@ -0,0 +1,63 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from unittest.mock import MagicMock
+
+import numpy
+import pytest
+
+pytest.importorskip("UM")
+
+from UM.Math.Polygon import Polygon
+from UM.Math.Vector import Vector
+from UM.Scene.SceneNode import SceneNode
+
+from cura import ConvexHullDecorator
+from cura import PrintHeadPolygons
+
+
+##  Create a node with a hull, as if a hull job just finished for it.
+@pytest.fixture
+def hullNode(monkeypatch):
+    application = MagicMock()
+    application.getGlobalContainerStack.return_value = None
+    monkeypatch.setattr(ConvexHullDecorator.Application, "getInstance", lambda: application)
+    monkeypatch.setattr(PrintHeadPolygons.Application, "getInstance", lambda: application)
+    head_polygons = PrintHeadPolygons.PrintHeadPolygons()
+    application.getPrintHeadPolygons.return_value = head_polygons
+
+    root = SceneNode()
+    node = SceneNode(root)
+    decorator = ConvexHullDecorator.ConvexHullDecorator()
+    node.addDecorator(decorator)
+    decorator.setConvexHull(Polygon(numpy.array([[-5, -5], [-5, 5], [5, 5], [5, -5]], numpy.float32)))
+    decorator.setConvexHullTransformation(decorator.getConvexHullTransformation())
+    return node, decorator, head_polygons
+
+
+def test_translateHull(hullNode):
+    node, decorator, _ = hullNode
+
+    node.setPosition(Vector(10, 0, 20))
+
+    assert decorator.translateConvexHull()
+    assert numpy.allclose(decorator.getConvexHull().getPoints().min(axis = 0), [5, 15])
+
+
+def test_translateHullAfterPrintSequenceChanged(hullNode):
+    node, decorator, head_polygons = hullNode
+
+    head_polygons._onPropertyChanged("print_sequence", "value")
+    node.setPosition(Vector(10, 0, 20))
+
+    # The hull may have to include the head now, so it must be computed again.
+    assert not decorator.translateConvexHull()
+
+
+def test_translateHullAfterHeadChanged(hullNode):
+    node, decorator, head_polygons = hullNode
+
+    head_polygons._onPropertyChanged("machine_head_with_fans_polygon", "value")
+    node.setPosition(Vector(10, 0, 20))
+
+    assert not decorator.translateConvexHull()
@@ -0,0 +1,543 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import hashlib
+import os
+import queue
+import socket
+import subprocess
+import sys
+import time
+import unittest.mock
+
+import numpy
+import pytest
+
+pytest.importorskip("UM")
+Arcus = pytest.importorskip("Arcus")
+pytest.importorskip("PyQt5")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+
+from CuraEngineBackend import CuraEngineBackend
+from CuraEngineBackend import ProcessSlicedLayersJob
+from CuraEngineBackend import StartSliceJob
+
+
+##  Stand-in for ProcessSlicedLayersJob that records what it gets.
+class FakeProcessSlicedLayersJob:
+    def __init__(self, layers):
+        self.layers = list(layers)
+        self.finished = False
+        self.aborted = False
+
+    def addLayer(self, layer):
+        self.layers.append(layer)
+
+    def finishLayers(self):
+        self.finished = True
+
+    def start(self):
+        pass
+
+    def abort(self):
+        self.aborted = True
+
+
+##  Stand-in for an engine message.
+class FakeMessage:
+    def __init__(self, type_name, **fields):
+        self._type_name = type_name
+        self.__dict__.update(fields)
+
+    def getTypeName(self):
+        return self._type_name
+
+
+##  Stand-in for the socket to the engine.
+#
+#   It records the messages that are sent to the engine, and hands messages
+#   from the engine to the handler that the backend registered for their type.
+class FakeSocket:
+    def __init__(self, backend):
+        self.sent_messages = []
+        self._handlers = {
+            "cura.proto.Layer": backend._onLayerMessage,
+            "cura.proto.GCodeLayer": backend._onGCodeLayerMessage,
+            "cura.proto.ObjectPrintTime": backend._onObjectPrintTimeMessage,
+            "cura.proto.SlicingFinished": backend._onSlicingFinishedMessage
+        }
+
+    def sendMessage(self, message):
+        self.sent_messages.append(message)
+
+    def receive(self, message):
+        self._handlers[message.getTypeName()](message)
+
+
+##  Stand-in for the engine process.
+class FakeProcess:
+    def __init__(self):
+        self.terminated = False
+
+    def terminate(self):
+        self.terminated = True
+
+    def wait(self):
+        return 0
+
+
+##  Create a backend that is in the middle of slicing, without an engine.
+def createSlicingBackend():
+    backend = CuraEngineBackend.CuraEngineBackend.__new__(CuraEngineBackend.CuraEngineBackend)
+    backend._stale_slices = 0
+    backend._stored_layer_data = []
+    backend._process_layers_job = None
+    backend._pending_groups = []
+    backend._slicing = True
+    backend._message = None
+    backend._layer_view_active = True
+    backend.backendStateChange = unittest.mock.MagicMock()
+    backend.processingProgress = unittest.mock.MagicMock()
+    return backend
+
+
+##  Create a backend with a persistent engine that is slicing.
+def createEngineBackend():
+    backend = createSlicingBackend()
+    backend._layer_view_active = False
+    backend._always_restart = False
+    backend._slice_in_engine = True
+    backend._start_slice_job = None
+    backend._slice_cache_key = None
+    backend._sent_settings = {}
+    backend._restart = False
+    backend._stale_slice_timer = unittest.mock.MagicMock()
+    backend._engine_start_time = None
+    backend._splice_groups_job = None
+    backend._slice_groups_together = False
+    backend._unspliceable_gcode = None
+    backend._process = FakeProcess()
+    backend._socket = FakeSocket(backend)
+    backend._scene = unittest.mock.MagicMock()
+    backend._scene.gcode_list = []
+    backend._print_times = []
+    backend._clearGroupSlices()
+    backend.slicingCancelled = unittest.mock.MagicMock()
+    backend.printDurationMessage = unittest.mock.MagicMock()
+    return backend
+
+
+def test_leaveLayerViewDuringSlice(monkeypatch):
+    monkeypatch.setattr(ProcessSlicedLayersJob, "ProcessSlicedLayersJob", FakeProcessSlicedLayersJob)
+    backend = createSlicingBackend()
+
+    backend._onLayerMessage("layer 0")
+    job = backend._process_layers_job
+    assert job is not None
+
+    backend._layer_view_active = False # The user switched to another view.
+    backend._onLayerMessage("layer 1")
+    backend._finishSlicing()
+
+    # The job got all layers and was told that no more layers come, so it doesn't wait forever.
+    assert job.layers == ["layer 0", "layer 1"]
+    assert job.finished
+
+
+def test_noLayerViewDuringSlice(monkeypatch):
+    monkeypatch.setattr(ProcessSlicedLayersJob, "ProcessSlicedLayersJob", FakeProcessSlicedLayersJob)
+    backend = createSlicingBackend()
+    backend._layer_view_active = False
+
+    backend._onLayerMessage("layer 0")
+    backend._finishSlicing()
+
+    # The layers are kept until the user opens the layer view.
+    assert backend._process_layers_job is None
+    assert backend._stored_layer_data == ["layer 0"]
+
+
+def test_engineQuitDuringSlice(monkeypatch):
+    monkeypatch.setattr(ProcessSlicedLayersJob, "ProcessSlicedLayersJob", FakeProcessSlicedLayersJob)
+    backend = createEngineBackend()
+    backend._layer_view_active = True
+    backend._restart = True # Don't create a new socket.
+
+    backend._onLayerMessage("layer 0")
+    job = backend._process_layers_job
+    backend._onBackendQuit()
+
+    # The engine crashed, so the rest of the layers never come.
+    assert job.aborted
+    assert backend._process_layers_job is None
+
+
+##  Create a stand-in for a SpliceGroupsJob that is done.
+def createSpliceGroupsJob(result):
+    job = unittest.mock.MagicMock()
+    job.getResult.return_value = result
+    job.getGCode.return_value = ("G28\n", "M104 S0\n")
+    return job
+
+
+def test_unspliceableGroups():
+    backend = createEngineBackend()
+    slices = []
+    backend.slice = lambda: slices.append(backend._slice_groups_together)
+    backend._slice_cache_key = "key"
+    job = createSpliceGroupsJob(None)
+    backend._splice_groups_job = job
+
+    backend._onSpliceGroupsCompleted(job)
+
+    # The groups are sliced again, all together, and the g-code that couldn't be joined is remembered.
+    assert slices == [True]
+    assert backend._unspliceable_gcode == ("G28\n", "M104 S0\n")
+    assert backend._slice_cache_key is None
+    assert backend._splice_groups_job is None
+
+
+def test_spliceGroupsAfterCancel():
+    backend = createEngineBackend()
+    job = createSpliceGroupsJob(None)
+    backend._splice_groups_job = job
+    slices = []
+    backend.slice = lambda: slices.append(True)
+
+    backend._stopSlicing()
+    backend._onSpliceGroupsCompleted(job)
+
+    # The result of a cancelled slice is ignored.
+    assert slices == []
+    assert backend._unspliceable_gcode is None
+
+
+def test_cancelSliceInPersistentEngine():
+    backend = createEngineBackend()
+    process = backend._process
+
+    backend._stopSlicing()
+
+    # The engine is kept, and the slice that is still running in it is counted as stale.
+    assert not process.terminated
+    assert backend._stale_slices == 1
+    assert not backend._slicing
+
+    # The output of the cancelled slice is discarded, up to and including its end.
+    backend._slicing = True
+    backend._slice_in_engine = True
+    backend._socket.receive(FakeMessage("cura.proto.Layer", id = 0))
+    backend._socket.receive(FakeMessage("cura.proto.GCodeLayer", data = b"G1 X1"))
+    backend._socket.receive(FakeMessage("cura.proto.SlicingFinished"))
+    assert backend._stale_slices == 0
+    assert backend._stored_layer_data == []
+    assert backend._scene.gcode_list == []
+    assert backend._slicing
+
+    # The output after it belongs to the next slice.
+    backend._socket.receive(FakeMessage("cura.proto.Layer", id = 0))
+    backend._socket.receive(FakeMessage("cura.proto.GCodeLayer", data = b"G1 X2"))
+    backend._socket.receive(FakeMessage("cura.proto.SlicingFinished"))
+    assert backend._scene.gcode_list == ["G1 X2"]
+    assert not backend._slicing
+    assert not backend._slice_in_engine
+
+
+def test_staleSliceTimeout():
+    backend = createEngineBackend()
+    process = backend._process
+
+    backend._stopSlicing()
+    assert backend._stale_slice_timer.start.called
+
+    # The cancelled slice is still running when the time is up, so the engine is restarted.
+    backend._onStaleSliceTimeout()
+    assert process.terminated
+    assert backend._stale_slices == 0
+    assert backend._restart
+
+
+def test_staleSliceTimeFollowsEngineStart():
+    backend = createEngineBackend()
+    backend._engine_start_time = time.monotonic() - 3 # The engine took three seconds to start.
+
+    backend._onBackendConnected()
+
+    # Waiting for a cancelled slice is worth it as long as it's shorter than a restart.
+    interval = backend._stale_slice_timer.setInterval.call_args[0][0]
+    assert 3000 <= interval < 4000
+    assert backend._engine_start_time is None
+
+
+def test_staleSliceFinishedBeforeTimeout():
+    backend = createEngineBackend()
+
+    backend._stopSlicing()
+    backend._socket.receive(FakeMessage("cura.proto.SlicingFinished"))
+    backend._onStaleSliceTimeout()
+
+    assert not backend._process.terminated
+    assert not backend._restart
+
+
+def test_cancelSliceNotSentYet():
+    backend = createEngineBackend()
+    backend._slice_in_engine = False # The start slice job is still running.
+
+    backend._stopSlicing()
+
+    assert not backend._process.terminated
+    assert backend._stale_slices == 0
+
+
+def test_stopSlicingWithStaleSlice():
+    backend = createEngineBackend()
+    backend._stale_slices = 1 # A cancelled slice is still running in the engine.
+    process = backend._process
+
+    backend._stopSlicing()
+
+    # The next slice would have to wait for two cancelled slices, so the engine is restarted instead.
+    assert process.terminated
+    assert backend._process is None
+    assert backend._stale_slices == 0
+    assert backend._restart
+
+
+def test_stopSlicingWithSeveralGroups():
+    backend = createEngineBackend()
+    backend._pending_groups.extend([0, 1])
+    process = backend._process
+
+    backend._stopSlicing()
+
+    assert process.terminated
+    assert backend._stale_slices == 0
+    assert len(backend._pending_groups) == 0
+
+
+def test_stopSlicingWithoutPersistentEngine():
+    backend = createEngineBackend()
+    backend._always_restart = True
+    process = backend._process
+
+    backend._stopSlicing()
+
+    assert process.terminated
+    assert backend._stale_slices == 0
+
+
+##  Listener that queues the messages from the stand-in engine, so that the
+#   test can hand them to the backend on its own thread, like the main thread
+#   of the application gets them.
+class QueueingListener(Arcus.SocketListener):
+    def __init__(self):
+        super().__init__()
+        self.socket = None
+        self.messages = queue.Queue()
+
+    def stateChanged(self, state):
+        pass
+
+    def messageReceived(self):
+        self.messages.put(self.socket.takeNextMessage())
+
+    def error(self, error):
+        pass
+
+
+##  Start a stand-in engine process, see StandInEngine.py, and create a backend
+#   with a persistent engine that is connected to it.
+#
+#   The extra command line arguments of the engine can be given as the
+#   parameter of the fixture.
+@pytest.fixture
+def standInEngine(request):
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        port = free_socket.getsockname()[1]
+
+    engine_socket = Arcus.Socket()
+    listener = QueueingListener()
+    listener.socket = engine_socket
+    engine_socket.addListener(listener)
+    assert engine_socket.registerAllMessageTypes(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "CuraEngineBackend", "Cura.proto"))
+    engine_socket.listen("127.0.0.1", port)
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "StandInEngine.py"), "connect", "127.0.0.1:{0}".format(port)] + getattr(request, "param", []))
+    try:
+        deadline = time.monotonic() + 10
+        while engine_socket.getState() != Arcus.SocketState.Connected:
+            assert time.monotonic() < deadline, "The stand-in engine did not connect"
+            time.sleep(0.01)
+
+        backend = createEngineBackend()
+        backend._slicing = False
+        backend._slice_in_engine = False
+        backend._settings_generation = 0
+        backend._engine_settings_delta = False
+        backend._socket = engine_socket
+        backend._process = process
+        backend._message_handlers = {
+            "cura.proto.Layer": backend._onLayerMessage,
+            "cura.proto.Progress": backend._onProgressMessage,
+            "cura.proto.GCodeLayer": backend._onGCodeLayerMessage,
+            "cura.proto.GCodePrefix": backend._onGCodePrefixMessage,
+            "cura.proto.ObjectPrintTime": backend._onObjectPrintTimeMessage,
+            "cura.proto.SlicingFinished": backend._onSlicingFinishedMessage,
+            "cura.proto.SettingsResync": backend._onSettingsResyncMessage,
+            "cura.proto.EngineFeatures": backend._onEngineFeaturesMessage
+        }
+        yield backend, listener.messages, process
+    finally:
+        engine_socket.close()
+        process.terminate()
+        process.wait()
+
+
+##  Hand messages from the stand-in engine to the backend until a condition
+#   holds.
+#
+#   \param condition Function that gets the last message and returns whether
+#   to stop.
+def receiveUntil(backend, messages, condition):
+    while True:
+        message = messages.get(timeout = 10)
+        backend._message_handlers[message.getTypeName()](message)
+        if condition(message):
+            return
+
+
+##  Start a slice in the backend as if the start slice job just finished.
+#
+#   \param settings Dictionary of the global settings.
+#   \param meshes List of (vertices, indices) of the objects to slice, where
+#   indices is None for meshes that are not indexed.
+#   \param base_generation If not 0, the settings are the changes since the
+#   settings with this generation.
+def startSlice(backend, settings, meshes, base_generation = 0):
+    settings_message = backend._socket.createMessage("cura.proto.SettingList")
+    encoded_settings = {}
+    for key, value in settings.items():
+        setting = settings_message.addRepeatedMessage("settings")
+        setting.name = key
+        setting.value = str(value).encode("utf-8")
+        encoded_settings[key] = setting.value
+    settings_message.base_generation = base_generation
+    slice_message = backend._socket.createMessage("cura.proto.Slice")
+    object_list = slice_message.addRepeatedMessage("object_lists")
+    for object_id, (vertices, indices) in enumerate(meshes):
+        obj = object_list.addRepeatedMessage("objects")
+        obj.id = object_id
+        obj.vertices = vertices.tobytes()
+        if indices is not None:
+            obj.indices = indices.tobytes()
+
+    job = unittest.mock.MagicMock()
+    job.isCancelled.return_value = False
+    job.getError.return_value = None
+    job.getResult.return_value = True
+    job.getCacheKey.return_value = None
+    job.getCachedResult.return_value = None
+    job.getGroupSlices.return_value = []
+    job.getSettingsMessage.return_value = settings_message
+    job.getSliceMessage.return_value = slice_message
+    job.getEncodedSettings.return_value = encoded_settings
+    backend._slicing = True
+    backend._onStartSliceCompleted(job)
+
+
+##  Get the comment lines of the stand-in engine from the g-code of a slice.
+def getStandInOutput(backend):
+    return [line for line in "".join(backend._scene.gcode_list).splitlines() if line.startswith((";PID:", ";SLICE:", ";SETTING:", ";MESH:"))]
+
+
+def test_persistentEngineReusedAfterCancel(standInEngine):
+    backend, messages, process = standInEngine
+    mesh = (numpy.zeros((3, 3), numpy.float32), None)
+
+    startSlice(backend, { "layer_height": 0.2, "standin_slice_time": 1 }, [mesh])
+    receiveUntil(backend, messages, lambda message: message.getTypeName() == "cura.proto.Progress") # The engine is slicing.
+    backend._stopSlicing()
+    assert backend._stale_slices == 1
+
+    startSlice(backend, { "layer_height": 0.1 }, [mesh])
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+
+    # The same engine process sliced the new slice, and only its output was used.
+    assert process.poll() is None
+    assert backend._process is process
+    assert backend._stale_slices == 0
+    assert getStandInOutput(backend) == [";PID:{0}".format(process.pid), ";SLICE:2", ";SETTING:layer_height=0.1", ";MESH:0:" + hashlib.sha1(mesh[0].tobytes()).hexdigest()]
+
+    # And it keeps slicing.
+    backend._scene.gcode_list = []
+    startSlice(backend, { "layer_height": 0.3 }, [mesh])
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+    assert getStandInOutput(backend)[:3] == [";PID:{0}".format(process.pid), ";SLICE:3", ";SETTING:layer_height=0.3"]
+
+
+def test_indexedMeshAfterCancel(standInEngine):
+    backend, messages, process = standInEngine
+    corners = numpy.random.RandomState(0).uniform(-100, 100, (50, 3)).astype(numpy.float32)
+    vertices = corners[numpy.random.RandomState(1).randint(0, 50, 600)] # Faces that share their corners.
+    unique_vertices, indices = StartSliceJob.weldVertices(vertices)
+    assert len(unique_vertices) < len(vertices)
+
+    startSlice(backend, { "standin_slice_time": 1 }, [(vertices, None)])
+    receiveUntil(backend, messages, lambda message: message.getTypeName() == "cura.proto.Progress")
+    backend._stopSlicing()
+    startSlice(backend, {}, [(unique_vertices, indices), (vertices, None)])
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+
+    # The engine that sliced the cancelled slice rebuilt exactly the same faces from the indexed mesh as from the flat one.
+    digest = hashlib.sha1(vertices.tobytes()).hexdigest()
+    assert process.poll() is None
+    assert getStandInOutput(backend) == [";PID:{0}".format(process.pid), ";SLICE:2", ";MESH:0:" + digest, ";MESH:1:" + digest]
+
+
+@pytest.mark.parametrize("standInEngine", [["--settings-delta"]], indirect = True)
+def test_settingsDelta(standInEngine):
+    backend, messages, process = standInEngine
+    mesh = (numpy.zeros((3, 3), numpy.float32), None)
+    receiveUntil(backend, messages, lambda message: message.getTypeName() == "cura.proto.EngineFeatures")
+    assert backend._engine_settings_delta
+
+    startSlice(backend, { "layer_height": 0.2, "infill_sparse_density": 20 }, [mesh])
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+    backend._scene.gcode_list = []
+    startSlice(backend, { "layer_height": 0.1 }, [mesh], base_generation = backend._settings_generation)
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+
+    # The engine applied the change on top of the settings it had.
+    assert getStandInOutput(backend)[2:4] == [";SETTING:infill_sparse_density=20", ";SETTING:layer_height=0.1"]
+
+
+@pytest.mark.parametrize("standInEngine", [["--settings-delta"]], indirect = True)
+def test_settingsDeltaResync(standInEngine):
+    backend, messages, process = standInEngine
+    receiveUntil(backend, messages, lambda message: message.getTypeName() == "cura.proto.EngineFeatures")
+    slices = []
+    backend.slice = lambda: slices.append(backend._sent_settings)
+
+    # Changes to settings that the engine never got.
+    startSlice(backend, { "layer_height": 0.1 }, [(numpy.zeros((3, 3), numpy.float32), None)], base_generation = 100)
+    receiveUntil(backend, messages, lambda message: message.getTypeName() == "cura.proto.SettingsResync")
+
+    # The slice is started again, with all settings.
+    assert slices == [None]
+    assert process.poll() is None
+
+
+def test_noSettingsDeltaWithoutEngineSupport(standInEngine):
+    backend, messages, process = standInEngine
+    mesh = (numpy.zeros((3, 3), numpy.float32), None)
+
+    startSlice(backend, { "layer_height": 0.2 }, [mesh])
+    receiveUntil(backend, messages, lambda message: not backend._slicing)
+
+    # An engine that doesn't report any features never gets only the changed settings.
+    assert not backend._engine_settings_delta
+    backend._engine_settings_delta = True
+    backend._onBackendConnected()
+    assert not backend._engine_settings_delta
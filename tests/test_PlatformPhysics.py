@@ -0,0 +1,79 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+from unittest.mock import MagicMock
+
+import numpy
+import pytest
+
+pytest.importorskip("UM")
+pytest.importorskip("PyQt5")
+
+from UM.Math.AxisAlignedBox import AxisAlignedBox
+from UM.Math.Polygon import Polygon
+from UM.Math.Vector import Vector
+from UM.Scene.SceneNode import SceneNode
+
+from cura.ConvexHullBroadPhase import ConvexHullBroadPhase
+from cura.ConvexHullDecorator import ConvexHullDecorator
+from cura.PlatformPhysics import PlatformPhysics
+
+
+##  Create a physics instance for a scene, without the timer and signals that
+#   need a running application.
+def createPhysics(root):
+    physics = PlatformPhysics.__new__(PlatformPhysics)
+    physics._controller = MagicMock()
+    physics._controller.getScene.return_value.getRoot.return_value = root
+    physics._build_volume = MagicMock()
+    physics._build_volume.getBoundingBox.return_value = AxisAlignedBox(minimum = Vector(-100, 0, -100), maximum = Vector(100, 100, 100))
+    physics._build_volume.getDisallowedAreas.return_value = []
+    physics._enabled = True
+    physics._broad_phase = ConvexHullBroadPhase()
+    physics._change_timer = MagicMock()
+    return physics
+
+
+##  Add a node that stands on the build plate, with the given hulls.
+def createNode(root, hull, head_hull = None):
+    node = SceneNode(root)
+    node.getBoundingBox = lambda: AxisAlignedBox(minimum = Vector(-5, 0, -5), maximum = Vector(5, 10, 5))
+    decorator = ConvexHullDecorator()
+    node.addDecorator(decorator)
+    decorator.setConvexHull(hull)
+    if head_hull is not None:
+        decorator.setConvexHullHead(head_hull)
+    decorator.setConvexHullJob(MagicMock()) # Don't start a job for a hull that seems missing.
+    return node
+
+
+def squareHull():
+    return Polygon(numpy.array([[-5, -5], [-5, 5], [5, 5], [5, -5]], numpy.float32))
+
+
+def emptyHull():
+    return Polygon(numpy.zeros((0, 2), numpy.float32))
+
+
+def test_degenerateHull():
+    root = SceneNode()
+    node = createNode(root, squareHull())
+    degenerate_node = createNode(root, emptyHull())
+    physics = createPhysics(root)
+
+    physics._onChangeTimerFinished()
+
+    assert node in physics._broad_phase
+    assert degenerate_node not in physics._broad_phase
+
+
+def test_degenerateHeadHull():
+    root = SceneNode()
+    node = createNode(root, squareHull())
+    degenerate_node = createNode(root, squareHull(), emptyHull())
+    physics = createPhysics(root)
+
+    physics._onChangeTimerFinished()
+
+    assert node in physics._broad_phase
+    assert degenerate_node not in physics._broad_phase
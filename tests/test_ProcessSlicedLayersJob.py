@@ -0,0 +1,159 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+import unittest.mock
+
+import numpy
+import pytest
+
+pytest.importorskip("UM")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+
+from CuraEngineBackend import ProcessSlicedLayersJob
+from cura import Layer
+
+
+##  Create the polygons of a layer as the engine sends them.
+def createPolygons(seed, count):
+    random = numpy.random.RandomState(seed)
+    polygons = []
+    for index in range(count):
+        points = random.randint(-200000, 200000, size = 2 * random.randint(0, 20)).astype("i8")
+        polygons.append((index % 10, points.tobytes(), float(random.randint(100, 800))))
+    return polygons
+
+
+##  Decode a layer one polygon at a time, the way layers were decoded before
+#   all polygons of a layer were decoded in one go.
+def createReferenceLayer(layer_number, height, thickness, polygons):
+    layer = Layer.Layer(layer_number)
+    layer.setHeight(height)
+    layer.setThickness(thickness)
+    for polygon_type, data, line_width in polygons:
+        points = numpy.frombuffer(data, dtype = "i8").reshape((-1, 2))
+        new_points = numpy.empty((len(points), 3), numpy.float32)
+        new_points[:, 0] = points[:, 0]
+        new_points[:, 1] = height
+        new_points[:, 2] = -points[:, 1]
+        new_points /= 1000
+        layer.addPolygon(polygon_type, new_points, line_width)
+    layer.build()
+    return layer
+
+
+def assertSameLayer(layer, other):
+    assert layer.getPoints().tobytes() == other.getPoints().tobytes()
+    assert numpy.array_equal(layer.getPolygonOffsets(), other.getPolygonOffsets())
+    assert numpy.array_equal(layer.getPolygonTypes(), other.getPolygonTypes())
+    assert numpy.array_equal(layer.getLineWidths(), other.getLineWidths())
+    for buffer, other_buffer in zip(layer.getBuffers(), other.getBuffers()):
+        assert buffer.tobytes() == other_buffer.tobytes()
+    assert layer.elementCount == other.elementCount
+
+
+def test_processLayer():
+    polygons = createPolygons(1, 200)
+
+    layer_number, layer = ProcessSlicedLayersJob._processLayer(3, 0.6, 0.2, polygons)
+
+    assert layer_number == 3
+    assertSameLayer(layer, createReferenceLayer(3, 0.6, 0.2, polygons))
+
+
+def test_processEmptyLayer():
+    _, layer = ProcessSlicedLayersJob._processLayer(0, 0.2, 0.2, [])
+
+    assertSameLayer(layer, createReferenceLayer(0, 0.2, 0.2, []))
+
+
+def test_processSplitLayer():
+    # The engine may send the polygons of one layer in several messages.
+    polygons = createPolygons(2, 100)
+
+    _, layer = ProcessSlicedLayersJob._processLayer(5, 1.0, 0.2, polygons[:40])
+    _, other_part = ProcessSlicedLayersJob._processLayer(5, 1.0, 0.2, polygons[40:])
+    layer.addPolygonsOf(other_part)
+
+    assertSameLayer(layer, createReferenceLayer(5, 1.0, 0.2, polygons))
+
+
+##  Stand-in for a polygon in a layer message of the engine.
+class FakePolygon:
+    def __init__(self, polygon_type, points, line_width):
+        self.type = polygon_type
+        self.points = points
+        self.line_width = line_width
+
+
+##  Stand-in for a layer message of the engine.
+class FakeLayerMessage:
+    def __init__(self, layer_id, polygons):
+        self.id = layer_id
+        self.height = 0.2 * (layer_id + 1)
+        self.thickness = 0.2
+        self._polygons = [FakePolygon(*polygon) for polygon in polygons]
+
+    def repeatedMessageCount(self, name):
+        return len(self._polygons)
+
+    def getRepeatedMessage(self, name, index):
+        return self._polygons[index]
+
+
+##  Create a job outside of the application, that records when it is put in
+#   the job queue and what layer data it shows.
+@pytest.fixture
+def streamingJob(monkeypatch):
+    monkeypatch.setattr(ProcessSlicedLayersJob, "Application", unittest.mock.MagicMock())
+    monkeypatch.setattr(ProcessSlicedLayersJob, "DepthFirstIterator", lambda root: [])
+    starts = []
+    monkeypatch.setattr(ProcessSlicedLayersJob.Job, "start", lambda job: starts.append(job))
+    job = ProcessSlicedLayersJob.ProcessSlicedLayersJob([FakeLayerMessage(0, createPolygons(3, 10))])
+    job.shown_layer_data = []
+    job._showLayerData = job.shown_layer_data.append
+    return job, starts
+
+
+def test_streamingJobWaitsOutsideJobQueue(streamingJob):
+    job, starts = streamingJob
+    job.start()
+    assert len(starts) == 1
+
+    # Without more layers the job stops running instead of waiting in its thread.
+    job.run()
+    assert len(starts) == 1
+    assert not job.shown_layer_data or len(job.shown_layer_data[-1].getLayers()) == 1
+
+    # A new layer puts it in the queue again, once.
+    job.addLayer(FakeLayerMessage(1, createPolygons(4, 10)))
+    job.addLayer(FakeLayerMessage(2, createPolygons(5, 10)))
+    assert len(starts) == 2
+    job.run()
+
+    job.finishLayers()
+    assert len(starts) == 3
+    job.run()
+
+    layer_data = job.shown_layer_data[-1]
+    assert sorted(layer_data.getLayers()) == [0, 1, 2]
+
+    # Once done, the job isn't started again.
+    job.abort()
+    assert len(starts) == 3
+
+
+def test_abortWaitingStreamingJob(streamingJob):
+    job, starts = streamingJob
+    job.start()
+    job.run()
+    aborted = []
+    job._onAborted = lambda: aborted.append(True)
+
+    job.abort()
+    assert len(starts) == 2 # The job must run to clean up.
+    job.run()
+
+    assert aborted
@@ -0,0 +1,105 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import pickle
+import sys
+
+import pytest
+
+pytest.importorskip("UM")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+
+from CuraEngineBackend import SliceCache
+
+
+def createResult():
+    layers = [
+        SliceCache.CachedLayer(-1, 0.2, 0.2, [(1, b"\x01" * 32, 0.4)]),
+        SliceCache.CachedLayer(0, 0.4, 0.2, [(2, b"\x02" * 16, 0.4), (3, b"", 0.35)])
+    ]
+    result = SliceCache.SliceResult([";FLAVOR:UltiGCode\n", "G1 X1\n"], layers, [(100, 1.5)])
+    result.compact()
+    return result
+
+
+def test_serialiseRoundTrip():
+    result = createResult()
+
+    loaded = SliceCache.SliceResult.deserialise(result.serialise())
+
+    assert loaded.getGCodeList() == result.getGCodeList()
+    assert loaded.getPrintTimes() == result.getPrintTimes()
+    assert [(layer.id, layer.height, layer.thickness, layer.getPolygonData()) for layer in loaded.getLayers()] == [(layer.id, layer.height, layer.thickness, layer.getPolygonData()) for layer in result.getLayers()]
+    assert loaded.getSize() == result.getSize()
+
+
+def test_deserialisePickle():
+    # Files of older versions of the cache are not read, and pickles are never loaded.
+    data = pickle.dumps({ "version": SliceCache.SliceCache.version, "gcode": [], "layers": [], "print_times": [] })
+
+    assert SliceCache.SliceResult.deserialise(data) is None
+
+
+def test_deserialiseTruncated():
+    data = createResult().serialise()
+
+    with pytest.raises(ValueError):
+        SliceCache.SliceResult.deserialise(data[:-1])
+
+
+##  Stand-in for a polygon in a layer message of the engine.
+class FakePolygon:
+    def __init__(self, polygon_type, points, line_width):
+        self.type = polygon_type
+        self.points = points
+        self.line_width = line_width
+
+
+##  Stand-in for a layer message of the engine.
+class FakeLayerMessage:
+    def __init__(self, layer):
+        self.id = layer.id
+        self.height = layer.height
+        self.thickness = layer.thickness
+        self._polygons = [FakePolygon(*polygon) for polygon in layer.getPolygonData()]
+
+    def repeatedMessageCount(self, name):
+        return len(self._polygons)
+
+    def getRepeatedMessage(self, name, index):
+        return self._polygons[index]
+
+
+def test_compactMessages():
+    cached = createResult()
+    result = SliceCache.SliceResult(cached.getGCodeList(), [FakeLayerMessage(layer) for layer in cached.getLayers()], cached.getPrintTimes())
+
+    result.compact()
+
+    assert [SliceCache.readLayerMessage(layer) for layer in result.getLayers()] == [SliceCache.readLayerMessage(layer) for layer in cached.getLayers()]
+    assert result.getSize() == cached.getSize()
+
+
+def test_noDiskCache(tmpdir):
+    path = os.path.join(str(tmpdir), "slice_cache")
+    cache = SliceCache.SliceCache(1024 * 1024, 0, path)
+
+    cache._store("key", createResult())
+
+    assert cache.get("key") is not None # Still kept in memory.
+    assert not os.path.exists(path)
+
+
+def test_diskCache(tmpdir):
+    path = os.path.join(str(tmpdir), "slice_cache")
+    cache = SliceCache.SliceCache(1024 * 1024, 1024 * 1024, path)
+    result = createResult()
+    cache._store("key", result)
+
+    cache = SliceCache.SliceCache(1024 * 1024, 1024 * 1024, path)
+
+    assert cache.get("key").getGCodeList() == result.getGCodeList()
+    cache.setDiskSize(0)
+    assert os.listdir(path) == []
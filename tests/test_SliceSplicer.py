@@ -0,0 +1,149 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("UM")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+
+from CuraEngineBackend import SliceCache
+from CuraEngineBackend import SliceSplicer
+
+StartGCode = "G28 ;Home\nG92 E0\n"
+EndGCode = "M104 S0\nG28 X0\n"
+
+
+##  Create the result of a group, as the engine would send it.
+#
+#   \param moves The g-code of the layers of the group.
+#   \param height The height of the group, in micrometres.
+def createGroupResult(moves, height = 10000):
+    gcode_list = [";FLAVOR:RepRap\n;TIME:100\n", StartGCode, ";LAYER:0\nM107\n" + moves, EndGCode]
+    return SliceCache.SliceResult(gcode_list, [SliceCache.CachedLayer(0, height, 200, [])], [(100, 1.0)])
+
+
+def splice(results, retraction_amount = 6.5):
+    return SliceSplicer.spliceGroupResults(results, StartGCode, EndGCode, 150, 200, retraction_amount, 25, 25)
+
+
+##  Get the g-code between the end of the first group and the start of the
+#   second group.
+def getHandOver(result):
+    gcode = "".join(result.getGCodeList())
+    return gcode[gcode.index(";Next group"):gcode.index(";LAYER:0", gcode.index(";Next group"))]
+
+
+def test_travelAboveGroupsBeforeLowering():
+    first = createGroupResult("G0 F9000 X10 Y10 Z0.3\nG1 F1200 X20 Y10 E1.5\n", height = 20000)
+    second = createGroupResult("G0 F9000 X100.5 Y50 Z0.3\nG1 F1200 X110 Y50 E1.2\n")
+
+    result = splice([first, second])
+    handover = getHandOver(result).split("\n")
+
+    # Up first, then to the first position of the next group at that height, so the next group only goes down.
+    assert handover.index("G0 F9000 Z25.000") < handover.index("G0 F9000 X100.500 Y50.000")
+    gcode = "".join(result.getGCodeList())
+    assert gcode.index("G0 F9000 X100.500 Y50.000") < gcode.index("G0 F9000 X100.5 Y50 Z0.3")
+    assert "M107" in handover
+    assert gcode.count(StartGCode) == 1
+    assert gcode.count(EndGCode) == 1
+
+
+def test_retractAndPrimeAroundTravel():
+    first = createGroupResult("G0 X10 Y10 Z0.3\nG1 X20 Y10 E1.5\n")
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    handover = getHandOver(splice([first, second])).split("\n")
+
+    assert handover.index("G92 E0") < handover.index("G1 F1500 E-6.50000") < handover.index("G0 F9000 Z15.000")
+    assert handover.index("G0 F9000 X100.000 Y50.000") < handover.index("G1 F1500 E0")
+
+
+def test_primeAfterRetractedGroup():
+    first = createGroupResult("G0 X10 Y10 Z0.3\nG1 X20 Y10 E11.5\nG1 F1500 E7\n")
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    handover = getHandOver(splice([first, second])).split("\n")
+
+    # Already retracted, so only prime over the distance that the group retracted.
+    assert "G92 E-4.50000" in handover
+    assert not any(line.startswith("G1") and "E-" in line for line in handover)
+    assert handover[-2] == "G1 F1500 E0"
+
+
+def test_firmwareRetraction():
+    first = createGroupResult("G0 X10 Y10 Z0.3\nG1 X20 Y10 E1.5\nG10\n")
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    handover = getHandOver(splice([first, second])).split("\n")
+
+    assert "G10" not in handover
+    assert handover[-2] == "G11"
+
+
+def test_noRetraction():
+    first = createGroupResult("G0 X10 Y10 Z0.3\nG1 X20 Y10 E1.5\n")
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    handover = getHandOver(splice([first, second], retraction_amount = 0)).split("\n")
+
+    assert not any(line.startswith("G1") for line in handover)
+
+
+def test_firstMoveWithoutPosition():
+    first = createGroupResult("G0 X10 Y10 Z0.3\n")
+    second = createGroupResult("G0 Z0.3\nG0 X100 Y50\n")
+
+    # It's unknown where the nozzle would go down, so the groups are not joined.
+    assert splice([first, second]) is None
+
+
+def test_relativeExtrusion():
+    start_gcode = "G28 ;Home\nM83\n"
+    first = SliceCache.SliceResult([start_gcode, ";LAYER:0\nG0 X10 Y10 Z0.3\nG1 X20 Y10 E1.5\n", EndGCode], [SliceCache.CachedLayer(0, 10000, 200, [])], [(100, 1.0)])
+    second = SliceCache.SliceResult([start_gcode, ";LAYER:0\nG0 X100 Y50 Z0.3\n", EndGCode], [SliceCache.CachedLayer(0, 10000, 200, [])], [(100, 1.0)])
+
+    result = SliceSplicer.spliceGroupResults([first, second], start_gcode, EndGCode, 150, 200, 6.5, 25, 25)
+    handover = getHandOver(result).split("\n")
+
+    # The extruder position is relative, so retract and prime by the distance instead of to a position.
+    assert not any(line.startswith("G92") for line in handover)
+    assert handover.index("G1 F1500 E-6.50000") < handover.index("G0 F9000 X100.000 Y50.000") < handover.index("G1 F1500 E6.50000")
+
+
+def test_relativeExtrusionRetractedGroup():
+    start_gcode = "G28 ;Home\nM83\n"
+    first = SliceCache.SliceResult([start_gcode, ";LAYER:0\nG0 X10 Y10 Z0.3\nG1 X20 Y10 E1.5\nG1 F1500 E-4.5\n", EndGCode], [SliceCache.CachedLayer(0, 10000, 200, [])], [(100, 1.0)])
+    second = SliceCache.SliceResult([start_gcode, ";LAYER:0\nG0 X100 Y50 Z0.3\n", EndGCode], [SliceCache.CachedLayer(0, 10000, 200, [])], [(100, 1.0)])
+
+    handover = getHandOver(SliceSplicer.spliceGroupResults([first, second], start_gcode, EndGCode, 150, 200, 6.5, 25, 25)).split("\n")
+
+    assert not any("E-" in line for line in handover)
+    assert handover[-2] == "G1 F1500 E4.50000"
+
+
+def test_startGCodeNotFound():
+    first = createGroupResult("G0 X10 Y10 Z0.3\n")
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    # The start g-code that was sent doesn't match what the engine wrote, so it's unclear where the groups start.
+    assert SliceSplicer.spliceGroupResults([first, second], "G28 X0 Y0\n", EndGCode, 150, 200, 6.5, 25, 25) is None
+
+
+def test_startGCodeInGroupTwice():
+    first = createGroupResult("G0 X10 Y10 Z0.3\n" + StartGCode)
+    second = createGroupResult("G0 X100 Y50 Z0.3\n")
+
+    assert splice([first, second]) is None
+
+
+def test_severalTools():
+    first = createGroupResult("T0\nG0 X10 Y10 Z0.3\nT1\nG0 X20 Y10\n")
+    second = createGroupResult("T0\nG0 X100 Y50 Z0.3\n")
+
+    # The state of every extruder would have to be handed over.
+    assert splice([first, second]) is None
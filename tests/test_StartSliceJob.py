@@ -0,0 +1,66 @@
+# Copyright (c) 2016 Ultimaker B.V.
+# Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+import numpy
+import pytest
+
+pytest.importorskip("UM")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
+
+from CuraEngineBackend import StartSliceJob
+
+
+##  Check that the welded vertices and indices rebuild exactly the vertices
+#   of the faces, bit for bit.
+def checkWelded(vertices):
+    unique_vertices, indices = StartSliceJob.weldVertices(vertices)
+
+    assert indices.dtype == numpy.int32
+    assert indices.shape == (len(vertices),)
+    rebuilt = unique_vertices[indices]
+    assert rebuilt.dtype == vertices.dtype
+    assert rebuilt.tobytes() == vertices.tobytes()
+    return unique_vertices, indices
+
+
+def test_weldCube():
+    corners = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], numpy.float32)
+    faces = [(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1), (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)]
+    vertices = corners[numpy.array(faces).reshape(-1)]
+
+    unique_vertices, _ = checkWelded(vertices)
+
+    assert len(unique_vertices) == 8
+
+
+def test_weldNoSharedVertices():
+    vertices = numpy.random.RandomState(0).uniform(-100, 100, (300, 3)).astype(numpy.float32)
+
+    unique_vertices, _ = checkWelded(vertices)
+
+    assert len(unique_vertices) == 300
+
+
+def test_weldDegenerateMesh():
+    vertices = numpy.array([
+        [1, 2, 3], [1, 2, 3], [1, 2, 3], # All corners the same.
+        [0, 0, 0], [1, 0, 0], [2, 0, 0], # All corners on one line.
+        [0.0, 0, 0], [-0.0, 0, 0], [0, 1, 0], # Zero and negative zero are different bits, so they are not welded.
+        [numpy.nan, 0, 0], [numpy.nan, 0, 0], [numpy.inf, 0, 0]
+    ], numpy.float32)
+
+    unique_vertices, indices = checkWelded(vertices)
+
+    assert indices[0] == indices[1] == indices[2]
+    assert indices[6] != indices[7]
+    assert indices[9] == indices[10] # The same NaN bits.
+
+
+def test_weldEmptyMesh():
+    unique_vertices, indices = checkWelded(numpy.zeros((0, 3), numpy.float32))
+
+    assert len(unique_vertices) == 0